@@ -0,0 +1,546 @@
+"""
+Instantánea analítica en Parquet (fuera de la base de datos de producción)
+
+Cada noche se vuelcan a Parquet, particionados por campaña y mes:
+
+- stays: stays ⋈ vehicles ⋈ parking_spots (una fila por estancia)
+- cash_transactions
+
+    ANALYTICS_DIR/snapshot_<ts>/stays/campaign=2025-2026/month=2025-10/part-0.parquet
+    ANALYTICS_DIR/CURRENT   <- nombre de la última instantánea completa
+
+Los informes de este módulo responden con el mismo formato que las
+funciones de analytics de crud, pero leyendo la instantánea (solo las
+particiones y columnas necesarias), así que los informes de varias
+temporadas no tocan PostgreSQL en horas de check-in.
+
+Uso:
+    python3 -m app.analytics_snapshot              # crear instantánea (cron)
+    python3 -m app.analytics_snapshot --report revenue-timeline --campaign 2024/2025
+"""
+
+import argparse
+import enum
+import json
+import math
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from app import models
+from app.utils import (
+    get_current_campaign_dates, get_campaign_year, get_campaign_dates, parse_campaign_name
+)
+
+MADRID = ZoneInfo("Europe/Madrid")
+
+ANALYTICS_DIR = Path(os.getenv("ANALYTICS_DIR", "/app/backups/analytics"))
+SNAPSHOT_CHUNK_SIZE = 10000  # Filas por lote leídas de la BD / por row group
+KEEP_SNAPSHOTS = 2           # La anterior se conserva para lectores en curso
+
+MONTH_NAMES = [
+    "Ene", "Feb", "Mar", "Abr", "May", "Jun",
+    "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"
+]
+DAY_NAMES = ["Dom", "Lun", "Mar", "Mié", "Jue", "Vie", "Sáb"]
+
+
+def _campaign_partition(day) -> str:
+    """Fecha -> carpeta de campaña ('2025-2026')"""
+    campaign_year = get_campaign_year(day)
+    return f"{campaign_year}-{campaign_year + 1}"
+
+
+# ============================================================================
+# ESCRITURA DE LA INSTANTÁNEA
+# ============================================================================
+
+def _stays_table():
+    import pyarrow as pa
+
+    Stay = models.Stay
+    columns = [
+        ("stay_id", Stay.id, pa.int64()),
+        ("vehicle_id", Stay.vehicle_id, pa.int64()),
+        ("license_plate", models.Vehicle.license_plate, pa.string()),
+        ("country", models.Vehicle.country, pa.string()),
+        ("vehicle_type", models.Vehicle.vehicle_type, pa.string()),
+        ("is_rental", models.Vehicle.is_rental, pa.bool_()),
+        ("spot_type", models.ParkingSpot.spot_type, pa.string()),
+        ("spot_number", models.ParkingSpot.spot_number, pa.string()),
+        ("detection_time", Stay.detection_time, pa.timestamp("us", tz="Europe/Madrid")),
+        ("check_in_time", Stay.check_in_time, pa.timestamp("us", tz="Europe/Madrid")),
+        ("check_out_time", Stay.check_out_time, pa.timestamp("us", tz="Europe/Madrid")),
+        ("status", Stay.status, pa.string()),
+        ("payment_status", Stay.payment_status, pa.string()),
+        ("payment_method", Stay.payment_method, pa.string()),
+        ("final_price", Stay.final_price, pa.float64()),
+        ("amount_paid", Stay.amount_paid, pa.float64()),
+        ("prepaid_amount", Stay.prepaid_amount, pa.float64()),
+    ]
+
+    def query(db):
+        return db.query(*[c for _, c, _ in columns]).join(
+            models.Vehicle, Stay.vehicle_id == models.Vehicle.id
+        ).outerjoin(
+            models.ParkingSpot, Stay.parking_spot_id == models.ParkingSpot.id
+        ).order_by(Stay.id)
+
+    def partition_time(row):
+        return row.check_out_time or row.check_in_time or row.detection_time
+
+    return "stays", columns, query, partition_time
+
+
+def _cash_transactions_table():
+    import pyarrow as pa
+
+    CashTransaction = models.CashTransaction
+    columns = [
+        ("transaction_id", CashTransaction.id, pa.int64()),
+        ("cash_session_id", CashTransaction.cash_session_id, pa.int64()),
+        ("timestamp", CashTransaction.timestamp, pa.timestamp("us", tz="Europe/Madrid")),
+        ("transaction_type", CashTransaction.transaction_type, pa.string()),
+        ("stay_id", CashTransaction.stay_id, pa.int64()),
+        ("amount_due", CashTransaction.amount_due, pa.float64()),
+        ("amount_paid", CashTransaction.amount_paid, pa.float64()),
+        ("change_given", CashTransaction.change_given, pa.float64()),
+        ("payment_method", CashTransaction.payment_method, pa.string()),
+        ("user_id", CashTransaction.user_id, pa.int64()),
+    ]
+
+    def query(db):
+        return db.query(*[c for _, c, _ in columns]).order_by(CashTransaction.id)
+
+    def partition_time(row):
+        return row.timestamp
+
+    return "cash_transactions", columns, query, partition_time
+
+
+class _PartitionedWriter:
+    """Un ParquetWriter por partición campaña/mes, con búfer de filas"""
+
+    def __init__(self, root: Path, schema):
+        self.root = root
+        self.schema = schema
+        self._writers = {}
+        self._buffers = {}
+        self.rows = 0
+
+    def append(self, partition, values):
+        buffer = self._buffers.setdefault(partition, [])
+        buffer.append(values)
+        if len(buffer) >= SNAPSHOT_CHUNK_SIZE:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = self._buffers.pop(partition, None)
+        if not buffer:
+            return
+
+        writer = self._writers.get(partition)
+        if writer is None:
+            campaign, month = partition
+            directory = self.root / f"campaign={campaign}" / f"month={month}"
+            directory.mkdir(parents=True, exist_ok=True)
+            writer = pq.ParquetWriter(directory / "part-0.parquet", self.schema, compression="zstd")
+            self._writers[partition] = writer
+
+        columns = list(zip(*buffer))
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+        self.rows += len(buffer)
+
+    def close(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for writer in self._writers.values():
+            writer.close()
+        return len(self._writers)
+
+
+TABLES = {
+    "stays": _stays_table,
+    "cash_transactions": _cash_transactions_table,
+}
+
+
+def _table_schema(table):
+    import pyarrow as pa
+
+    _, columns, _, _ = table
+    return pa.schema([pa.field(label, arrow_type) for label, _, arrow_type in columns])
+
+
+def _write_table(db, snapshot_dir: Path, table) -> dict:
+    name, _, query, partition_time = table
+    writer = _PartitionedWriter(snapshot_dir / name, _table_schema(table))
+
+    try:
+        for row in query(db).yield_per(SNAPSHOT_CHUNK_SIZE):
+            when = partition_time(row)
+            if when is None:
+                continue
+            if when.tzinfo is not None:
+                when = when.astimezone(MADRID)
+            values = [
+                value.value if isinstance(value, enum.Enum) else value
+                for value in row
+            ]
+            writer.append((_campaign_partition(when), when.strftime("%Y-%m")), values)
+    finally:
+        partitions = writer.close()
+
+    return {"rows": writer.rows, "partitions": partitions}
+
+
+def current_snapshot_dir() -> Optional[Path]:
+    """Carpeta de la última instantánea completa (None si aún no hay)"""
+    pointer = ANALYTICS_DIR / "CURRENT"
+    if not pointer.exists():
+        return None
+    snapshot_dir = ANALYTICS_DIR / pointer.read_text().strip()
+    return snapshot_dir if snapshot_dir.exists() else None
+
+
+def create_snapshot() -> Path:
+    """
+    Vuelca stays y cash_transactions a una carpeta nueva y, al terminar,
+    la publica en CURRENT (los lectores nunca ven una instantánea a medias).
+    """
+    from app.database import AnalyticsSessionLocal
+
+    ANALYTICS_DIR.mkdir(parents=True, exist_ok=True)
+    started = datetime.now(MADRID)
+    snapshot_dir = ANALYTICS_DIR / f"snapshot_{started.strftime('%Y%m%d_%H%M%S')}"
+    snapshot_dir.mkdir()
+
+    db = AnalyticsSessionLocal()  # statement_timeout de analytics, no el de recepción
+    try:
+        tables = {}
+        for name, table in TABLES.items():
+            tables[name] = _write_table(db, snapshot_dir, table())
+            print(f"✓ {name}: {tables[name]['rows']} filas en {tables[name]['partitions']} particiones")
+    except Exception:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        raise
+    finally:
+        db.close()
+
+    (snapshot_dir / "snapshot.json").write_text(json.dumps({
+        "created_at": started.isoformat(),
+        "tables": tables
+    }, indent=2))
+
+    pointer_tmp = ANALYTICS_DIR / "CURRENT.tmp"
+    pointer_tmp.write_text(snapshot_dir.name)
+    pointer_tmp.replace(ANALYTICS_DIR / "CURRENT")
+
+    # Borrar instantáneas antiguas
+    snapshots = sorted(ANALYTICS_DIR.glob("snapshot_*"))
+    for old in snapshots[:-KEEP_SNAPSHOTS]:
+        shutil.rmtree(old, ignore_errors=True)
+
+    print(f"✓ Instantánea publicada: {snapshot_dir}")
+    return snapshot_dir
+
+
+# ============================================================================
+# CAPA DE CONSULTA
+# ============================================================================
+
+class SnapshotNotAvailable(Exception):
+    pass
+
+
+def _resolve_campaign(campaign: Optional[str]):
+    """None -> campaña actual; '2024/2025' -> fechas de esa campaña"""
+    if campaign is None:
+        return get_current_campaign_dates()
+    return get_campaign_dates(parse_campaign_name(campaign))
+
+
+def _campaign_bounds(campaign: Optional[str]):
+    dates = _resolve_campaign(campaign)
+    start = datetime.combine(dates["start_date"], datetime.min.time()).replace(tzinfo=MADRID)
+    end = datetime.combine(dates["end_date"], datetime.max.time()).replace(tzinfo=MADRID)
+    return dates, start, end
+
+
+def load_table(name: str, columns, campaigns=None):
+    """
+    DataFrame con las columnas pedidas de la instantánea actual.
+    campaigns limita las particiones leídas (['2024/2025', ...]).
+    """
+    import pyarrow.parquet as pq
+
+    snapshot_dir = current_snapshot_dir()
+    if snapshot_dir is None:
+        raise SnapshotNotAvailable("No hay instantánea analítica; ejecutar app.analytics_snapshot")
+
+    if not (snapshot_dir / name).exists():
+        # Tabla sin filas: sin particiones, pero con sus tipos
+        schema = _table_schema(TABLES[name]())
+        return schema.empty_table().select(list(columns)).to_pandas()
+
+    filters = None
+    if campaigns:
+        names = [
+            f"{year}-{year + 1}" for year in (parse_campaign_name(c) for c in campaigns)
+        ]
+        filters = [("campaign", "in", names)]
+
+    table = pq.read_table(
+        snapshot_dir / name, columns=list(columns), filters=filters, partitioning="hive"
+    )
+    return table.to_pandas()
+
+
+def list_campaigns():
+    """Campañas presentes en la instantánea, de más antigua a más reciente"""
+    snapshot_dir = current_snapshot_dir()
+    if snapshot_dir is None:
+        raise SnapshotNotAvailable("No hay instantánea analítica; ejecutar app.analytics_snapshot")
+    return sorted(
+        p.name.split("=", 1)[1].replace("-", "/")
+        for p in (snapshot_dir / "stays").glob("campaign=*")
+    )
+
+
+def _completed_stays(columns, campaign=None, all_campaigns=False):
+    """
+    Estancias completadas con entrada y salida. Con campaña, solo las que
+    salen entre el 1 de septiembre y el 30 de junio (como crud).
+    """
+    wanted = {"status", "check_in_time", "check_out_time", *columns}
+    if all_campaigns:
+        df = load_table("stays", wanted)
+    else:
+        dates, start, end = _campaign_bounds(campaign)
+        df = load_table("stays", wanted, [dates["campaign_name"]])
+        df = df[(df.check_out_time >= start) & (df.check_out_time <= end)]
+
+    return df[
+        (df.status == models.StayStatus.COMPLETED.value)
+        & df.check_in_time.notna()
+        & df.check_out_time.notna()
+    ]
+
+
+def _nights(df):
+    return (df.check_out_time - df.check_in_time).dt.total_seconds() / 86400
+
+
+def get_revenue_timeline(campaign: Optional[str] = None):
+    """Ingresos diarios de una campaña (actual por defecto)"""
+    dates, start, end = _campaign_bounds(campaign)
+    df = load_table("stays", ["status", "check_out_time", "final_price"], [dates["campaign_name"]])
+    df = df[
+        (df.status == models.StayStatus.COMPLETED.value)
+        & (df.check_out_time >= start) & (df.check_out_time <= end)
+        & df.final_price.notna()
+    ]
+    daily = df.groupby(df.check_out_time.dt.strftime("%Y-%m-%d")).final_price.sum().sort_index()
+    return [{"date": day, "revenue": float(revenue)} for day, revenue in daily.items()]
+
+
+def get_country_distribution_with_rentals(campaign: Optional[str] = None):
+    """Como crud.get_country_distribution_with_rentals; campaign=None -> histórico completo"""
+    df = _completed_stays(
+        ["country", "amount_paid", "is_rental"], campaign, all_campaigns=campaign is None
+    )
+    df = df[df.amount_paid.notna()].assign(nights=lambda d: _nights(d).apply(math.ceil))
+
+    by_country = []
+    countries = df[df.country.notna()].groupby("country").agg(
+        count=("nights", "size"),
+        revenue=("amount_paid", "sum"),
+        total_nights=("nights", "sum"),
+        rental_count=("is_rental", lambda s: int(s.fillna(False).sum()))
+    ).sort_values("count", ascending=False, kind="stable")
+    for country, r in countries.iterrows():
+        by_country.append({
+            "country": country or "Unknown",
+            "count": int(r["count"]),
+            "revenue": float(r.revenue),
+            "total_nights": int(r.total_nights),
+            "avg_nights": round(float(r.total_nights) / r["count"], 2) if r["count"] > 0 else 0,
+            "rental_count": int(r.rental_count)
+        })
+
+    rentals = df[df.is_rental.fillna(False).astype(bool)]
+    rental_count = len(rentals)
+    rental_nights = int(rentals.nights.sum())
+    return {
+        "by_country": by_country,
+        "rental_totals": {
+            "count": rental_count,
+            "revenue": float(rentals.amount_paid.sum()),
+            "total_nights": rental_nights,
+            "avg_nights": round(rental_nights / rental_count, 2) if rental_count > 0 else 0,
+            "rental_count": rental_count
+        }
+    }
+
+
+def get_monthly_comparison(months: int = 6, campaign: Optional[str] = None):
+    """
+    Ingresos por mes: los últimos 'months' meses (como crud) o,
+    con campaign, todos los meses de esa campaña.
+    """
+    if campaign is None:
+        cutoff = datetime.now(MADRID) - timedelta(days=months * 30)
+        df = load_table("stays", ["status", "check_out_time", "final_price"])
+        df = df[df.check_out_time >= cutoff]
+    else:
+        dates, start, end = _campaign_bounds(campaign)
+        df = load_table("stays", ["status", "check_out_time", "final_price"], [dates["campaign_name"]])
+        df = df[(df.check_out_time >= start) & (df.check_out_time <= end)]
+
+    df = df[(df.status == models.StayStatus.COMPLETED.value) & df.final_price.notna()]
+    monthly = df.groupby([df.check_out_time.dt.year, df.check_out_time.dt.month]).final_price.agg(
+        ["size", "sum"]
+    ).sort_index()
+
+    return [
+        {
+            "period": f"{MONTH_NAMES[int(month) - 1]} {int(year)}",
+            "count": int(r["size"]),
+            "revenue": float(r["sum"])
+        }
+        for (year, month), r in monthly.iterrows()
+    ]
+
+
+def get_total_nights(campaign: Optional[str] = None):
+    df = _completed_stays([], campaign)
+    total_nights = int(_nights(df).sum())
+    total_stays = len(df)
+    return {
+        "total_nights": total_nights,
+        "avg_nights_per_stay": round(total_nights / total_stays, 2) if total_stays > 0 else 0
+    }
+
+
+def get_nights_timeline(campaign: Optional[str] = None):
+    df = _completed_stays([], campaign)
+    daily = _nights(df).groupby(df.check_out_time.dt.strftime("%Y-%m-%d")).sum().sort_index()
+    return [{"date": day, "nights": int(nights)} for day, nights in daily.items()]
+
+
+def get_payment_methods_distribution(campaign: Optional[str] = None):
+    dates, start, end = _campaign_bounds(campaign)
+    df = load_table("stays", ["status", "payment_status", "check_out_time"], [dates["campaign_name"]])
+    df = df[
+        (df.status == models.StayStatus.COMPLETED.value)
+        & (df.check_out_time >= start) & (df.check_out_time <= end)
+    ]
+    counts = df.payment_status.value_counts()
+    return [
+        {"method": "Pago Adelantado", "count": int(counts.get(models.PaymentStatus.PREPAID.value, 0))},
+        {"method": "Pago Normal", "count": int(counts.get(models.PaymentStatus.PAID.value, 0))},
+        {"method": "SINPA", "count": int(counts.get(models.PaymentStatus.UNPAID.value, 0))}
+    ]
+
+
+def get_stay_length_distribution(campaign: Optional[str] = None):
+    df = _completed_stays([], campaign, all_campaigns=campaign is None)
+    nights = _nights(df).astype(int)
+    return [
+        {"category": "1 noche", "count": int((nights == 1).sum())},
+        {"category": "2 noches", "count": int((nights == 2).sum())},
+        {"category": "3-5 noches", "count": int(((nights >= 3) & (nights <= 5)).sum())},
+        {"category": "6+ noches", "count": int((nights >= 6).sum())}
+    ]
+
+
+def get_country_distribution(campaign: Optional[str] = None):
+    wanted = ["status", "country", "final_price"]
+    if campaign is None:
+        df = load_table("stays", wanted)
+    else:
+        dates, start, end = _campaign_bounds(campaign)
+        df = load_table("stays", wanted + ["check_out_time"], [dates["campaign_name"]])
+        df = df[(df.check_out_time >= start) & (df.check_out_time <= end)]
+
+    df = df[(df.status == models.StayStatus.COMPLETED.value) & df.country.notna()]
+    countries = df.groupby("country").final_price.agg(["size", "sum"]).sort_values(
+        "size", ascending=False, kind="stable"
+    )
+    return [
+        {"country": country or "Unknown", "count": int(r["size"]), "revenue": float(r["sum"])}
+        for country, r in countries.iterrows()
+    ]
+
+
+def get_weekday_distribution(campaign: Optional[str] = None):
+    campaigns = None if campaign is None else [_resolve_campaign(campaign)["campaign_name"]]
+    df = load_table("stays", ["check_in_time"], campaigns)
+    # pandas: lunes = 0; crud (extract dow): domingo = 0
+    weekdays = ((df.check_in_time.dropna().dt.dayofweek + 1) % 7).value_counts().sort_index()
+    return [{"day": DAY_NAMES[int(day)], "count": int(count)} for day, count in weekdays.items()]
+
+
+def get_peak_hours(campaign: Optional[str] = None):
+    campaigns = None if campaign is None else [_resolve_campaign(campaign)["campaign_name"]]
+    df = load_table("stays", ["check_in_time"], campaigns)
+    hours = df.check_in_time.dropna().dt.hour.value_counts().sort_index()
+    return [{"hour": int(hour), "count": int(count)} for hour, count in hours.items()]
+
+
+def get_cash_revenue_by_method(campaign: Optional[str] = None):
+    """Cobros (checkout + prepago) por método de pago desde las transacciones de caja"""
+    dates, start, end = _campaign_bounds(campaign)
+    df = load_table(
+        "cash_transactions", ["timestamp", "transaction_type", "payment_method", "amount_paid"],
+        [dates["campaign_name"]]
+    )
+    df = df[
+        df.transaction_type.isin([
+            models.TransactionType.CHECKOUT.value, models.TransactionType.PREPAYMENT.value
+        ])
+        & (df.timestamp >= start) & (df.timestamp <= end)
+    ]
+    totals = df.groupby("payment_method").amount_paid.sum()
+    return {
+        "campaign_name": dates["campaign_name"],
+        "total": float(totals.sum()),
+        "by_method": {method: float(amount) for method, amount in totals.items()}
+    }
+
+
+# Nombre del informe (API/CLI) -> función
+REPORTS = {
+    "revenue-timeline": get_revenue_timeline,
+    "country-distribution": get_country_distribution,
+    "country-distribution-with-rentals": get_country_distribution_with_rentals,
+    "monthly-comparison": get_monthly_comparison,
+    "total-nights": get_total_nights,
+    "nights-timeline": get_nights_timeline,
+    "payment-methods": get_payment_methods_distribution,
+    "stay-length-distribution": get_stay_length_distribution,
+    "weekday-distribution": get_weekday_distribution,
+    "peak-hours": get_peak_hours,
+    "cash-revenue": get_cash_revenue_by_method,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Instantánea analítica en Parquet")
+    parser.add_argument("--report", choices=sorted(REPORTS), help="Consultar un informe en vez de crear la instantánea")
+    parser.add_argument("--campaign", help="Campaña, p.ej. 2024/2025 (por defecto la actual)")
+    args = parser.parse_args()
+
+    if args.report:
+        print(json.dumps(REPORTS[args.report](campaign=args.campaign), indent=2, ensure_ascii=False))
+    else:
+        create_snapshot()
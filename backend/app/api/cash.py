@@ -4,8 +4,9 @@ from typing import Optional
 from pydantic import BaseModel
 from typing import List
 from app.database import get_db
-from app import models, schemas, crud
+from app import models, schemas, crud, fast_json
 from app.dependencies import get_current_active_user
+from app.metrics import query_budget
 
 router = APIRouter(prefix="/cash", tags=["cash"])
 
@@ -146,6 +147,7 @@ async def close_session(
     
 
 @router.get("/pending-transactions", response_model=schemas.PendingTransactionsList)
+@query_budget(4)
 async def get_pending_transactions(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
@@ -259,6 +261,7 @@ async def register_withdrawal(
 
 
 @router.get("/transactions/{session_id}", response_model=List[schemas.CashTransactionResponse])
+@query_budget(3)
 async def get_transactions(
     session_id: int,
     db: Session = Depends(get_db),
@@ -466,15 +469,27 @@ async def get_closed_sessions(
 ):
     """Obtiene historial de cierres de caja (OPTIMIZADO)"""
     from sqlalchemy import and_, func, case
-    from sqlalchemy.orm import aliased
+    from sqlalchemy.orm import aliased, Bundle
     
     # Alias para los usuarios
     OpenedBy = aliased(models.User)
     ClosedBy = aliased(models.User)
     
+    # Con FAST_JSON solo las columnas que se devuelven (sin objetos ORM);
+    # el Bundle mantiene el acceso session.<campo> del formateo
+    fast = fast_json.enabled()
+    session_columns = Bundle(
+        "session",
+        models.CashSession.id, models.CashSession.opened_at, models.CashSession.closed_at,
+        models.CashSession.initial_amount, models.CashSession.actual_cash,
+        models.CashSession.actual_card, models.CashSession.actual_transfer,
+        models.CashSession.actual_withdrawal, models.CashSession.remaining_in_register,
+        models.CashSession.difference, models.CashSession.notes, models.CashSession.cash_breakdown
+    ) if fast else models.CashSession
+    
     # Query única con JOINs y subqueries
     query = db.query(
-        models.CashSession,
+        session_columns,
         OpenedBy.username.label('opened_by_username'),
         ClosedBy.username.label('closed_by_username'),
         # Subquery para cash_in
@@ -557,4 +572,6 @@ async def get_closed_sessions(
             "cash_breakdown": session.cash_breakdown or {}
         })
     
+    if fast:
+        return fast_json.FastJSONResponse(result)
     return result
\ No newline at end of file
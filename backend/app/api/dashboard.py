@@ -4,10 +4,14 @@ from app.database import get_db
 from app import models, schemas
 from app.dependencies import get_current_active_user
 from app.crud import get_dashboard_data
+from app.metrics import query_budget
+from app.data_versions import conditional_get
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 @router.get("/data", response_model=schemas.DashboardData)
+@query_budget(5)
+@conditional_get("stays")
 async def dashboard_data(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from app import models, schemas, crud
+from app.database import get_db
+from app.api.auth import get_current_active_user
+
+router = APIRouter(prefix="/detections", tags=["detections"])
+
+
+@router.post("/batch", response_model=schemas.DetectionBatchResult)
+def ingest_detection_batch(
+    batch: schemas.DetectionBatch,
+    window_seconds: int = Query(crud.DETECTION_DEDUP_WINDOW_SECONDS, ge=0, le=3600),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Ingesta masiva de lecturas de la cámara (ANPR).
+    
+    - Colapsa lecturas repetidas de la misma matrícula dentro de window_seconds
+      (0 - 3600; 0 desactiva la agrupación)
+    - Crea vehículos nuevos y estancias PENDING en una sola transacción
+    - plate_candidates: vehículos conocidos con matrícula parecida a cada
+      vehículo nuevo (posible mala lectura), del más al menos probable
+    """
+    return crud.ingest_detections(db, batch.detections, window_seconds)
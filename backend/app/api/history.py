@@ -5,7 +5,7 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from app.database import get_db
-from app import models, schemas
+from app import models, schemas, fast_json
 from app.dependencies import get_current_active_user
 
 router = APIRouter(prefix="/history", tags=["history"])
@@ -82,7 +82,7 @@ async def history_logs(
     # Execute and format results
     results = query.all()
     
-    return [
+    rows = [
         {
             "id": row.id,
             "action": row.action,
@@ -96,6 +96,11 @@ async def history_logs(
         }
         for row in results
     ]
+    
+    # Ya es una proyección: con FAST_JSON solo se evita jsonable_encoder
+    if fast_json.enabled():
+        return fast_json.FastJSONResponse(rows)
+    return rows
 
 
 @router.get("/stats/")
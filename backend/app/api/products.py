@@ -7,11 +7,13 @@ from zoneinfo import ZoneInfo
 from app import models, schemas
 from app.database import get_db
 from app.api.auth import get_current_active_user
+from app.data_versions import conditional_get
 
 router = APIRouter(prefix="/products", tags=["products"])
 
 
 @router.get("")
+@conditional_get("products")
 async def get_products(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user),
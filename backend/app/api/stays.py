@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Body
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func
 from typing import List, Optional
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from app.database import get_db
-from app import models, schemas, crud
+from app import models, schemas, crud, fast_json
 from app.dependencies import get_current_active_user
+from app.metrics import query_budget
+from app.data_versions import conditional_get
+from app.vehicle_stats import record_checkout, refresh_vehicle_stats
 from app.crud import (
     get_pending_stays,
     get_active_stays,
@@ -26,10 +30,14 @@ async def list_pending_stays(
     return get_pending_stays(db)
 
 @router.get("/active", response_model=List[schemas.Stay])
+@query_budget(3)
+@conditional_get("stays")
 async def list_active_stays(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
+    if fast_json.enabled():
+        return fast_json.FastJSONResponse(crud.get_active_stays_rows(db))
     return get_active_stays(db)
 
 @router.post("/{stay_id}/check-in", response_model=schemas.Stay)
@@ -94,6 +102,8 @@ async def check_out(
             detail="No hay caja abierta. Por favor, abre la caja antes de hacer checkout."
         )
     
+    was_completed = stay.status == models.StayStatus.COMPLETED
+    
     # Actualizar fechas (editables)
     if checkout_data.check_in_time:
         stay.check_in_time = checkout_data.check_in_time
@@ -113,6 +123,9 @@ async def check_out(
     if stay.payment_status != models.PaymentStatus.PREPAID:
         stay.payment_status = models.PaymentStatus.PAID
     
+    # Estadísticas de cliente del vehículo
+    record_checkout(db, stay, was_completed)
+    
     # Liberar plaza
     if stay.parking_spot:
         stay.parking_spot.is_occupied = False
@@ -282,7 +295,9 @@ async def prepay_stay(
     try:
         from app.print_ticket import print_ticket
         
-        print_result = print_ticket(
+        # En el pool de hilos: una impresora de red apagada no bloquea el bucle de eventos
+        print_result = await run_in_threadpool(
+            print_ticket,
             ticket_type='prepayment',
             license_plate=stay.vehicle.license_plate,
             check_in_time=stay.check_in_time.isoformat(),
@@ -401,11 +416,13 @@ async def checkout_with_prepayment(
     if not stay:
         raise HTTPException(status_code=404, detail="Stay not found")
     
+    was_completed = stay.status == models.StayStatus.COMPLETED
     stay.check_out_time = datetime.now(ZoneInfo("Europe/Madrid"))
     stay.final_price = final_price
     stay.status = models.StayStatus.COMPLETED
     stay.payment_status = models.PaymentStatus.PAID
     stay.cash_registered = False
+    record_checkout(db, stay, was_completed)
     
     if stay.parking_spot:
         stay.parking_spot.is_occupied = False
@@ -576,7 +593,9 @@ async def extend_stay(
     try:
         from app.print_ticket import print_ticket
         
-        print_result = print_ticket(
+        # En el pool de hilos: una impresora de red apagada no bloquea el bucle de eventos
+        print_result = await run_in_threadpool(
+            print_ticket,
             ticket_type='extension',
             license_plate=stay.vehicle.license_plate,
             check_in_time=stay.check_in_time.isoformat(),
@@ -659,9 +678,10 @@ async def delete_checkout(
     final_price = stay.final_price
     check_out_time = stay.check_out_time
     
-    # 1. MARCAR STAY COMO DISCARDED
+    # 1. MARCAR STAY COMO DISCARDED (y recalcular las estadísticas del cliente)
     stay.status = models.StayStatus.DISCARDED
     stay.cash_registered = False
+    refresh_vehicle_stats(db, [stay.vehicle_id])
     
     # 2. LIBERAR PLAZA DE PARKING
     if stay.parking_spot:
@@ -731,16 +751,20 @@ async def delete_checkout(
     }
 
 @router.get("/recent-checkouts")
+@query_budget(2)
 async def get_recent_checkouts_endpoint(
     limit: int = Query(10, ge=1, le=100),
+    before: Optional[datetime] = Query(None, description="check_out_time del último checkout recibido"),
+    before_id: Optional[int] = Query(None, description="stay_id del último checkout recibido"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
     Obtiene los checkouts más recientes.
     Útil para el modal de eliminación de checkouts.
+    "Cargar más": pasar before y before_id del último de la página anterior.
     """
-    checkouts = crud.get_recent_checkouts(db, limit)
+    checkouts = crud.get_recent_checkouts(db, limit, before, before_id)
     return checkouts
 
 
@@ -822,42 +846,38 @@ async def delete_active_stay(
 # ============================================================================
 
 @router.get("/pending-transfers")
+@query_budget(3)
 async def get_pending_transfers(
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Sin límite: todas"),
+    before: Optional[datetime] = Query(None, description="created_at de la última recibida"),
+    before_id: Optional[int] = Query(None, description="id de la última recibida"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
     Obtiene todas las transferencias pendientes de confirmación.
     Incluye información del stay y vehículo asociado.
+    Con limit se pagina ("cargar más" con before y before_id de la última);
+    count sigue siendo el total de pendientes.
     """
-    pending = db.query(models.PendingTransfer).filter(
-        models.PendingTransfer.confirmed == False
-    ).order_by(models.PendingTransfer.created_at.desc()).all()
-    
-    result = []
-    for p in pending:
-        stay = p.stay
-        result.append({
-            "id": p.id,
-            "stay_id": p.stay_id,
-            "transaction_type": p.transaction_type.value,
-            "amount": p.amount,
-            "created_at": p.created_at.isoformat(),
-            "created_by": p.created_by.username,
-            "notes": p.notes,
-            # Info del stay
-            "license_plate": stay.vehicle.license_plate,
-            "country": stay.vehicle.country,
-            "vehicle_type": stay.vehicle.vehicle_type,
-            "stay_status": stay.status.value,
-            "parking_spot": stay.parking_spot.spot_number if stay.parking_spot else None,
-            "check_in_time": stay.check_in_time.isoformat() if stay.check_in_time else None,
-            "check_out_time": stay.check_out_time.isoformat() if stay.check_out_time else None
-        })
+    result = crud.get_pending_transfers_rows(
+        db, limit + 1 if limit else None, before, before_id
+    )
+    has_more = bool(limit) and len(result) > limit
+    if has_more:
+        result = result[:limit]
+    
+    if limit or before is not None:
+        count = db.query(func.count(models.PendingTransfer.id)).filter(
+            models.PendingTransfer.confirmed == False
+        ).scalar()
+    else:
+        count = len(result)
     
     return {
-        "count": len(result),
-        "pending_transfers": result
+        "count": count,
+        "pending_transfers": result,
+        "has_more": has_more
     }
 
 
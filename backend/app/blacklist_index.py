@@ -0,0 +1,181 @@
+"""
+Índice en memoria de la lista negra (SINPAs no resueltos)
+
+Cada llegada a la barrera consulta /api/blacklist/check/{plate}. En vez de
+ir a la base de datos, se responde desde este índice, que se carga al
+arrancar y se actualiza tras cada cambio:
+
+- mark_stay_as_sinpa / add_to_blacklist
+- resolve_blacklist_entry
+- eliminación de SINPA en check-in y entrada manual
+
+Con varios workers, los cambios se propagan por change_feed (LISTEN/NOTIFY).
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app import models, change_feed
+from app.database import SessionLocal
+from app.plates import normalize_plate, rank_plates, match_score
+
+CHANNEL = "blacklist_changed"
+
+_ENTRY_FIELDS = (
+    "id", "vehicle_id", "license_plate", "reason", "amount_owed",
+    "incident_date", "stay_id", "notes", "resolved"
+)
+
+
+def _entry_to_dict(entry: models.Blacklist) -> dict:
+    return {field: getattr(entry, field) for field in _ENTRY_FIELDS}
+
+
+class BlacklistIndex:
+    """Matrícula normalizada -> entradas no resueltas y deuda total"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_plate: Dict[str, dict] = {}
+        self.ready = False
+
+    @staticmethod
+    def _group(entries: Iterable[models.Blacklist]) -> Dict[str, dict]:
+        grouped: Dict[str, dict] = {}
+        for entry in entries:
+            key = entry.plate_key or normalize_plate(entry.license_plate)
+            item = grouped.setdefault(key, {
+                "license_plate": entry.license_plate, "entries": [], "total_debt": 0.0
+            })
+            item["entries"].append(_entry_to_dict(entry))
+            item["total_debt"] += entry.amount_owed or 0.0
+        return grouped
+
+    def load(self, db: Session):
+        """Carga completa desde la base de datos"""
+        entries = db.query(models.Blacklist).filter(
+            models.Blacklist.resolved == False
+        ).order_by(models.Blacklist.id).all()
+
+        grouped = self._group(entries)
+        with self._lock:
+            self._by_plate = grouped
+            self.ready = True
+
+    def refresh_plates(self, db: Session, plates: Iterable[str]):
+        """Relee de la base de datos solo las matrículas indicadas"""
+        keys = {normalize_plate(p) for p in plates if p}
+        if not keys:
+            return
+
+        entries = db.query(models.Blacklist).filter(
+            models.Blacklist.plate_key.in_(keys),
+            models.Blacklist.resolved == False
+        ).order_by(models.Blacklist.id).all()
+
+        grouped = self._group(entries)
+        with self._lock:
+            for key in keys:
+                if key in grouped:
+                    self._by_plate[key] = grouped[key]
+                else:
+                    self._by_plate.pop(key, None)
+
+    def lookup(self, license_plate: str) -> Optional[dict]:
+        """
+        Resultado con el mismo formato que crud.check_blacklist,
+        o None si el índice aún no está cargado.
+        """
+        if not self.ready:
+            return None
+
+        key = normalize_plate(license_plate)
+        with self._lock:
+            item = self._by_plate.get(key)
+
+        if not item:
+            return {
+                "is_blacklisted": False,
+                "entries": [],
+                "total_debt": 0.0,
+                "similar_plates": self.similar(license_plate)
+            }
+
+        return {
+            "is_blacklisted": True,
+            "entries": list(item["entries"]),
+            "total_debt": item["total_debt"],
+            "similar_plates": []
+        }
+
+    def similar(self, license_plate: str, limit: int = 5) -> List[dict]:
+        """
+        Matrículas en lista negra parecidas a la leída (posible error de
+        lectura ANPR). No marcan is_blacklisted: solo se muestran como aviso.
+        """
+        key = normalize_plate(license_plate)
+        with self._lock:
+            items = dict(self._by_plate)
+
+        candidates = []
+        for distance, match_key in rank_plates(key, items):
+            if distance == 0:
+                continue
+            candidates.append({
+                "license_plate": items[match_key]["license_plate"],
+                "total_debt": items[match_key]["total_debt"],
+                "distance": distance,
+                "score": match_score(distance)
+            })
+        return candidates[:limit]
+
+    def plates(self) -> List[str]:
+        with self._lock:
+            return list(self._by_plate)
+
+
+blacklist_index = BlacklistIndex()
+
+
+def blacklist_changed(db: Session, plates: Iterable[str]):
+    """
+    Llamar DESPUÉS del commit que modifica la lista negra.
+    Actualiza el índice local y avisa al resto de workers.
+    """
+    plates = [p for p in plates if p]
+    if not plates:
+        return
+
+    # Sin índice local (aún cargando) no hay nada que refrescar aquí, pero
+    # los demás workers tienen que enterarse igualmente
+    if blacklist_index.ready:
+        blacklist_index.refresh_plates(db, plates)
+    for plate in plates:
+        change_feed.notify(CHANNEL, plate)
+
+
+def _on_remote_change(plate: Optional[str]):
+    db = SessionLocal()
+    try:
+        if plate:
+            blacklist_index.refresh_plates(db, [plate])
+        else:
+            blacklist_index.load(db)
+    finally:
+        db.close()
+
+
+def init_blacklist_index():
+    """Carga inicial (evento startup) y suscripción a cambios de otros workers"""
+    db = SessionLocal()
+    try:
+        blacklist_index.load(db)
+        print(f"✓ Índice de lista negra cargado ({len(blacklist_index.plates())} matrículas)")
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el índice de lista negra, se consultará la BD: {e}")
+    finally:
+        db.close()
+
+    change_feed.subscribe(CHANNEL, _on_remote_change)
@@ -0,0 +1,224 @@
+"""
+Registro de campañas (Sept - Jun) y KPIs por campaña
+
+- get_campaign: cualquier campaña por nombre ('2024/2025') o año de inicio
+- get_campaign_kpis: ingresos, pernoctas, estancias, ocupación y SINPAs
+- compare_campaigns: KPIs de varias campañas lado a lado
+
+Los KPIs de una campaña cerrada se congelan en la tabla campaign_aggregates
+y en memoria: una comparación interanual cuesta una lectura de caché por
+campaña pasada. Solo la campaña en curso se calcula contra la BD.
+"""
+
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models, change_feed
+from app.database import SessionLocal
+from app.utils import get_campaign_year, get_campaign_dates, parse_campaign_name
+
+CHANNEL = "campaign_aggregates_changed"
+# Primera campaña aceptada en peticiones (date() no admite años fuera de rango)
+MIN_CAMPAIGN_YEAR = 2000
+
+_frozen: Dict[int, dict] = {}
+_lock = threading.Lock()
+
+
+def get_campaign(campaign: Union[str, int, None] = None) -> dict:
+    """
+    Campaña por nombre ('2024/2025'), año de inicio (2024) o None (la actual).
+    Añade is_closed: la campaña terminó y sus datos ya no cambian.
+    ValueError si la campaña no es válida o es posterior a la actual.
+    """
+    today = datetime.now(ZoneInfo("Europe/Madrid")).date()
+    current_year = get_campaign_year(today)
+    if campaign is None:
+        campaign_year = current_year
+    elif isinstance(campaign, int):
+        campaign_year = campaign
+    else:
+        campaign_year = parse_campaign_name(campaign)
+
+    if not MIN_CAMPAIGN_YEAR <= campaign_year <= current_year:
+        raise ValueError(f"Campaña fuera de rango: {campaign_year}/{campaign_year + 1} "
+                         f"(de {MIN_CAMPAIGN_YEAR}/{MIN_CAMPAIGN_YEAR + 1} a la actual)")
+
+    dates = get_campaign_dates(campaign_year)
+    return {
+        **dates,
+        "campaign_year": campaign_year,
+        "is_closed": today > dates["end_date"]
+    }
+
+
+def list_campaigns(db: Session) -> List[dict]:
+    """Campañas desde la primera estancia registrada hasta la actual"""
+    first = db.query(func.min(models.Stay.check_in_time)).scalar()
+    current = get_campaign()
+    first_year = max(MIN_CAMPAIGN_YEAR, get_campaign_year(first)) if first else current["campaign_year"]
+    return [get_campaign(year) for year in range(first_year, current["campaign_year"] + 1)]
+
+
+def _bounds(campaign: dict):
+    madrid = ZoneInfo("Europe/Madrid")
+    start = datetime.combine(campaign["start_date"], datetime.min.time()).replace(tzinfo=madrid)
+    end = datetime.combine(campaign["end_date"], datetime.max.time()).replace(tzinfo=madrid)
+    return start, end
+
+
+def compute_campaign_kpis(db: Session, campaign: dict) -> dict:
+    """KPIs de una campaña calculados contra la base de datos"""
+    start, end = _bounds(campaign)
+
+    # Estancias completadas que salen en la campaña y sus pernoctas
+    stays = db.query(
+        func.count(models.Stay.id).label("count"),
+        func.sum(models.Stay.amount_paid).label("revenue"),
+        func.sum(
+            func.extract('epoch', models.Stay.check_out_time - models.Stay.check_in_time) / 86400
+        ).label("nights")
+    ).filter(
+        models.Stay.status == models.StayStatus.COMPLETED,
+        models.Stay.check_in_time.isnot(None),
+        models.Stay.check_out_time >= start,
+        models.Stay.check_out_time <= end
+    ).first()
+
+    # Ingresos cobrados (desde transacciones de caja, como el resumen de analytics)
+    cash_revenue = db.query(func.sum(models.CashTransaction.amount_paid)).filter(
+        models.CashTransaction.transaction_type.in_([
+            models.TransactionType.CHECKOUT,
+            models.TransactionType.PREPAYMENT,
+        ]),
+        models.CashTransaction.timestamp >= start,
+        models.CashTransaction.timestamp <= end
+    ).scalar() or 0.0
+
+    # SINPAs generados en la campaña (resueltos o no: no cambia al cobrarlos)
+    sinpas = db.query(
+        func.count(models.Blacklist.id).label("count"),
+        func.sum(models.Blacklist.amount_owed).label("debt")
+    ).filter(
+        models.Blacklist.incident_date >= start,
+        models.Blacklist.incident_date <= end
+    ).first()
+
+    # Ocupación media: pernoctas / (plazas x días de campaña)
+    total_spots = db.query(func.count(models.ParkingSpot.id)).scalar() or 0
+    campaign_days = (campaign["end_date"] - campaign["start_date"]).days + 1
+    total_nights = int(stays.nights or 0)
+    capacity = total_spots * campaign_days
+    total_stays = stays.count or 0
+
+    return {
+        "total_stays": total_stays,
+        "total_revenue": float(cash_revenue),
+        "stays_revenue": float(stays.revenue or 0),
+        "total_nights": total_nights,
+        "avg_nights_per_stay": round(total_nights / total_stays, 2) if total_stays > 0 else 0,
+        "occupancy_percentage": round(total_nights / capacity * 100, 1) if capacity > 0 else 0,
+        "total_sinpas": sinpas.count or 0,
+        "sinpa_debt": float(sinpas.debt or 0)
+    }
+
+
+def _freeze(db: Session, campaign: dict, kpis: dict):
+    entry = db.query(models.CampaignAggregate).filter(
+        models.CampaignAggregate.campaign_year == campaign["campaign_year"]
+    ).first()
+    if entry is None:
+        entry = models.CampaignAggregate(campaign_year=campaign["campaign_year"])
+        db.add(entry)
+    entry.campaign_name = campaign["campaign_name"]
+    entry.kpis = kpis
+    entry.computed_at = datetime.now(ZoneInfo("Europe/Madrid"))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otro worker la congeló a la vez: mismos datos, vale la suya
+        db.rollback()
+
+    with _lock:
+        _frozen[campaign["campaign_year"]] = kpis
+
+
+def get_campaign_kpis(db: Session, campaign: Union[str, int, None] = None,
+                      refresh: bool = False) -> dict:
+    """
+    KPIs de una campaña. Las cerradas se calculan una sola vez y quedan
+    congeladas; refresh=True las recalcula (p.ej. tras corregir datos antiguos).
+    """
+    campaign = get_campaign(campaign)
+    campaign_year = campaign["campaign_year"]
+
+    if campaign["is_closed"] and not refresh:
+        with _lock:
+            kpis = _frozen.get(campaign_year)
+        if kpis is None:
+            entry = db.query(models.CampaignAggregate).filter(
+                models.CampaignAggregate.campaign_year == campaign_year
+            ).first()
+            if entry is not None:
+                kpis = entry.kpis
+                with _lock:
+                    _frozen[campaign_year] = kpis
+        if kpis is not None:
+            return {"campaign_name": campaign["campaign_name"], "is_closed": True,
+                    "frozen": True, **kpis}
+
+    kpis = compute_campaign_kpis(db, campaign)
+    if campaign["is_closed"]:
+        _freeze(db, campaign, kpis)
+        if refresh:
+            change_feed.notify(CHANNEL, str(campaign_year))
+
+    return {"campaign_name": campaign["campaign_name"], "is_closed": campaign["is_closed"],
+            "frozen": campaign["is_closed"], **kpis}
+
+
+def compare_campaigns(db: Session, campaigns: Optional[List[str]] = None,
+                      last: int = 3) -> List[dict]:
+    """
+    KPIs lado a lado, de la más antigua a la más reciente.
+    Sin lista de campañas: las 'last' últimas (incluida la actual).
+    """
+    if campaigns:
+        selected = sorted({get_campaign(c)["campaign_year"] for c in campaigns})
+    else:
+        current_year = get_campaign()["campaign_year"]
+        first_year = max(MIN_CAMPAIGN_YEAR, current_year - max(1, last) + 1)
+        selected = list(range(first_year, current_year + 1))
+
+    return [get_campaign_kpis(db, year) for year in selected]
+
+
+def _on_remote_refresh(campaign_year: Optional[str]):
+    """Otro worker recalculó una campaña: descartar la copia local"""
+    with _lock:
+        if campaign_year:
+            _frozen.pop(int(campaign_year), None)
+        else:
+            _frozen.clear()
+
+
+def init_campaign_aggregates():
+    """Precarga los KPIs congelados (evento startup) y escucha recálculos"""
+    db = SessionLocal()
+    try:
+        entries = db.query(models.CampaignAggregate).all()
+        with _lock:
+            _frozen.update({entry.campaign_year: entry.kpis for entry in entries})
+        print(f"✓ KPIs congelados cargados ({len(entries)} campañas)")
+    except Exception as e:
+        print(f"⚠️ No se pudieron cargar los KPIs de campañas: {e}")
+    finally:
+        db.close()
+
+    change_feed.subscribe(CHANNEL, _on_remote_refresh)
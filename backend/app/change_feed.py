@@ -0,0 +1,109 @@
+"""
+Canal de notificación de cambios entre workers (PostgreSQL LISTEN/NOTIFY)
+
+Cada worker de uvicorn mantiene cachés en memoria (p.ej. la lista negra).
+Cuando un worker modifica datos, publica un aviso en un canal y el resto
+de workers lo reciben y refrescan su caché.
+
+En bases de datos que no son PostgreSQL (SQLite en desarrollo) el canal no
+hace nada: con un solo proceso basta con actualizar la caché local.
+"""
+
+import select
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.database import engine
+
+# Callbacks por canal. Reciben el payload (str) o None tras (re)conectar,
+# lo que indica que pueden haberse perdido avisos y hay que recargar todo.
+_subscribers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+_listener_thread = None
+_stop_event = threading.Event()
+
+
+def is_enabled() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def notify(channel: str, payload: str = ""):
+    """Publica un aviso en el canal (se entrega a todos los workers)"""
+    if not is_enabled():
+        return
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": channel, "payload": payload})
+            conn.commit()
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar aviso en '{channel}': {e}")
+
+
+def subscribe(channel: str, callback: Callable[[Optional[str]], None]):
+    """Registra un callback para un canal (llamar antes de start_listener)"""
+    _subscribers.setdefault(channel, []).append(callback)
+
+
+def _dispatch(channel: str, payload: Optional[str]):
+    for callback in _subscribers.get(channel, []):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"⚠️ Error procesando aviso de '{channel}': {e}")
+
+
+def _listen_loop():
+    while not _stop_event.is_set():
+        raw = None
+        try:
+            raw = engine.raw_connection()
+            raw.detach()  # Conexión dedicada, fuera del pool
+            conn = raw.driver_connection
+            conn.autocommit = True
+
+            cursor = conn.cursor()
+            for channel in _subscribers:
+                cursor.execute(f'LISTEN "{channel}"')
+
+            # Tras conectar, forzar recarga completa por si se perdió algo
+            for channel in _subscribers:
+                _dispatch(channel, None)
+
+            while not _stop_event.is_set():
+                if select.select([conn], [], [], 5)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        _dispatch(notification.channel, notification.payload)
+
+        except Exception as e:
+            print(f"⚠️ Listener de cambios desconectado: {e}. Reintentando en 5s")
+            time.sleep(5)
+        finally:
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+
+
+def start_listener():
+    """Arranca el hilo que escucha los canales suscritos (solo PostgreSQL)"""
+    global _listener_thread
+
+    if not is_enabled() or not _subscribers or _listener_thread is not None:
+        return
+
+    _stop_event.clear()
+    _listener_thread = threading.Thread(target=_listen_loop, name="change-feed", daemon=True)
+    _listener_thread.start()
+
+
+def stop_listener():
+    global _listener_thread
+    _stop_event.set()
+    _listener_thread = None
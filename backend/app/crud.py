@@ -1,16 +1,20 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, and_, or_, text, desc, asc
 from app import models, schemas
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from passlib.context import CryptContext
-import subprocess
 import os
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from app.utils import get_current_campaign_dates
+from app.blacklist_index import blacklist_index, blacklist_changed
+from app.plates import normalize_plate
+from app.local_dates import local_day_range, local_day_start, local_timestamp
+from app.plate_index import find_similar_vehicles, find_similar_vehicles_many, vehicle_created, vehicles_upserted
+from app.vehicle_stats import record_checkout
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -32,20 +36,83 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 def get_vehicle_by_license_plate(db: Session, license_plate: str):
-    return db.query(models.Vehicle).filter(models.Vehicle.license_plate == license_plate).first()
+    # Busca por matrícula normalizada ("1234-abc" == "1234ABC"); si hay
+    # duplicados antiguos, primero el que coincide exactamente
+    return db.query(models.Vehicle).filter(
+        models.Vehicle.plate_key == normalize_plate(license_plate)
+    ).order_by(
+        (models.Vehicle.license_plate == license_plate).desc(),
+        models.Vehicle.id
+    ).first()
 
 def create_vehicle(db: Session, vehicle: schemas.VehicleCreate):
     db_vehicle = models.Vehicle(**vehicle.dict())
     db.add(db_vehicle)
     db.commit()
     db.refresh(db_vehicle)
+    vehicle_created(db_vehicle)
     return db_vehicle
 
 def get_pending_stays(db: Session):
-    return db.query(models.Stay).filter(models.Stay.status == models.StayStatus.PENDING).all()
+    return db.query(models.Stay).options(
+        joinedload(models.Stay.vehicle), joinedload(models.Stay.parking_spot)
+    ).filter(models.Stay.status == models.StayStatus.PENDING).all()
 
 def get_active_stays(db: Session):
-    return db.query(models.Stay).filter(models.Stay.status == models.StayStatus.ACTIVE).all()
+    return db.query(models.Stay).options(
+        joinedload(models.Stay.vehicle), joinedload(models.Stay.parking_spot)
+    ).filter(models.Stay.status == models.StayStatus.ACTIVE).all()
+
+def get_active_stays_rows(db: Session):
+    """
+    Estancias activas ya con la forma de schemas.Stay, desde una consulta de
+    proyección (sin objetos ORM). Camino rápido de /api/stays/active.
+    """
+    rows = db.query(
+        models.Stay.vehicle_id, models.Stay.status, models.Stay.final_price,
+        models.Stay.payment_status, models.Stay.prepaid_amount, models.Stay.id,
+        models.Stay.detection_time, models.Stay.check_in_time, models.Stay.check_out_time,
+        models.Stay.user_id,
+        models.Vehicle.license_plate, models.Vehicle.vehicle_type, models.Vehicle.brand,
+        models.Vehicle.country, models.Vehicle.is_blacklisted, models.Vehicle.is_rental,
+        models.ParkingSpot.spot_number, models.ParkingSpot.spot_type,
+        models.ParkingSpot.is_occupied, models.ParkingSpot.id.label("spot_id")
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.ParkingSpot, models.Stay.parking_spot_id == models.ParkingSpot.id
+    ).filter(models.Stay.status == models.StayStatus.ACTIVE).all()
+
+    return [
+        {
+            "vehicle_id": row.vehicle_id,
+            "status": row.status,
+            "final_price": row.final_price,
+            "payment_status": row.payment_status,
+            "prepaid_amount": row.prepaid_amount,
+            "id": row.id,
+            "detection_time": row.detection_time,
+            "check_in_time": row.check_in_time,
+            "check_out_time": row.check_out_time,
+            "user_id": row.user_id,
+            "vehicle": {
+                "license_plate": row.license_plate,
+                "vehicle_type": row.vehicle_type,
+                "brand": row.brand,
+                "country": row.country,
+                "is_blacklisted": row.is_blacklisted,
+                "is_rental": row.is_rental,
+                "id": row.vehicle_id
+            },
+            "parking_spot": {
+                "spot_number": row.spot_number,
+                "spot_type": row.spot_type,
+                "is_occupied": row.is_occupied,
+                "id": row.spot_id
+            } if row.spot_id is not None else None
+        }
+        for row in rows
+    ]
 
 def get_stay(db: Session, stay_id: int):
     return db.query(models.Stay).filter(models.Stay.id == stay_id).first()
@@ -97,6 +164,7 @@ def check_in_stay(db: Session, stay_id: int, spot_type: models.SpotType, user_id
     # ============================================================================
     # ELIMINAR SINPA SI SE SOLICITA
     # ============================================================================
+    removed_plates = set()
     if remove_sinpa:
         # Buscar entradas en blacklist para este vehículo
         blacklist_entries = db.query(models.Blacklist).filter(
@@ -106,6 +174,7 @@ def check_in_stay(db: Session, stay_id: int, spot_type: models.SpotType, user_id
         
         if blacklist_entries:
             total_debt_cleared = sum(entry.amount_owed for entry in blacklist_entries)
+            removed_plates = {entry.license_plate for entry in blacklist_entries}
             
             # Eliminar todas las entradas de lista negra
             for entry in blacklist_entries:
@@ -150,6 +219,8 @@ def check_in_stay(db: Session, stay_id: int, spot_type: models.SpotType, user_id
     
     db.commit()
     db.refresh(stay)
+    
+    blacklist_changed(db, removed_plates)
     return stay
 
 def check_out_stay(db: Session, stay_id: int, final_price: float, user_id: int):
@@ -157,10 +228,13 @@ def check_out_stay(db: Session, stay_id: int, final_price: float, user_id: int):
     if not stay:
         return None
     
+    was_completed = stay.status == models.StayStatus.COMPLETED
+    
     # Update stay
     stay.status = models.StayStatus.COMPLETED
     stay.check_out_time = datetime.now(ZoneInfo("Europe/Madrid"))
     stay.final_price = final_price
+    record_checkout(db, stay, was_completed)
     
     # Free up parking spot
     if stay.parking_spot:
@@ -262,6 +336,7 @@ def create_manual_stay(db: Session, stay_data: dict, user_id: int, remove_sinpa:
     # ============================================================================
     # ELIMINAR SINPA SI SE SOLICITA
     # ============================================================================
+    removed_plates = set()
     if remove_sinpa:
         # Buscar entradas en blacklist para este vehículo
         blacklist_entries = db.query(models.Blacklist).filter(
@@ -271,6 +346,7 @@ def create_manual_stay(db: Session, stay_data: dict, user_id: int, remove_sinpa:
         
         if blacklist_entries:
             total_debt_cleared = sum(entry.amount_owed for entry in blacklist_entries)
+            removed_plates = {entry.license_plate for entry in blacklist_entries}
             
             # Eliminar todas las entradas de lista negra
             for entry in blacklist_entries:
@@ -351,6 +427,7 @@ def create_manual_stay(db: Session, stay_data: dict, user_id: int, remove_sinpa:
             }
         ), user_id)
     
+    blacklist_changed(db, removed_plates)
     return db_stay
 
 def create_history_log(db: Session, log: schemas.HistoryLogCreate, user_id: int):
@@ -366,6 +443,58 @@ def create_history_log(db: Session, log: schemas.HistoryLogCreate, user_id: int)
     db.refresh(db_log)
     return db_log
 
+def expire_stale_pending_stays(db: Session, max_age_hours: float, batch_size: int = 500):
+    """
+    Descarta las detecciones pendientes más antiguas que max_age_hours
+    (falsos positivos del ANPR que nadie descartó). Un UPDATE ... RETURNING
+    por lote y un INSERT en bloque del HistoryLog: si varios workers lo
+    ejecutan a la vez, cada estancia se descarta y se registra una sola vez.
+    Las que ya tienen plaza asignada no se tocan.
+
+    Devuelve el número de estancias descartadas.
+    """
+    from sqlalchemy import update, insert
+
+    now = datetime.now(ZoneInfo("Europe/Madrid"))
+    cutoff = now - timedelta(hours=max_age_hours)
+    expired = 0
+
+    while True:
+        batch = db.query(models.Stay.id).filter(
+            models.Stay.status == models.StayStatus.PENDING,
+            models.Stay.detection_time < cutoff,
+            models.Stay.parking_spot_id.is_(None)
+        ).order_by(models.Stay.detection_time).limit(batch_size).subquery()
+
+        stay_ids = db.execute(
+            update(models.Stay).where(
+                models.Stay.id.in_(batch.select()),
+                models.Stay.status == models.StayStatus.PENDING
+            ).values(status=models.StayStatus.DISCARDED).returning(models.Stay.id),
+            execution_options={"synchronize_session": False}
+        ).scalars().all()
+
+        if stay_ids:
+            db.execute(insert(models.HistoryLog), [
+                {
+                    "stay_id": stay_id,
+                    "action": "Stay discarded - Expired",
+                    "timestamp": now,
+                    "details": {
+                        "reason": "Detección pendiente caducada",
+                        "max_age_hours": max_age_hours,
+                        "automatic": True
+                    },
+                    "user_id": None
+                }
+                for stay_id in stay_ids
+            ])
+        db.commit()
+
+        expired += len(stay_ids)
+        if len(stay_ids) < batch_size:
+            return expired
+
 def get_history_logs(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.HistoryLog).offset(skip).limit(limit).all()
 
@@ -373,8 +502,11 @@ def get_dashboard_data(db: Session):
     pending_stays = get_pending_stays(db)
     active_stays = get_active_stays(db)
     
-    total_spots = db.query(models.ParkingSpot).count()
-    occupied_spots = db.query(models.ParkingSpot).filter(models.ParkingSpot.is_occupied == True).count()
+    # Total y ocupadas en una sola consulta
+    total_spots, occupied_spots = db.query(
+        func.count(models.ParkingSpot.id),
+        func.count(models.ParkingSpot.id).filter(models.ParkingSpot.is_occupied == True)
+    ).one()
     available_spots = total_spots - occupied_spots
     
     return {
@@ -496,6 +628,8 @@ def checkout_with_prepayment(db: Session, stay_id: int, final_price: float, user
     if stay.prepaid_amount:
         remaining_amount = max(0, final_price - stay.prepaid_amount)
     
+    was_completed = stay.status == models.StayStatus.COMPLETED
+    
     # Actualizar stay
     stay.status = models.StayStatus.COMPLETED
     stay.check_out_time = datetime.now(ZoneInfo("Europe/Madrid"))
@@ -508,6 +642,9 @@ def checkout_with_prepayment(db: Session, stay_id: int, final_price: float, user
     else:
         stay.payment_status = models.PaymentStatus.PAID
     
+    # Estadísticas de cliente del vehículo
+    record_checkout(db, stay, was_completed)
+    
     # Liberar plaza de parking
     if stay.parking_spot:
         spot = db.query(models.ParkingSpot).filter(
@@ -534,87 +671,175 @@ def checkout_with_prepayment(db: Session, stay_id: int, final_price: float, user
     return stay
 
 
-def print_ticket(ticket_type: str, license_plate: str, check_in_time: str, 
-                 amount: float, check_out_time: Optional[str] = None):
+# ============================================================================
+# INGESTA MASIVA DE DETECCIONES ANPR
+# ============================================================================
+
+DETECTION_DEDUP_WINDOW_SECONDS = int(os.getenv("DETECTION_DEDUP_WINDOW_SECONDS", "120"))
+
+
+def collapse_detections(detections: List[schemas.Detection], window_seconds: int):
     """
-    Ejecuta el script de Python para imprimir un ticket.
+    Agrupa las lecturas repetidas de la misma matrícula (normalizada).
     
-    Args:
-        ticket_type: 'checkout' o 'prepayment'
-        license_plate: Matrícula del vehículo
-        check_in_time: Fecha/hora de entrada (formato ISO)
-        amount: Importe en euros
-        check_out_time: Fecha/hora de salida (solo para checkout)
+    Una lectura se descarta si la anterior de esa matrícula fue hace menos
+    de window_seconds (la cámara lee varias veces al mismo vehículo mientras
+    se acerca). Devuelve las detecciones que abren una llegada nueva.
+    """
+    madrid = ZoneInfo("Europe/Madrid")
+    now = datetime.now(madrid)
+    window = timedelta(seconds=window_seconds)
     
-    Returns:
-        dict con success (bool) y message (str)
+    readings = []
+    for detection in detections:
+        key = normalize_plate(detection.license_plate)
+        if not key:
+            continue
+        detected_at = detection.detected_at or now
+        if detected_at.tzinfo is None:
+            detected_at = detected_at.replace(tzinfo=madrid)
+        readings.append((detected_at, key, detection))
+    
+    readings.sort(key=lambda r: r[0])
+    
+    last_seen = {}
+    arrivals = []
+    for detected_at, key, detection in readings:
+        previous = last_seen.get(key)
+        last_seen[key] = detected_at
+        if previous is not None and detected_at - previous < window:
+            continue
+        arrivals.append((detected_at, key, detection))
+    
+    return arrivals
+
+
+def ingest_detections(db: Session, detections: List[schemas.Detection],
+                      window_seconds: int = DETECTION_DEDUP_WINDOW_SECONDS):
     """
-    try:
-        # Construir comando
-        cmd = [
-            "python3",
-            "/app/print_ticket.py",
-            "--type", ticket_type,
-            "--license", license_plate,
-            "--entry", check_in_time,
-            "--amount", str(amount),
-        ]
-        
-        # CONFIGURACIÓN DE IMPRESORA
-        # Por defecto usa modo 'file' para testing (guarda en /tmp/ticket_output.bin)
-        cmd.extend([
-            "--printer-type", "file",
-            "--output", "/tmp/ticket_output.bin"
-        ])
-        
-        # Para usar impresora USB real, comenta las líneas de arriba y descomenta estas:
-        # cmd.extend([
-        #     "--printer-type", "usb",
-        #     "--vendor-id", "0x04b8",  # Reemplaza con tu vendor ID
-        #     "--product-id", "0x0e15"   # Reemplaza con tu product ID
-        # ])
-        
-        # Si es checkout, añadir hora de salida
-        if ticket_type == "checkout" and check_out_time:
-            cmd.extend(["--exit", check_out_time])
-        
-        # Ejecutar el script
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if result.returncode == 0:
-            return {
-                "success": True,
-                "message": "Ticket impreso correctamente"
-            }
-        else:
-            error_msg = result.stderr or result.stdout or "Error desconocido"
-            return {
-                "success": False,
-                "message": f"Error al imprimir: {error_msg}"
+    Crea las estancias pendientes de un lote de detecciones en una sola
+    transacción (en vez de un create_stay con dos commits por lectura).
+    
+    - Colapsa repeticiones de la misma matrícula dentro de la ventana
+    - Ignora llegadas con una estancia PENDING reciente (lote anterior)
+    - Vehículos: INSERT ... ON CONFLICT DO NOTHING en una sentencia
+    - Estancias: un único INSERT multi-fila
+    """
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    
+    arrivals = collapse_detections(detections, window_seconds)
+    collapsed = len(detections) - len(arrivals)
+    
+    if not arrivals:
+        return {"received": len(detections), "collapsed": collapsed,
+                "vehicles_created": 0, "stays_created": 0, "stay_ids": [], "plate_candidates": {}}
+    
+    keys = {key for _, key, _ in arrivals}
+    
+    # Vehículos existentes (por matrícula normalizada)
+    vehicle_ids = {}
+    
+    def load_vehicles(plate_keys):
+        for vehicle_id, plate_key in db.query(models.Vehicle.id, models.Vehicle.plate_key).filter(
+            models.Vehicle.plate_key.in_(plate_keys)
+        ).order_by(models.Vehicle.id):
+            vehicle_ids.setdefault(plate_key, vehicle_id)
+    
+    load_vehicles(keys)
+    
+    # Otro worker puede estar creando la misma matrícula con otro formato
+    # ("1234-ABC" / "1234ABC"): no choca en license_plate y saldrían dos
+    # vehículos con la misma clave. Un lock por clave que falta (en orden,
+    # sin interbloqueos) hasta el commit, y volver a buscarlas
+    missing = sorted(keys - vehicle_ids.keys())
+    if missing and db.bind.dialect.name == "postgresql":
+        db.execute(text(
+            "SELECT pg_advisory_xact_lock(hashtext(k)) "
+            "FROM unnest(CAST(:keys AS text[])) WITH ORDINALITY AS t(k, n) ORDER BY n"
+        ), {"keys": missing})
+        load_vehicles(missing)
+    
+    # Insertar los que faltan (ON CONFLICT cubre la carrera con otro worker)
+    new_vehicles = {}
+    for _, key, detection in arrivals:
+        if key not in vehicle_ids and key not in new_vehicles:
+            new_vehicles[key] = {
+                "license_plate": detection.license_plate.strip().upper(),
+                "plate_key": key,
+                "vehicle_type": detection.vehicle_type,
+                "country": detection.country,
+                "is_blacklisted": False,
+                "is_rental": False
             }
     
-    except subprocess.TimeoutExpired:
-        return {
-            "success": False,
-            "message": "Timeout: la impresora no responde"
-        }
-    except FileNotFoundError:
-        return {
-            "success": False,
-            "message": "Script print_ticket.py no encontrado en /app/"
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "message": f"Error inesperado: {str(e)}"
-        }
+    created_vehicles = []
+    if new_vehicles:
+        stmt = dialect_insert(models.Vehicle).values(list(new_vehicles.values())).on_conflict_do_nothing(
+            index_elements=[models.Vehicle.license_plate]
+        ).returning(models.Vehicle.id, models.Vehicle.license_plate, models.Vehicle.plate_key)
+        for vehicle_id, license_plate, plate_key in db.execute(stmt):
+            vehicle_ids[plate_key] = vehicle_id
+            created_vehicles.append((vehicle_id, license_plate))
+        
+        # Los que otro worker insertó a la vez: existen, pero no son nuevos
+        lost = {row["license_plate"]: key for key, row in new_vehicles.items() if key not in vehicle_ids}
+        if lost:
+            for vehicle_id, license_plate in db.query(models.Vehicle.id, models.Vehicle.license_plate).filter(
+                models.Vehicle.license_plate.in_(lost)
+            ):
+                vehicle_ids[lost[license_plate]] = vehicle_id
+    
+    # Llegadas que ya tienen estancia pendiente dentro de la ventana
+    earliest = min(detected_at for detected_at, _, _ in arrivals) - timedelta(seconds=window_seconds)
+    recent_pending = {}
+    for vehicle_id, detection_time in db.query(models.Stay.vehicle_id, models.Stay.detection_time).filter(
+        models.Stay.vehicle_id.in_(set(vehicle_ids.values())),
+        models.Stay.status == models.StayStatus.PENDING,
+        models.Stay.detection_time >= earliest
+    ):
+        if detection_time.tzinfo is None:
+            detection_time = detection_time.replace(tzinfo=ZoneInfo("Europe/Madrid"))
+        recent_pending.setdefault(vehicle_id, []).append(detection_time)
+    
+    window = timedelta(seconds=window_seconds)
+    stay_rows = []
+    for detected_at, key, _ in arrivals:
+        vehicle_id = vehicle_ids[key]
+        if any(abs(detected_at - t) < window for t in recent_pending.get(vehicle_id, [])):
+            collapsed += 1
+            continue
+        stay_rows.append({
+            "vehicle_id": vehicle_id,
+            "detection_time": detected_at,
+            "status": models.StayStatus.PENDING,
+            "payment_status": models.PaymentStatus.PENDING
+        })
     
+    stay_ids = []
+    if stay_rows:
+        stay_ids = list(db.execute(
+            dialect_insert(models.Stay).values(stay_rows).returning(models.Stay.id)
+        ).scalars())
     
+    db.commit()
+    
+    # Vehículos nuevos que pueden ser una mala lectura de uno conocido
+    plate_candidates = find_similar_vehicles_many(db, [plate for _, plate in created_vehicles])
+    vehicles_upserted(created_vehicles)
+    
+    return {
+        "received": len(detections),
+        "collapsed": collapsed,
+        "vehicles_created": len(created_vehicles),
+        "stays_created": len(stay_ids),
+        "stay_ids": stay_ids,
+        "plate_candidates": plate_candidates
+    }
+
+
 # ============================================================================
 # FUNCIONES PARA GESTIÓN DE LISTA NEGRA (SINPAS)
 # ============================================================================
@@ -623,10 +848,17 @@ def check_blacklist(db: Session, license_plate: str):
     """
     Verifica si un vehículo está en la lista negra.
     Retorna todas las entradas no resueltas.
+    
+    Responde desde el índice en memoria; solo consulta la BD si el
+    índice no está cargado.
     """
+    cached = blacklist_index.lookup(license_plate)
+    if cached is not None:
+        return cached
+    
     entries = db.query(models.Blacklist).filter(
         and_(
-            models.Blacklist.license_plate == license_plate,
+            models.Blacklist.plate_key == normalize_plate(license_plate),
             models.Blacklist.resolved == False
         )
     ).all()
@@ -635,7 +867,8 @@ def check_blacklist(db: Session, license_plate: str):
         return {
             "is_blacklisted": False,
             "entries": [],
-            "total_debt": 0.0
+            "total_debt": 0.0,
+            "similar_plates": []
         }
     
     total_debt = sum(entry.amount_owed for entry in entries)
@@ -643,7 +876,8 @@ def check_blacklist(db: Session, license_plate: str):
     return {
         "is_blacklisted": True,
         "entries": entries,
-        "total_debt": total_debt
+        "total_debt": total_debt,
+        "similar_plates": []
     }
 
 
@@ -666,6 +900,8 @@ def add_to_blacklist(db: Session, vehicle_id: int, license_plate: str,
     db.commit()
     db.refresh(blacklist_entry)
     
+    blacklist_changed(db, [license_plate])
+    
     return blacklist_entry
 
 
@@ -690,10 +926,13 @@ def mark_stay_as_sinpa(db: Session, stay_id: int, notes: Optional[str], user_id:
         daily_rate = 10.0  # 10€ por día
         stay.final_price = days * daily_rate
     
+    was_completed = stay.status == models.StayStatus.COMPLETED
+    
     # Marcar el stay
     stay.status = models.StayStatus.COMPLETED
     stay.check_out_time = datetime.now(ZoneInfo("Europe/Madrid"))
     stay.payment_status = models.PaymentStatus.UNPAID
+    record_checkout(db, stay, was_completed)
     
     # Liberar plaza
     if stay.parking_spot:
@@ -826,6 +1065,8 @@ def resolve_blacklist_entry(db: Session, blacklist_id: int, user_id: int, paid:
     db.commit()
     db.refresh(entry)
     
+    blacklist_changed(db, [entry.license_plate])
+    
     return entry
 
 
@@ -903,19 +1144,18 @@ def get_revenue_timeline(db: Session, days: int = 30):
     El parámetro 'days' se ignora, ahora usa toda la campaña
     """
     campaign = get_current_campaign_dates()
-    start_date = datetime.combine(campaign["start_date"], datetime.min.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
-    end_date = datetime.combine(campaign["end_date"], datetime.max.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
+    start_date, end_date = local_day_range(campaign["start_date"], campaign["end_date"])
     
     results = db.query(
-        func.date(models.Stay.check_out_time).label('date'),
+        models.Stay.check_out_local_date.label('date'),
         func.sum(models.Stay.final_price).label('revenue')
     ).filter(
         models.Stay.status == models.StayStatus.COMPLETED,
         models.Stay.check_out_time >= start_date,
-        models.Stay.check_out_time <= end_date,
+        models.Stay.check_out_time < end_date,
         models.Stay.final_price.isnot(None)
     ).group_by(
-        func.date(models.Stay.check_out_time)
+        models.Stay.check_out_local_date
     ).order_by('date').all()
     
     return [
@@ -961,7 +1201,7 @@ def get_peak_hours(db: Session):
     Horas pico de entrada (check-in)
     """
     results = db.query(
-        extract('hour', models.Stay.check_in_time).label('hour'),
+        extract('hour', local_timestamp(models.Stay.check_in_time)).label('hour'),
         func.count(models.Stay.id).label('count')
     ).filter(
         models.Stay.check_in_time.isnot(None)
@@ -1082,8 +1322,8 @@ def get_monthly_comparison(db: Session, months: int = 6):
     cutoff_date = datetime.now(ZoneInfo("Europe/Madrid")) - timedelta(days=months*30)
     
     results = db.query(
-        extract('year', models.Stay.check_out_time).label('year'),
-        extract('month', models.Stay.check_out_time).label('month'),
+        extract('year', models.Stay.check_out_local_date).label('year'),
+        extract('month', models.Stay.check_out_local_date).label('month'),
         func.count(models.Stay.id).label('count'),
         func.sum(models.Stay.final_price).label('revenue')
     ).filter(
@@ -1112,7 +1352,7 @@ def get_weekday_distribution(db: Session):
     Distribución de check-ins por día de la semana
     """
     results = db.query(
-        extract('dow', models.Stay.check_in_time).label('weekday'),
+        extract('dow', models.Stay.check_in_local_date).label('weekday'),
         func.count(models.Stay.id).label('count')
     ).filter(
         models.Stay.check_in_time.isnot(None)
@@ -1175,22 +1415,21 @@ def get_nights_timeline(db: Session, days: int = 30):
     El parámetro 'days' se ignora, ahora usa toda la campaña
     """
     campaign = get_current_campaign_dates()
-    start_date = datetime.combine(campaign["start_date"], datetime.min.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
-    end_date = datetime.combine(campaign["end_date"], datetime.max.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
+    start_date, end_date = local_day_range(campaign["start_date"], campaign["end_date"])
     
     results = db.query(
-        func.date(models.Stay.check_out_time).label('date'),
+        models.Stay.check_out_local_date.label('date'),
         func.sum(
             func.extract('epoch', models.Stay.check_out_time - models.Stay.check_in_time) / 86400
         ).label('nights')
     ).filter(
         models.Stay.status == models.StayStatus.COMPLETED,
         models.Stay.check_out_time >= start_date,
-        models.Stay.check_out_time <= end_date,
+        models.Stay.check_out_time < end_date,
         models.Stay.check_in_time.isnot(None),
         models.Stay.check_out_time.isnot(None)
     ).group_by(
-        func.date(models.Stay.check_out_time)
+        models.Stay.check_out_local_date
     ).order_by('date').all()
     
     return [
@@ -1396,15 +1635,16 @@ def get_checkins_around_today(db: Session, days_before: int = 7, days_after: int
     start_date = today - timedelta(days=days_before)
     end_date = today + timedelta(days=days_after)
     
-    # Contar check-ins por día
+    # Contar check-ins por día (rango sobre check_in_time: usa el índice)
+    range_start, range_end = local_day_range(start_date, end_date)
     results = db.query(
-        func.date(models.Stay.check_in_time).label('date'),
+        models.Stay.check_in_local_date.label('date'),
         func.count(models.Stay.id).label('checkins')
     ).filter(
-        func.date(models.Stay.check_in_time) >= start_date,
-        func.date(models.Stay.check_in_time) <= end_date
+        models.Stay.check_in_time >= range_start,
+        models.Stay.check_in_time < range_end
     ).group_by(
-        func.date(models.Stay.check_in_time)
+        models.Stay.check_in_local_date
     ).order_by('date').all()
     
     # Crear lista completa con días sin check-ins = 0
@@ -1427,6 +1667,70 @@ def get_checkins_around_today(db: Session, days_before: int = 7, days_after: int
         "today": today.strftime("%Y-%m-%d")
     }
 
+def get_payment_methods_detailed_rows(db: Session, start_date: datetime, end_date: datetime):
+    """
+    Desglose por método de pago en una sola consulta de proyección (sin la
+    consulta por transacción del camino normal). Misma salida que
+    /api/analytics/payment-methods-detailed.
+    """
+    rows = db.query(
+        models.CashTransaction.payment_method,
+        models.CashTransaction.amount_paid,
+        models.CashTransaction.timestamp,
+        models.Stay.id.label("stay_id"),
+        models.Stay.check_in_time,
+        models.Vehicle.license_plate,
+        models.Vehicle.country
+    ).outerjoin(
+        models.Stay, models.CashTransaction.stay_id == models.Stay.id
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).filter(
+        models.CashTransaction.transaction_type.in_([
+            models.TransactionType.CHECKOUT,
+            models.TransactionType.PREPAYMENT
+        ]),
+        models.CashTransaction.timestamp >= start_date,
+        models.CashTransaction.timestamp <= end_date
+    ).all()
+
+    totals = {
+        models.PaymentMethod.CASH: [0.0, 0],
+        models.PaymentMethod.CARD: [0.0, 0],
+        models.PaymentMethod.TRANSFER: [0.0, 0]
+    }
+    listed = {models.PaymentMethod.CARD: [], models.PaymentMethod.TRANSFER: []}
+
+    for row in rows:
+        if row.payment_method not in totals:
+            continue
+        amount = row.amount_paid or 0
+        totals[row.payment_method][0] += amount
+        totals[row.payment_method][1] += 1
+
+        if row.payment_method in listed and row.stay_id is not None:
+            listed[row.payment_method].append({
+                "license_plate": row.license_plate,
+                "country": row.country or "Unknown",
+                "amount": amount,
+                "check_out_time": row.timestamp.isoformat(),
+                "check_in_time": row.check_in_time.isoformat() if row.check_in_time else None
+            })
+
+    for transactions in listed.values():
+        transactions.sort(key=lambda x: x["check_out_time"] or "", reverse=True)
+
+    return {
+        "totals": {
+            method.value: {"amount": round(total, 2), "count": count}
+            for method, (total, count) in totals.items()
+        },
+        "transactions": {
+            "transfer": listed[models.PaymentMethod.TRANSFER],
+            "card": listed[models.PaymentMethod.CARD]
+        }
+    }
+
 def get_payment_distribution_by_country(db: Session):
     """
     Obtiene distribución por país para cada tipo de pago DE LA CAMPAÑA ACTUAL
@@ -1595,6 +1899,18 @@ def close_cash_session(db: Session, session_id: int, actual_final_amount: float,
     
     return session
 
+def session_transactions(session_id: int, opened_at: Optional[datetime]):
+    """
+    Filtro de las transacciones de una caja. El límite de fecha (desde el día
+    antes de abrirla) no cambia el resultado, pero PostgreSQL solo lee las
+    particiones recientes de cash_transactions (ver app/partitions.py)
+    """
+    criteria = [models.CashTransaction.cash_session_id == session_id]
+    if opened_at is not None:
+        criteria.append(models.CashTransaction.timestamp >= opened_at - timedelta(days=1))
+    return and_(*criteria)
+
+
 def calculate_expected_by_method(db: Session, session_id: int):
     """
     Calcula el importe esperado en caja DESGLOSADO por método de pago
@@ -1615,7 +1931,7 @@ def calculate_expected_by_method(db: Session, session_id: int):
     
     # Obtener todas las transacciones de la sesión
     transactions = db.query(models.CashTransaction).filter(
-        models.CashTransaction.cash_session_id == session_id
+        session_transactions(session_id, session.opened_at)
     ).all()
     
     for tx in transactions:
@@ -1693,7 +2009,7 @@ def get_cash_session_summary(db: Session, session_id: int):
     # Total ingresos en efectivo
     cash_in = db.query(func.sum(models.CashTransaction.amount_due)).filter(
         and_(
-            models.CashTransaction.cash_session_id == session_id,
+            session_transactions(session_id, session.opened_at),
             models.CashTransaction.transaction_type.in_([
                 models.TransactionType.CHECKOUT,
                 models.TransactionType.PREPAYMENT,
@@ -1706,7 +2022,7 @@ def get_cash_session_summary(db: Session, session_id: int):
     # Total retiros
     withdrawals = db.query(func.sum(models.CashTransaction.amount_due)).filter(
         and_(
-            models.CashTransaction.cash_session_id == session_id,
+            session_transactions(session_id, session.opened_at),
             models.CashTransaction.transaction_type == models.TransactionType.WITHDRAWAL
         )
     ).scalar() or 0.0
@@ -1766,7 +2082,9 @@ def get_pending_transactions(db: Session):
     total = 0.0
     
     # 1. PREPAYMENTS pendientes (stays ACTIVOS con prepago no registrado)
-    prepayments = db.query(models.Stay).filter(
+    prepayments = db.query(models.Stay).options(
+        joinedload(models.Stay.vehicle), joinedload(models.Stay.user)
+    ).filter(
         and_(
             models.Stay.status == models.StayStatus.ACTIVE,
             models.Stay.prepaid_amount.isnot(None),
@@ -1775,8 +2093,7 @@ def get_pending_transactions(db: Session):
     ).order_by(models.Stay.check_in_time.desc()).all()
     
     for stay in prepayments:
-        user = db.query(models.User).filter(models.User.id == stay.user_id).first()
-        username = user.username if user else "Unknown"
+        username = stay.user.username if stay.user else "Unknown"
         
         pending.append({
             "stay_id": stay.id,
@@ -1791,7 +2108,9 @@ def get_pending_transactions(db: Session):
         total += stay.prepaid_amount
     
     # 2. CHECKOUTS pendientes (stays COMPLETADOS no registrados en caja)
-    checkouts = db.query(models.Stay).filter(
+    checkouts = db.query(models.Stay).options(
+        joinedload(models.Stay.vehicle), joinedload(models.Stay.user)
+    ).filter(
         and_(
             models.Stay.status == models.StayStatus.COMPLETED,
             models.Stay.cash_registered == False,
@@ -1800,8 +2119,7 @@ def get_pending_transactions(db: Session):
     ).order_by(models.Stay.check_out_time.desc()).all()
     
     for stay in checkouts:
-        user = db.query(models.User).filter(models.User.id == stay.user_id).first()
-        username = user.username if user else "Unknown"
+        username = stay.user.username if stay.user else "Unknown"
         
         # Calcular el importe a cobrar (restando prepago si existe Y ya está registrado)
         amount_due = stay.final_price
@@ -1902,21 +2220,28 @@ def register_pending_transaction(db: Session, stay_id: int, payment_method: str,
 
 def get_cash_transactions(db: Session, session_id: int):
     """Obtiene todas las transacciones de una sesión de caja"""
-    transactions = db.query(models.CashTransaction).filter(
-        models.CashTransaction.cash_session_id == session_id
+    opened_at = db.query(models.CashSession.opened_at).filter(
+        models.CashSession.id == session_id
+    ).scalar()
+    
+    # Matrícula y usuario en la misma consulta (sin consultas por fila)
+    transactions = db.query(
+        models.CashTransaction,
+        models.Vehicle.license_plate,
+        models.User.username
+    ).outerjoin(
+        models.Stay, models.CashTransaction.stay_id == models.Stay.id
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.User, models.CashTransaction.user_id == models.User.id
+    ).filter(
+        session_transactions(session_id, opened_at)
     ).order_by(models.CashTransaction.timestamp.desc()).all()
     
     result = []
-    for tx in transactions:
-        # Obtener datos adicionales
-        license_plate = None
-        if tx.stay_id:
-            stay = db.query(models.Stay).filter(models.Stay.id == tx.stay_id).first()
-            if stay:
-                license_plate = stay.vehicle.license_plate
-        
-        user = db.query(models.User).filter(models.User.id == tx.user_id).first()
-        username = user.username if user else "Unknown"
+    for tx, license_plate, username in transactions:
+        username = username or "Unknown"
         
         result.append({
             "id": tx.id,
@@ -2159,36 +2484,15 @@ def get_customer_history(db: Session, license_plate: str):
     """
     Obtiene el historial de un cliente por matrícula
     Retorna info de visitas previas, gastos, etc.
+    (leído de las estadísticas del vehículo, ver app/vehicle_stats.py)
     """
-    from sqlalchemy import and_
-    
     # Buscar el vehículo
-    vehicle = db.query(models.Vehicle).filter(
-        models.Vehicle.license_plate == license_plate
-    ).first()
+    vehicle = get_vehicle_by_license_plate(db, license_plate)
     
-    if not vehicle:
-        return {
-            "is_returning_customer": False,
-            "total_visits": 0,
-            "last_visit_date": None,
-            "total_spent": 0.0,
-            "avg_nights": 0.0,
-            "last_payment_status": None,
-            "country": None  # ← AÑADIR
-        }
-    
-    # Obtener todas las estancias completadas
-    completed_stays = db.query(models.Stay).filter(
-        and_(
-            models.Stay.vehicle_id == vehicle.id,
-            models.Stay.status == models.StayStatus.COMPLETED
-        )
-    ).order_by(models.Stay.check_out_time.desc()).all()
+    # Matrículas parecidas (posible error de lectura ANPR), ordenadas
+    similar_plates = find_similar_vehicles(db, license_plate)
     
-    total_visits = len(completed_stays)
-    
-    if total_visits == 0:
+    if not vehicle or not vehicle.visit_count:
         return {
             "is_returning_customer": False,
             "total_visits": 0,
@@ -2196,70 +2500,138 @@ def get_customer_history(db: Session, license_plate: str):
             "total_spent": 0.0,
             "avg_nights": 0.0,
             "last_payment_status": None,
-            "country": vehicle.country  # ← AÑADIR
+            "country": vehicle.country if vehicle else None,
+            "similar_plates": similar_plates
         }
     
-    # Calcular estadísticas
-    total_spent = sum([stay.final_price for stay in completed_stays if stay.final_price])
-    
-    # Calcular promedio de noches
-    total_nights = 0
-    stays_with_nights = 0
-    for stay in completed_stays:
-        if stay.check_in_time and stay.check_out_time:
-            nights = (stay.check_out_time - stay.check_in_time).days
-            if nights > 0:
-                total_nights += nights
-                stays_with_nights += 1
-    
-    avg_nights = round(total_nights / stays_with_nights, 1) if stays_with_nights > 0 else 0
-    
-    # Última visita
-    last_stay = completed_stays[0]
-    last_visit_date = last_stay.check_out_time
-    last_payment_status = last_stay.payment_status.value if last_stay.payment_status else "unknown"
+    avg_nights = (
+        round(vehicle.total_nights / vehicle.nights_visit_count, 1)
+        if vehicle.nights_visit_count else 0
+    )
+    last_visit_date = vehicle.last_visit_at
+    last_payment_status = vehicle.last_payment_status.value if vehicle.last_payment_status else "unknown"
     
     return {
         "is_returning_customer": True,
-        "total_visits": total_visits,
+        "total_visits": vehicle.visit_count,
         "last_visit_date": last_visit_date.isoformat() if last_visit_date else None,
-        "total_spent": float(total_spent),
+        "total_spent": float(vehicle.total_spent or 0.0),
         "avg_nights": avg_nights,
         "last_payment_status": last_payment_status,
-        "country": vehicle.country  # ← AÑADIR
+        "country": vehicle.country,
+        "similar_plates": similar_plates
     }
 
 
-def get_recent_checkouts(db: Session, limit: int = 10):
+def keyset_before(query, time_column, id_column, before: Optional[datetime] = None,
+                  before_id: Optional[int] = None):
+    """
+    "Cargar más" de una lista ordenada por (time_column desc, id desc): filas
+    posteriores a la última recibida (su fecha y su id). Sin OFFSET, así cada
+    página cuesta lo mismo que la primera.
+    """
+    if before is None:
+        return query
+    if before_id is None:
+        return query.filter(time_column < before)
+    return query.filter(or_(
+        time_column < before,
+        and_(time_column == before, id_column < before_id)
+    ))
+
+
+def get_recent_checkouts(db: Session, limit: int = 10, before: Optional[datetime] = None,
+                         before_id: Optional[int] = None):
     """
     Obtiene los checkouts más recientes
     Útil para mostrar en el modal de eliminación
-    """
-    checkouts = db.query(models.Stay).filter(
+    (una consulta con vehículo y usuario; before/before_id = página siguiente)
+    """
+    query = db.query(
+        models.Stay.id, models.Stay.check_in_time, models.Stay.check_out_time,
+        models.Stay.final_price, models.Stay.payment_method,
+        models.Vehicle.id.label("vehicle_id"), models.Vehicle.license_plate,
+        models.Vehicle.vehicle_type, models.Vehicle.country,
+        models.User.username
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.User, models.Stay.user_id == models.User.id
+    ).filter(
         models.Stay.status == models.StayStatus.COMPLETED,
         models.Stay.check_out_time.isnot(None)
+    )
+    rows = keyset_before(
+        query, models.Stay.check_out_time, models.Stay.id, before, before_id
     ).order_by(
-        models.Stay.check_out_time.desc()
+        models.Stay.check_out_time.desc(), models.Stay.id.desc()
     ).limit(limit).all()
     
-    result = []
-    for stay in checkouts:
-        user = db.query(models.User).filter(models.User.id == stay.user_id).first()
-        username = user.username if user else "Unknown"
-        
-        result.append({
-            "stay_id": stay.id,
-            "license_plate": stay.vehicle.license_plate if stay.vehicle else "Unknown",
-            "vehicle_type": stay.vehicle.vehicle_type if stay.vehicle else "Unknown",
-            "country": stay.vehicle.country if stay.vehicle else "Unknown",
-            "check_in_time": stay.check_in_time.isoformat() if stay.check_in_time else None,
-            "check_out_time": stay.check_out_time.isoformat() if stay.check_out_time else None,
-            "final_price": stay.final_price,
-            "payment_method": stay.payment_method.value if stay.payment_method else "Unknown",
-            "user": username
-        })
+    return [
+        {
+            "stay_id": row.id,
+            "license_plate": row.license_plate if row.vehicle_id is not None else "Unknown",
+            "vehicle_type": row.vehicle_type if row.vehicle_id is not None else "Unknown",
+            "country": row.country if row.vehicle_id is not None else "Unknown",
+            "check_in_time": row.check_in_time.isoformat() if row.check_in_time else None,
+            "check_out_time": row.check_out_time.isoformat() if row.check_out_time else None,
+            "final_price": row.final_price,
+            "payment_method": row.payment_method.value if row.payment_method else "Unknown",
+            "user": row.username or "Unknown"
+        }
+        for row in rows
+    ]
+
+
+def get_pending_transfers_rows(db: Session, limit: Optional[int] = None,
+                               before: Optional[datetime] = None, before_id: Optional[int] = None):
+    """
+    Transferencias sin confirmar con los datos de su estancia, vehículo,
+    plaza y usuario en una consulta (las más recientes primero)
+    """
+    query = db.query(
+        models.PendingTransfer.id, models.PendingTransfer.stay_id,
+        models.PendingTransfer.transaction_type, models.PendingTransfer.amount,
+        models.PendingTransfer.created_at, models.PendingTransfer.notes,
+        models.User.username.label("created_by"),
+        models.Vehicle.license_plate, models.Vehicle.country, models.Vehicle.vehicle_type,
+        models.Stay.status.label("stay_status"), models.Stay.check_in_time, models.Stay.check_out_time,
+        models.ParkingSpot.spot_number
+    ).join(
+        models.Stay, models.PendingTransfer.stay_id == models.Stay.id
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.ParkingSpot, models.Stay.parking_spot_id == models.ParkingSpot.id
+    ).outerjoin(
+        models.User, models.PendingTransfer.created_by_user_id == models.User.id
+    ).filter(models.PendingTransfer.confirmed == False)
+    query = keyset_before(
+        query, models.PendingTransfer.created_at, models.PendingTransfer.id, before, before_id
+    ).order_by(models.PendingTransfer.created_at.desc(), models.PendingTransfer.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
     
-    return result
+    return [
+        {
+            "id": row.id,
+            "stay_id": row.stay_id,
+            "transaction_type": row.transaction_type.value,
+            "amount": row.amount,
+            "created_at": row.created_at.isoformat(),
+            "created_by": row.created_by,
+            "notes": row.notes,
+            # Info del stay
+            "license_plate": row.license_plate,
+            "country": row.country,
+            "vehicle_type": row.vehicle_type,
+            "stay_status": row.stay_status.value,
+            "parking_spot": row.spot_number,
+            "check_in_time": row.check_in_time.isoformat() if row.check_in_time else None,
+            "check_out_time": row.check_out_time.isoformat() if row.check_out_time else None
+        }
+        for row in query.all()
+    ]
 
 # ============================================================================
 # FUNCIONES PARA OCUPACIÓN
@@ -2270,7 +2642,7 @@ def get_daily_occupancy_average(db: Session):
     Calcula la ocupación media para el día actual (histórica de todos los años)
     Ej: Si hoy es 14 de diciembre, promedia todos los 14 de diciembre registrados
     """
-    from datetime import datetime
+    from datetime import datetime, date, timedelta
     from zoneinfo import ZoneInfo
     
     today = datetime.now(ZoneInfo("Europe/Madrid"))
@@ -2288,23 +2660,26 @@ def get_daily_occupancy_average(db: Session):
     
     # Obtener todos los stays que estuvieron activos en este día/mes de cualquier año
     # Un stay está activo en una fecha si: check_in <= fecha < check_out
+    # (por día local: entró antes del fin de ese día y salió a partir de su fin)
+    first_check_in = db.query(func.min(models.Stay.check_in_time)).scalar()
+    day_ends = []
+    for year in range(first_check_in.year if first_check_in else today.year, today.year + 1):
+        try:
+            day_ends.append(local_day_start(date(year, current_month, current_day) + timedelta(days=1)))
+        except ValueError:
+            continue  # 29 de febrero en año no bisiesto
     
-    stays_on_this_day = db.query(models.Stay).filter(
+    stays_on_this_day = db.query(models.Stay).options(
+        joinedload(models.Stay.parking_spot)
+    ).filter(
         and_(
             models.Stay.status == models.StayStatus.COMPLETED,
-            models.Stay.check_in_time.isnot(None),
-            models.Stay.check_out_time.isnot(None),
-            extract('day', models.Stay.check_in_time) <= current_day,
-            extract('month', models.Stay.check_in_time) <= current_month,
-            or_(
-                extract('month', models.Stay.check_out_time) > current_month,
-                and_(
-                    extract('month', models.Stay.check_out_time) == current_month,
-                    extract('day', models.Stay.check_out_time) > current_day
-                )
-            )
+            or_(*[
+                and_(models.Stay.check_in_time < day_end, models.Stay.check_out_time >= day_end)
+                for day_end in day_ends
+            ])
         )
-    ).all()
+    ).all() if day_ends else []
     
     # Contar ocupación por tipo
     occupied = {"A": 0, "B": 0, "CB": 0, "C": 0, "CPLUS": 0}
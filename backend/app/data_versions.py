@@ -0,0 +1,227 @@
+"""
+Versiones de datos por familia y GET condicional (ETag / 304)
+
+El dashboard, los productos, la lista negra y las estancias activas se piden
+sin parar desde los terminales pero cambian poco. Cada familia de recursos
+tiene un token de versión que se renueva tras cada commit que toca sus
+tablas (eventos de la sesión de SQLAlchemy, así cuenta cualquier mutación
+de crud o de los routers). El ETag de una respuesta sale de la ruta, la
+query string y los tokens de sus familias.
+
+ConditionalGetMiddleware responde 304 Not Modified cuando el If-None-Match
+coincide, tras validar el JWT pero ANTES de tocar la base de datos: un
+sondeo sin cambios cuesta leer un diccionario y una respuesta vacía. Con
+Cache-Control: no-cache el navegador revalida solo y convierte el 304 en la
+respuesta que ya tenía; el frontend no cambia.
+
+Entre workers (PostgreSQL) el token nuevo se difunde por change_feed, así
+todos los workers acaban con el mismo. Si el listener se reconecta se
+renuevan todos los tokens locales por si se perdió algún aviso.
+"""
+
+import hashlib
+import secrets
+import threading
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import event
+
+from app import change_feed
+
+CHANNEL = "data_versions"
+
+# Tabla -> familias cuyas respuestas dependen de ella
+TABLE_FAMILIES = {
+    "stays": ("stays",),
+    "parking_spots": ("stays",),
+    "vehicles": ("stays", "blacklist"),
+    "blacklist": ("blacklist",),
+    "products": ("products",),
+}
+
+FAMILIES = sorted({family for families in TABLE_FAMILIES.values() for family in families})
+
+_versions: Dict[str, str] = {family: secrets.token_hex(6) for family in FAMILIES}
+_lock = threading.Lock()
+
+
+# ============================================================================
+# VERSIONES
+# ============================================================================
+
+def get_version(family: str) -> str:
+    with _lock:
+        return _versions[family]
+
+
+def _set_versions(families: Iterable[str], token: str):
+    with _lock:
+        for family in families:
+            if family in _versions:
+                _versions[family] = token
+
+
+def bump(families: Iterable[str]):
+    """Nueva versión para las familias (local y en el resto de workers)"""
+    families = sorted(set(families))
+    if not families:
+        return
+    token = secrets.token_hex(6)
+    _set_versions(families, token)
+    change_feed.notify(CHANNEL, f"{token}:{','.join(families)}")
+
+
+def _on_remote_bump(payload: Optional[str]):
+    if not payload:
+        # Reconexión: pudo perderse algún aviso, invalidar todo en local
+        for family in FAMILIES:
+            _set_versions([family], secrets.token_hex(6))
+        return
+    token, _, families = payload.partition(":")
+    _set_versions(families.split(","), token)
+
+
+def init_data_versions():
+    """Suscripción a los cambios de otros workers (antes de start_listener)"""
+    change_feed.subscribe(CHANNEL, _on_remote_bump)
+
+
+# ============================================================================
+# EVENTOS DE SESIÓN: QUÉ FAMILIAS TOCA CADA TRANSACCIÓN
+# ============================================================================
+
+def _mark_tables(session, table_names):
+    touched = session.info.setdefault("data_families", set())
+    for name in table_names:
+        touched.update(TABLE_FAMILIES.get(name, ()))
+
+
+def _after_flush(session, flush_context):
+    objects = list(session.new) + list(session.dirty) + list(session.deleted)
+    _mark_tables(session, {getattr(obj, "__tablename__", None) for obj in objects})
+
+
+def _do_orm_execute(state):
+    # INSERT/UPDATE/DELETE en bloque (db.execute(insert(...)), query.update())
+    if state.is_select:
+        return
+    table = getattr(state.statement, "table", None)
+    if table is None and state.bind_mapper is not None:
+        table = state.bind_mapper.local_table
+    if table is not None:
+        _mark_tables(state.session, [table.name])
+
+
+def _after_commit(session):
+    families = session.info.pop("data_families", None)
+    if families:
+        bump(families)
+
+
+def _after_rollback(session):
+    session.info.pop("data_families", None)
+
+
+def install_session_hooks(session_factory):
+    """Engancha los eventos a la fábrica de sesiones (una vez)"""
+    if event.contains(session_factory, "after_commit", _after_commit):
+        return
+    event.listen(session_factory, "after_flush", _after_flush)
+    event.listen(session_factory, "do_orm_execute", _do_orm_execute)
+    event.listen(session_factory, "after_commit", _after_commit)
+    event.listen(session_factory, "after_rollback", _after_rollback)
+
+
+# ============================================================================
+# GET CONDICIONAL
+# ============================================================================
+
+def conditional_get(*families: str):
+    """
+    Decorador de endpoint: respuestas con ETag según las familias indicadas
+    y 304 si el cliente ya tiene la versión actual
+    """
+    unknown = set(families) - set(FAMILIES)
+    if unknown:
+        raise ValueError(f"Familias desconocidas: {sorted(unknown)}")
+
+    def decorator(endpoint):
+        endpoint.etag_families = families
+        return endpoint
+    return decorator
+
+
+def compute_etag(scope, families) -> str:
+    with _lock:
+        tokens = [_versions[family] for family in families]
+    raw = "|".join([scope["path"], scope.get("query_string", b"").decode("latin-1"), *tokens])
+    return '"' + hashlib.blake2b(raw.encode(), digest_size=12).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110 §13.1.2)"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _token_is_valid(authorization: str) -> bool:
+    """JWT firmado y sin caducar (sin consultar el usuario en la BD)"""
+    from jose import JWTError, jwt
+    from app.dependencies import SECRET_KEY, ALGORITHM
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub") is not None
+    except JWTError:
+        return False
+
+
+class ConditionalGetMiddleware:
+    """Middleware ASGI: ETag y 304 para los endpoints con @conditional_get"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        from app.metrics import match_route
+
+        families = getattr(getattr(match_route(scope), "endpoint", None), "etag_families", None)
+        if not families:
+            await self.app(scope, receive, send)
+            return
+
+        # Versión leída ANTES que los datos: si cambian mientras se consulta,
+        # el ETag queda viejo y el siguiente sondeo recibe los datos nuevos
+        etag = compute_etag(scope, families)
+        headers = {}
+        for name, value in scope.get("headers", []):
+            if name in (b"if-none-match", b"authorization"):
+                headers[name] = value.decode("latin-1")
+
+        if (_etag_matches(headers.get(b"if-none-match", ""), etag)
+                and _token_is_valid(headers.get(b"authorization", ""))):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(b"etag", etag.encode()), (b"cache-control", b"no-cache")],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"etag", etag.encode()), (b"cache-control", b"no-cache")
+                ]}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
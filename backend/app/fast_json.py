@@ -0,0 +1,39 @@
+"""
+Camino rápido de serialización JSON para los endpoints de lectura grandes
+
+Con FAST_JSON=true, /api/stays/active, /api/history/, /api/cash/closed-sessions
+y /api/analytics/payment-methods-detailed leen con consultas de proyección
+(tuplas de columnas, sin objetos ORM) y devuelven FastJSONResponse: orjson
+serializa directamente datetimes y enums, sin jsonable_encoder ni validación
+Pydantic de la respuesta. Menos CPU por respuesta en la Raspberry.
+
+La salida es idéntica byte a byte a la del camino normal
+(benchmarks/check_fast_json.py lo comprueba). Sin orjson instalado se usa
+siempre el camino normal.
+"""
+
+import os
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+
+
+def enabled() -> bool:
+    """¿Usar el camino rápido en esta petición?"""
+    return FAST_JSON and orjson is not None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Respuesta serializada con orjson. OPT_UTC_Z escribe UTC como 'Z', igual
+    que Pydantic; el resto (ISO 8601, enums por valor, floats) ya coincide.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,78 @@
+"""
+Días locales (Europe/Madrid) en consultas SQL
+
+- local_day_range: un filtro "del día X al día Y" en hora de Madrid como
+  rango semiabierto de marcas de tiempo [inicio de X, inicio de Y+1). La
+  columna queda desnuda en el WHERE y la consulta usa su índice.
+- local_date / local_timestamp: fecha y hora locales de una columna para
+  agrupar. func.date() o extract() sobre la columna agrupan por la zona
+  horaria de la sesión de la BD, no por la de Madrid (mal a medianoche).
+
+Las agrupaciones por día de stays usan las columnas generadas e indexadas
+check_in_local_date / check_out_local_date (local_date calculado al
+escribir, ver models.Stay y schema_updates).
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Date, DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+TIMEZONE = "Europe/Madrid"
+MADRID = ZoneInfo(TIMEZONE)
+
+
+def local_day_start(day: date) -> datetime:
+    """00:00 hora de Madrid del día indicado"""
+    return datetime.combine(day, time.min, tzinfo=MADRID)
+
+
+def local_day_range(start_day: date, end_day: Optional[date] = None) -> Tuple[datetime, datetime]:
+    """
+    [00:00 de start_day, 00:00 del día siguiente a end_day) en hora de Madrid.
+    Usar como column >= inicio AND column < fin.
+    """
+    return local_day_start(start_day), local_day_start((end_day or start_day) + timedelta(days=1))
+
+
+# ============================================================================
+# EXPRESIONES SQL
+# ============================================================================
+
+class local_timestamp(FunctionElement):
+    """Marca de tiempo en hora de Madrid, sin zona (para extract de hora, día...)"""
+    type = DateTime()
+    name = "local_timestamp"
+    inherit_cache = True
+
+
+class local_date(FunctionElement):
+    """Fecha local de Madrid de una marca de tiempo"""
+    type = Date()
+    name = "local_date"
+    inherit_cache = True
+
+
+@compiles(local_timestamp)
+def _local_timestamp(element, compiler, **kw):
+    # SQLite (desarrollo) guarda la hora local tal cual, sin zona
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(local_timestamp, "postgresql")
+def _local_timestamp_postgresql(element, compiler, **kw):
+    return f"({compiler.process(element.clauses, **kw)} AT TIME ZONE '{TIMEZONE}')"
+
+
+@compiles(local_date)
+def _local_date(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(local_date, "postgresql")
+def _local_date_postgresql(element, compiler, **kw):
+    # timezone(text, timestamptz) es inmutable: válido en columnas generadas
+    return f"(({compiler.process(element.clauses, **kw)} AT TIME ZONE '{TIMEZONE}')::date)"
@@ -1,13 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Header, Path
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
-from app.database import engine, get_db
+from app.database import engine, get_db, SessionLocal, analytics_engine
 from app import models
-from app.api import auth, stays, dashboard, history, cash, products
-from app.crud import register_prepayment, checkout_with_prepayment, print_ticket
+from app.api import auth, stays, dashboard, history, cash, products, detections
+from app.crud import register_prepayment, checkout_with_prepayment, get_payment_methods_detailed_rows
+from app.print_ticket import print_ticket
 from app.crud import check_blacklist, mark_stay_as_sinpa, get_all_blacklist, resolve_blacklist_entry
 from app.dependencies import get_current_active_user
-from typing import Optional
+from app.blacklist_index import init_blacklist_index
+from app.plate_index import init_plate_index
+from app.campaigns import init_campaign_aggregates, MIN_CAMPAIGN_YEAR
+from app.schema_updates import apply_schema_updates
+from app import change_feed, metrics, fast_json, data_versions, workloads, pending_expiry, partitions
+from app.local_dates import local_day_range
+from typing import List, Optional
 import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -15,6 +23,7 @@ from sqlalchemy import func
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+apply_schema_updates(engine)
 
 app = FastAPI(
     title="Caravan Parking Management API",
@@ -23,6 +32,13 @@ app = FastAPI(
     redoc_url="/redoc"  # URL for ReDoc
 )
 
+# ============================================================================
+# GET CONDICIONAL (ETag / 304) - dentro de CORS para que los 304 lleven sus
+# cabeceras (el último middleware añadido es el más externo)
+# ============================================================================
+app.add_middleware(data_versions.ConditionalGetMiddleware)
+data_versions.install_session_hooks(SessionLocal)
+
 # ============================================================================
 # CORS DINÁMICO - Funciona en Local y Producción
 # ============================================================================
@@ -37,6 +53,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============================================================================
+# MÉTRICAS (latencia por ruta, códigos de estado, consultas SQL)
+# ============================================================================
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.install_query_hooks(engine)
+metrics.install_query_hooks(analytics_engine)
+
 # Include API routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(stays.router, prefix="/api")
@@ -44,12 +67,41 @@ app.include_router(dashboard.router, prefix="/api")
 app.include_router(history.router, prefix="/api")
 app.include_router(cash.router, prefix="/api")
 app.include_router(products.router, prefix="/api")
+app.include_router(detections.router, prefix="/api")
+
+@app.on_event("startup")
+def load_memory_indexes():
+    """Carga las cachés en memoria y escucha cambios de otros workers"""
+    init_blacklist_index()
+    init_plate_index()
+    init_campaign_aggregates()
+    data_versions.init_data_versions()
+    change_feed.start_listener()
+    pending_expiry.start_expiry()
+    partitions.start_partition_maintenance()
+
+
+@app.on_event("shutdown")
+def stop_change_listener():
+    change_feed.stop_listener()
+    pending_expiry.stop_expiry()
+    partitions.stop_partition_maintenance()
+
 
 @app.get("/")
 async def root():
     return {"message": "Caravan Parking Management API"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """Métricas en formato Prometheus (protegidas si METRICS_TOKEN está definido)"""
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and authorization != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de métricas no válido")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # ============================================================================
 # NUEVAS RUTAS - AÑADIDAS PARA PAGOS Y TICKETS
 # ============================================================================
@@ -73,30 +125,22 @@ import requests
 from app import schemas
 
 @app.post("/api/print-ticket")
-async def print_ticket_endpoint(
+def print_ticket_endpoint(
     ticket_data: schemas.PrintTicketRequest,
     current_user: models.User = Depends(get_current_active_user)
 ):
-    """Imprime un ticket llamando directamente al módulo print_ticket (sin Flask)"""
+    """Imprime un ticket en proceso (destino según PRINTER_TYPE: usb, network o file)"""
+    # def, no async: FastAPI la ejecuta en su pool de hilos. Una impresora de
+    # red apagada espera hasta su timeout sin bloquear el resto de terminales
     
     try:
-        from app.print_ticket import print_ticket
-        import os
-        
-        # Obtener configuración de impresora desde variables de entorno
-        PRINTER_HOST = os.getenv("PRINTER_HOST", "192.168.1.100")
-        PRINTER_PORT = int(os.getenv("PRINTER_PORT", "9100"))
-        
-        # Llamar a la función de impresión
         result = print_ticket(
             ticket_type=ticket_data.type,
             license_plate=ticket_data.license_plate,
             check_in_time=ticket_data.check_in_time,
             check_out_time=ticket_data.check_out_time,
             amount=ticket_data.amount,
-            spot_type=ticket_data.spot_type,
-            printer_host=PRINTER_HOST,
-            printer_port=PRINTER_PORT
+            spot_type=ticket_data.spot_type
         )
         
         return result
@@ -126,7 +170,7 @@ async def get_checkouts_due_today(
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Estancias prepagadas con salida prevista HOY"""
-    today = datetime.now(ZoneInfo("Europe/Madrid")).date()
+    today_start, tomorrow_start = local_day_range(datetime.now(ZoneInfo("Europe/Madrid")).date())
     
     stays = db.query(models.Stay).options(
         joinedload(models.Stay.vehicle),
@@ -134,7 +178,8 @@ async def get_checkouts_due_today(
     ).filter(
         models.Stay.status == models.StayStatus.ACTIVE,
         models.Stay.payment_status == models.PaymentStatus.PREPAID,
-        func.date(models.Stay.check_out_time) == today
+        models.Stay.check_out_time >= today_start,
+        models.Stay.check_out_time < tomorrow_start
     ).order_by(models.Stay.check_out_time).all()
     
     return {
@@ -179,6 +224,7 @@ async def mark_sinpa_endpoint(
 
 
 @app.get("/api/blacklist/")
+@data_versions.conditional_get("blacklist")
 async def get_blacklist(
     resolved: bool = False,
     db: Session = Depends(get_db),
@@ -277,6 +323,7 @@ from app.crud import (
 )
 
 @app.get("/api/analytics/overview")
+@workloads.analytics
 async def analytics_overview(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -286,6 +333,7 @@ async def analytics_overview(
 
 
 @app.get("/api/analytics/revenue-timeline")
+@workloads.analytics
 async def analytics_revenue_timeline(
     days: int = 30,
     db: Session = Depends(get_db),
@@ -296,6 +344,7 @@ async def analytics_revenue_timeline(
 
 
 @app.get("/api/analytics/country-distribution")
+@workloads.analytics
 async def analytics_country_distribution(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -305,6 +354,7 @@ async def analytics_country_distribution(
 
 
 @app.get("/api/analytics/peak-hours")
+@workloads.analytics
 async def analytics_peak_hours(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -314,6 +364,7 @@ async def analytics_peak_hours(
 
 
 @app.get("/api/analytics/vehicle-types")
+@workloads.analytics
 async def analytics_vehicle_types(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -323,6 +374,7 @@ async def analytics_vehicle_types(
 
 
 @app.get("/api/analytics/payment-methods")
+@workloads.analytics
 async def analytics_payment_methods(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -332,6 +384,7 @@ async def analytics_payment_methods(
 
 
 @app.get("/api/analytics/stay-duration-by-country")
+@workloads.analytics
 async def analytics_stay_duration(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -341,6 +394,7 @@ async def analytics_stay_duration(
 
 
 @app.get("/api/analytics/monthly-comparison")
+@workloads.analytics
 async def analytics_monthly_comparison(
     months: int = 6,
     db: Session = Depends(get_db),
@@ -351,6 +405,7 @@ async def analytics_monthly_comparison(
 
 
 @app.get("/api/analytics/weekday-distribution")
+@workloads.analytics
 async def analytics_weekday_distribution(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -359,6 +414,7 @@ async def analytics_weekday_distribution(
     return get_weekday_distribution(db)
 
 @app.get("/api/analytics/rental-vs-owned")
+@workloads.analytics
 async def analytics_rental_vs_owned(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -370,6 +426,7 @@ async def analytics_rental_vs_owned(
 # ============================================================================
 
 @app.get("/api/analytics/total-nights")
+@workloads.analytics
 async def analytics_total_nights(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -379,6 +436,7 @@ async def analytics_total_nights(
 
 
 @app.get("/api/analytics/nights-timeline")
+@workloads.analytics
 async def analytics_nights_timeline(
     days: int = 30,
     db: Session = Depends(get_db),
@@ -389,6 +447,7 @@ async def analytics_nights_timeline(
 
 
 @app.get("/api/analytics/stay-length-distribution")
+@workloads.analytics
 async def analytics_stay_length_distribution(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -397,6 +456,7 @@ async def analytics_stay_length_distribution(
     return get_stay_length_distribution(db)
 
 @app.get("/api/analytics/payment-methods-detailed")
+@workloads.analytics
 async def analytics_payment_methods_detailed(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -411,6 +471,11 @@ async def analytics_payment_methods_detailed(
     start_date = datetime.combine(campaign["start_date"], datetime.min.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
     end_date = datetime.combine(campaign["end_date"], datetime.max.time()).replace(tzinfo=ZoneInfo("Europe/Madrid"))
     
+    if fast_json.enabled():
+        return fast_json.FastJSONResponse(
+            get_payment_methods_detailed_rows(db, start_date, end_date)
+        )
+    
     # Obtener transacciones DE LA CAMPAÑA
     transactions = db.query(models.CashTransaction).filter(
         models.CashTransaction.transaction_type.in_([
@@ -496,6 +561,7 @@ async def analytics_payment_methods_detailed(
     }
 
 @app.get("/api/analytics/daily-occupancy-average")
+@workloads.analytics
 async def analytics_daily_occupancy_average(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
@@ -506,6 +572,8 @@ async def analytics_daily_occupancy_average(
 
 
 @app.get("/api/analytics/occupancy-period")
+@workloads.admission(cost=workloads.range_days)
+@workloads.analytics
 async def analytics_occupancy_period(
     start_date: str,
     end_date: str,
@@ -518,6 +586,8 @@ async def analytics_occupancy_period(
     return get_occupancy_by_period(db, start_date, end_date, country)
 
 @app.get("/api/analytics/user-performance")
+@workloads.admission(cost=workloads.range_days)
+@workloads.analytics
 async def analytics_user_performance(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
@@ -530,6 +600,7 @@ async def analytics_user_performance(
 
 
 @app.get("/api/analytics/checkins-around-today")
+@workloads.analytics
 async def analytics_checkins_around_today(
     days_before: int = 7,
     days_after: int = 7,
@@ -541,10 +612,97 @@ async def analytics_checkins_around_today(
     return get_checkins_around_today(db, days_before, days_after)
 
 @app.get("/api/analytics/payment-distribution-by-country")
+@workloads.analytics
 async def analytics_payment_distribution_by_country(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
 ):
     """Distribución por país para cada tipo de pago (campaña actual)"""
     from app.crud import get_payment_distribution_by_country
-    return get_payment_distribution_by_country(db)
\ No newline at end of file
+    return get_payment_distribution_by_country(db)
+
+# ============================================================================
+# COMPARATIVA DE CAMPAÑAS
+# ============================================================================
+
+@app.get("/api/analytics/campaigns")
+@workloads.analytics
+async def analytics_campaigns(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """Campañas con datos, de la primera a la actual"""
+    from app.campaigns import list_campaigns
+    return list_campaigns(db)
+
+
+@app.get("/api/analytics/campaigns/compare")
+@workloads.analytics
+async def analytics_campaigns_compare(
+    campaigns: Optional[List[str]] = Query(None),
+    last: int = Query(3, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """
+    KPIs lado a lado: ?campaigns=2023/2024&campaigns=2024/2025
+    o las 'last' últimas campañas (incluida la actual)
+    """
+    from app.campaigns import compare_campaigns
+    try:
+        return compare_campaigns(db, campaigns, last)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/analytics/campaigns/{campaign_year}/refresh")
+@workloads.analytics
+async def analytics_campaign_refresh(
+    campaign_year: int = Path(..., ge=MIN_CAMPAIGN_YEAR),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """Recalcula (y vuelve a congelar) los KPIs de una campaña cerrada"""
+    from app.campaigns import get_campaign_kpis
+    try:
+        return get_campaign_kpis(db, campaign_year, refresh=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ============================================================================
+# INFORMES DESDE LA INSTANTÁNEA ANALÍTICA (PARQUET, SIN TOCAR LA BD)
+# ============================================================================
+
+@app.get("/api/analytics/snapshot/campaigns")
+@workloads.analytics
+def analytics_snapshot_campaigns(
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """Campañas disponibles en la instantánea nocturna"""
+    from app import analytics_snapshot
+    try:
+        return analytics_snapshot.list_campaigns()
+    except analytics_snapshot.SnapshotNotAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/analytics/snapshot/{report}")
+@workloads.analytics
+def analytics_snapshot_report(
+    report: str,
+    campaign: Optional[str] = None,
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """
+    Informe de analytics calculado sobre la instantánea Parquet.
+    campaign: '2024/2025' (por defecto la campaña actual)
+    """
+    from app import analytics_snapshot
+    if report not in analytics_snapshot.REPORTS:
+        raise HTTPException(status_code=404, detail=f"Informe desconocido: {report}")
+    try:
+        return analytics_snapshot.REPORTS[report](campaign=campaign)
+    except analytics_snapshot.SnapshotNotAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,333 @@
+"""
+Métricas de la API en formato de texto Prometheus (/metrics)
+
+- MetricsMiddleware: latencia por ruta (histograma), códigos de estado y
+  número de consultas SQL por petición
+- install_query_hooks: eventos de SQLAlchemy que cuentan y cronometran cada
+  consulta y registran las lentas (> SLOW_QUERY_MS) junto con su ruta
+- count_queries / query_budget: conteo de consultas de un bloque y máximo
+  declarado por endpoint (para cazar N+1 antes de que lleguen a producción)
+
+Las rutas se agrupan por plantilla ("/api/stays/{stay_id}"), no por URL, para
+no disparar la cardinalidad. Cada worker lleva sus propios contadores.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Modo desarrollo: cabeceras X-Query-Count / X-Query-Budget en cada respuesta
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [contadores por bucket..., suma, total]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {data[-1]}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {data[-2]}")
+                lines.append(f"{self.name}_count{labels} {data[-1]}")
+        return lines
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+REQUESTS = Counter(
+    "http_requests_total", "Peticiones HTTP por ruta y código de estado",
+    ("method", "route", "status")
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP",
+    ("method", "route")
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Consultas SQL por petición",
+    ("method", "route"), QUERY_COUNT_BUCKETS
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Peticiones HTTP en curso"
+)
+DB_QUERIES = Counter(
+    "db_queries_total", "Consultas SQL ejecutadas", ("method", "route")
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Duración de las consultas SQL", ("method", "route")
+)
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries_total", f"Consultas SQL de más de {SLOW_QUERY_MS:g} ms", ("method", "route")
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    "http_query_budget_exceeded_total", "Peticiones que superan su presupuesto de consultas",
+    ("method", "route")
+)
+
+ANALYTICS_SHED = Counter(
+    "analytics_requests_shed_total", "Informes rechazados con 429 por control de admisión",
+    ("endpoint", "reason")
+)
+ANALYTICS_COALESCED = Counter(
+    "analytics_requests_coalesced_total", "Informes servidos con el cálculo de otra petición idéntica",
+    ("endpoint",)
+)
+ANALYTICS_INFLIGHT_COST = Gauge(
+    "analytics_inflight_cost", "Coste estimado (días de datos) de los informes en curso"
+)
+
+_ALL = (REQUESTS, REQUEST_LATENCY, REQUEST_QUERIES, IN_PROGRESS,
+        DB_QUERIES, DB_QUERY_LATENCY, DB_SLOW_QUERIES, QUERY_BUDGET_EXCEEDED,
+        ANALYTICS_SHED, ANALYTICS_COALESCED, ANALYTICS_INFLIGHT_COST)
+
+
+def render() -> str:
+    lines = []
+    for metric in _ALL:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================================
+# CONSULTAS POR PETICIÓN
+# ============================================================================
+
+class RequestStats:
+    """Contadores de la petición en curso (compartidos con el threadpool)"""
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.queries = 0
+        self.query_time = 0.0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class QueryCounter:
+    """Resultado de count_queries: número de consultas y sus sentencias"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements: List[str] = []
+
+    def __len__(self):
+        return self.count
+
+
+_query_counters: ContextVar[tuple] = ContextVar("query_counters", default=())
+
+
+@contextmanager
+def count_queries():
+    """
+    Cuenta las consultas SQL ejecutadas dentro del bloque:
+
+        with count_queries() as queries:
+            crud.get_cash_transactions(db, session_id)
+        assert queries.count <= 3, queries.statements
+    """
+    counter = QueryCounter()
+    token = _query_counters.set(_query_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _query_counters.reset(token)
+
+
+def query_budget(max_queries: int):
+    """
+    Decorador de endpoint: máximo de consultas SQL por petición (incluida
+    la del usuario autenticado). Si se supera se avisa en el log y en
+    http_query_budget_exceeded_total; benchmarks/check_query_budgets.py falla.
+    """
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in _query_counters.get():
+        counter.count += 1
+        counter.statements.append(statement)
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    stats = current_request.get()
+    if stats:
+        stats.queries += 1
+        stats.query_time += elapsed
+        method, route = stats.method, stats.route
+    else:
+        method, route = "", "background"  # Arranque, cron, listener...
+
+    DB_QUERIES.inc(method, route)
+    DB_QUERY_LATENCY.observe(elapsed, method, route)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(method, route)
+        print(f"🐢 Consulta lenta ({elapsed * 1000:.0f} ms) en {method} {route}: "
+              f"{' '.join(statement.split())[:500]}")
+
+
+def _handle_error(exception_context):
+    """La consulta falló: descartar su marca de inicio"""
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def install_query_hooks(engine):
+    """Engancha el conteo/cronometraje de consultas al engine (una vez)"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# ============================================================================
+# MIDDLEWARE
+# ============================================================================
+
+def match_route(scope):
+    """Ruta que atenderá la petición (None si ninguna)"""
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia, estado y consultas SQL por ruta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        matched = match_route(scope)
+        route = getattr(matched, "path", "unmatched")
+        budget = getattr(getattr(matched, "endpoint", None), "query_budget", None)
+        stats = RequestStats(method, route)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if QUERY_COUNT_HEADER:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-query-count", str(stats.queries).encode()))
+                    if budget is not None:
+                        headers.append((b"x-query-budget", str(budget).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_PROGRESS.dec()
+            current_request.reset(token)
+            REQUESTS.inc(method, route, str(status_code))
+            REQUEST_LATENCY.observe(elapsed, method, route)
+            REQUEST_QUERIES.observe(stats.queries, method, route)
+            if budget is not None and stats.queries > budget:
+                QUERY_BUDGET_EXCEEDED.inc(method, route)
+                print(f"⚠️ {method} {route}: {stats.queries} consultas SQL "
+                      f"(presupuesto {budget}). ¿Un N+1?")
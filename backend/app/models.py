@@ -1,11 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, JSON, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Enum, JSON, Float, Computed, Index, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import enum
 
+from app.plates import normalize_plate
+from app.local_dates import local_date
+
 Base = declarative_base()
 
 # Helper function para timezone de Madrid
@@ -58,15 +61,29 @@ class Vehicle(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     license_plate = Column(String, unique=True, index=True)
+    plate_key = Column(String, index=True)  # ← Matrícula normalizada (ver app/plates.py)
     vehicle_type = Column(String)
     brand = Column(String, nullable=True)
     country = Column(String, nullable=True)
     is_blacklisted = Column(Boolean, default=False)
     is_rental = Column(Boolean, default=False)  # ← Vehículos de alquiler
     
+    # Estadísticas de cliente (estancias COMPLETED), ver app/vehicle_stats.py
+    visit_count = Column(Integer, default=0)
+    total_spent = Column(Float, default=0.0)
+    total_nights = Column(Integer, default=0)
+    nights_visit_count = Column(Integer, default=0)  # Visitas de al menos una noche
+    last_visit_at = Column(DateTime(timezone=True), nullable=True)
+    last_payment_status = Column(Enum(PaymentStatus), nullable=True)
+    
     # Relationships
     stays = relationship("Stay", back_populates="vehicle")
     blacklist_entries = relationship("Blacklist", back_populates="vehicle")
+    
+    @validates("license_plate")
+    def _set_plate_key(self, key, value):
+        self.plate_key = normalize_plate(value)
+        return value
 
 class ParkingSpot(Base):
     __tablename__ = "parking_spots"
@@ -83,11 +100,14 @@ class Stay(Base):
     __tablename__ = "stays"
     
     id = Column(Integer, primary_key=True, index=True)
-    vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), index=True)
     parking_spot_id = Column(Integer, ForeignKey("parking_spots.id"), nullable=True)
     detection_time = Column(DateTime(timezone=True), default=madrid_now)
-    check_in_time = Column(DateTime(timezone=True), nullable=True)
-    check_out_time = Column(DateTime(timezone=True), nullable=True)
+    check_in_time = Column(DateTime(timezone=True), nullable=True, index=True)
+    check_out_time = Column(DateTime(timezone=True), nullable=True, index=True)
+    # Día local de Madrid, calculado por la BD (agrupar por día con índice)
+    check_in_local_date = Column(Date, Computed(local_date(check_in_time)), index=True)
+    check_out_local_date = Column(Date, Computed(local_date(check_out_time)), index=True)
     status = Column(Enum(StayStatus), default=StayStatus.PENDING)
     final_price = Column(Float, nullable=True)
     payment_status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING)
@@ -101,6 +121,13 @@ class Stay(Base):
     cash_registered = Column(Boolean, default=False)
     prepayment_cash_registered = Column(Boolean, default=False)  # ← AÑADIR ESTE
     
+    # Lista de pendientes (recepción y dashboard): índice parcial, solo las PENDING
+    __table_args__ = (
+        Index("ix_stays_pending", "detection_time",
+              postgresql_where=text("status = 'PENDING'"),
+              sqlite_where=text("status = 'PENDING'")),
+    )
+    
     # Relationships (siempre al final)
     vehicle = relationship("Vehicle", back_populates="stays")
     parking_spot = relationship("ParkingSpot", back_populates="stays")
@@ -128,6 +155,7 @@ class Blacklist(Base):
     id = Column(Integer, primary_key=True, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
     license_plate = Column(String, index=True)
+    plate_key = Column(String, index=True)  # ← Matrícula normalizada
     reason = Column(String, default="sinpa")
     amount_owed = Column(Float)
     incident_date = Column(DateTime(timezone=True), default=madrid_now)  # ← TIMEZONE TRUE
@@ -138,6 +166,11 @@ class Blacklist(Base):
     # Relationships
     vehicle = relationship("Vehicle", back_populates="blacklist_entries")
     stay = relationship("Stay")
+    
+    @validates("license_plate")
+    def _set_plate_key(self, key, value):
+        self.plate_key = normalize_plate(value)
+        return value
 
 # ============================================================================
 # AÑADE ESTAS CLASES AL FINAL DE TU models.py (después de Blacklist)
@@ -283,4 +316,16 @@ class Product(Base):
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(ZoneInfo("Europe/Madrid")), onupdate=lambda: datetime.now(ZoneInfo("Europe/Madrid")))
     
     # Relaciones
-    transactions = relationship("CashTransaction", back_populates="product")
\ No newline at end of file
+    transactions = relationship("CashTransaction", back_populates="product")
+
+class CampaignAggregate(Base):
+    """
+    KPIs congelados de una campaña cerrada (sus datos ya no cambian).
+    Se calculan una vez y se sirven siempre desde aquí.
+    """
+    __tablename__ = "campaign_aggregates"
+    
+    campaign_year = Column(Integer, primary_key=True)  # 2024 -> campaña 2024/2025
+    campaign_name = Column(String, nullable=False)
+    kpis = Column(JSON, nullable=False)
+    computed_at = Column(DateTime(timezone=True), default=madrid_now)
@@ -0,0 +1,544 @@
+"""
+Particiones mensuales de history_logs y cash_transactions (PostgreSQL)
+
+Las dos tablas crecen sin parar (varias entradas del historial por acción,
+cada turno de caja) y nunca se podaban. En PostgreSQL son tablas
+particionadas por rango de "timestamp", una partición por mes de Madrid:
+
+    history_logs_p2025_10  [2025-10-01 00:00 Madrid, 2025-11-01 00:00 Madrid)
+    history_logs_default   red de seguridad: fechas sin partición (nunca falla un INSERT)
+
+Las consultas con filtro de fecha (analytics, rendimiento por usuario,
+historial, cajas) solo leen los meses de su rango: PostgreSQL descarta el
+resto de particiones al planificar.
+
+- Conversión: una sola vez y a mano (--convert), con la aplicación parada
+  o sin actividad: copia todas las filas con las tablas bloqueadas. La
+  clave primaria pasa a ser (id, timestamp), como exige PostgreSQL; el ORM
+  sigue identificando las filas por id (secuencia única). Mientras no se
+  convierten, todo funciona igual sobre las tablas normales.
+- Creación automática: al arrancar (schema_updates) y cada
+  PARTITION_MAINTENANCE_HOURS se crean las particiones del mes en curso y de los PARTITION_MONTHS_AHEAD
+  siguientes. Si ya había filas de ese mes en la partición por defecto se
+  mueven a la nueva.
+- Archivo: las particiones de campañas cerradas (salvo las
+  ARCHIVE_KEEP_CAMPAIGNS más recientes) se separan de la tabla y pasan al
+  esquema "archive": dejan de aparecer en la aplicación y en sus informes,
+  pero siguen en la BD. Opcionalmente se exportan a Parquet (zstd) en
+  ARCHIVE_DIR y se eliminan. Se pueden volver a adjuntar con --restore.
+
+SQLite (desarrollo) no tiene particiones: todo esto no hace nada.
+
+Uso:
+    python3 -m app.partitions --status
+    python3 -m app.partitions --convert
+    python3 -m app.partitions --ensure
+    python3 -m app.partitions --archive [--keep-campaigns 2] [--export] [--drop]
+    python3 -m app.partitions --restore 2022/2023
+"""
+
+import argparse
+import enum
+import json
+import os
+import re
+import threading
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sqlalchemy import column, select, table as sql_table, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.types import Boolean, DateTime, Float, Integer
+
+from app import models
+from app.local_dates import MADRID, local_day_start
+from app.utils import get_campaign_year, parse_campaign_name
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", "24"))
+# Campañas cerradas que siguen adjuntas (informes de temporadas anteriores)
+ARCHIVE_KEEP_CAMPAIGNS = int(os.getenv("ARCHIVE_KEEP_CAMPAIGNS", "2"))
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "/app/backups/archive"))
+ARCHIVE_SCHEMA = "archive"
+EXPORT_CHUNK_SIZE = 10000
+
+PARTITIONED_TABLES = {
+    "history_logs": models.HistoryLog.__table__,
+    "cash_transactions": models.CashTransaction.__table__,
+}
+PARTITION_KEY = "timestamp"
+
+_PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+# ============================================================================
+# MESES Y NOMBRES
+# ============================================================================
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def _months(first: date, last: date) -> List[date]:
+    months, month = [], _month_start(first)
+    while month <= last:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month.year}_{month.month:02d}"
+
+
+def _bounds(month: date) -> Tuple[str, str]:
+    """Límites [inicio, fin) del mes en hora de Madrid, como literales timestamptz"""
+    return local_day_start(month).isoformat(), local_day_start(_next_month(month)).isoformat()
+
+
+def _partition_month(name: str) -> Optional[date]:
+    match = _PARTITION_NAME.match(name)
+    return date(int(match["year"]), int(match["month"]), 1) if match else None
+
+
+def _today() -> date:
+    return datetime.now(MADRID).date()
+
+
+# ============================================================================
+# CATÁLOGO
+# ============================================================================
+
+def _is_postgresql(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def _relkind(conn, name: str) -> Optional[str]:
+    """'r' tabla normal, 'p' particionada, None si no existe (esquema actual)"""
+    return conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :name AND n.nspname = current_schema()"
+    ), {"name": name}).scalar()
+
+
+def _exists(conn, name: str, schema: Optional[str] = None) -> bool:
+    qualified = f"{schema}.{name}" if schema else name
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": qualified}).scalar() is not None
+
+
+def attached_partitions(conn, table_name: str) -> List[str]:
+    return list(conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "JOIN pg_namespace n ON n.oid = p.relnamespace "
+        "WHERE p.relname = :table AND n.nspname = current_schema() ORDER BY c.relname"
+    ), {"table": table_name}).scalars())
+
+
+def archived_partitions(conn, table_name: str) -> List[str]:
+    return list(conn.execute(text(
+        "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relkind = 'r' AND c.relname LIKE :pattern ORDER BY c.relname"
+    ), {"schema": ARCHIVE_SCHEMA, "pattern": f"{table_name}_p%"}).scalars())
+
+
+# ============================================================================
+# CREACIÓN DE PARTICIONES
+# ============================================================================
+
+def _create_partition(conn, table_name: str, month: date) -> bool:
+    """Partición de un mes (si no existe ni está archivada). Devuelve si la creó"""
+    name = partition_name(table_name, month)
+    if _exists(conn, name) or _exists(conn, name, ARCHIVE_SCHEMA):
+        return False
+
+    start, end = _bounds(month)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS)"))
+    # Filas de ese mes que cayeron en la partición por defecto (si no, ATTACH falla)
+    default = f"{table_name}_default"
+    if _exists(conn, default):
+        conn.execute(text(
+            f'WITH moved AS (DELETE FROM {default} WHERE "{PARTITION_KEY}" >= :start '
+            f'AND "{PARTITION_KEY}" < :end RETURNING *) INSERT INTO {name} SELECT * FROM moved'
+        ), {"start": start, "end": end})
+    conn.execute(text(
+        f"ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return True
+
+
+def _convert_table(conn, table) -> int:
+    """Tabla normal -> particionada por mes, con sus filas. Devuelve cuántas"""
+    name = table.name
+    old = f"{name}_unpartitioned"
+    key = f'"{PARTITION_KEY}"'
+
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": old}).scalar()
+
+    # Filas antiguas sin fecha (anteriores al valor por defecto): la más antigua conocida
+    conn.execute(text(
+        f"UPDATE {old} SET {key} = COALESCE((SELECT min({key}) FROM {old}), now()) WHERE {key} IS NULL"
+    ))
+    first, last = conn.execute(text(f"SELECT min({key}), max({key}) FROM {old}")).one()
+
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})"))
+    conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {key} SET NOT NULL"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {name}.id"))
+    conn.execute(text(f"CREATE TABLE {name}_default PARTITION OF {name} DEFAULT"))
+
+    today = _today()
+    first_month = first.astimezone(MADRID).date() if first else today
+    last_month = max(last.astimezone(MADRID).date() if last else today, today)
+    for month in _months(first_month, last_month):
+        _create_partition(conn, name, month)
+
+    rows = conn.execute(text(f"INSERT INTO {name} SELECT * FROM {old}")).rowcount
+    conn.execute(text(f"DROP TABLE {old}"))
+
+    # Tras borrar la tabla vieja (mismos nombres). En una tabla particionada la
+    # clave primaria debe incluir la de partición; todo se crea en cada partición
+    conn.execute(text(f"ALTER TABLE {name} ADD PRIMARY KEY (id, {key})"))
+    for index in table.indexes:
+        conn.execute(CreateIndex(index))
+    for fk in table.foreign_keys:
+        conn.execute(text(
+            f"ALTER TABLE {name} ADD FOREIGN KEY ({fk.parent.name}) "
+            f"REFERENCES {fk.column.table.name} ({fk.column.name})"
+        ))
+    return rows
+
+
+def _lock(conn):
+    """Un solo worker a la vez crea o mueve particiones (hasta el commit)"""
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('partitions'))"))
+
+
+def ensure_partitions(conn, first_month: Optional[date] = None) -> int:
+    """
+    Particiones desde first_month (por defecto, el mes en curso) hasta
+    PARTITION_MONTHS_AHEAD meses vista. Devuelve cuántas creó.
+    """
+    if not _is_postgresql(conn):
+        return 0
+    _lock(conn)
+
+    today = _today()
+    last_month = _month_start(today)
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        last_month = _next_month(last_month)
+
+    created = 0
+    for name in PARTITIONED_TABLES:
+        if _relkind(conn, name) != "p":
+            continue
+        for month in _months(first_month or today, last_month):
+            created += _create_partition(conn, name, month)
+    return created
+
+
+def update_partitions(conn):
+    """
+    schema_updates: crea las particiones próximas. No convierte tablas: al
+    arrancar solo DDL rápido (ver convert_tables)
+    """
+    if not _is_postgresql(conn):
+        return
+    pending = [name for name in PARTITIONED_TABLES if _relkind(conn, name) == "r"]
+    if pending:
+        print(f"ℹ️ {', '.join(pending)} sin particionar. Para convertirlas (una vez, "
+              f"con la aplicación parada): python3 -m app.partitions --convert")
+    created = ensure_partitions(conn)
+    if created:
+        print(f"✓ {created} particiones mensuales creadas")
+
+
+def convert_tables(engine) -> dict:
+    """
+    Convierte las tablas normales en particionadas (--convert). Cada tabla en
+    su transacción, bloqueada mientras se copian sus filas. Devuelve las
+    filas copiadas por tabla (solo las convertidas ahora)
+    """
+    converted = {}
+    if engine.dialect.name != "postgresql":
+        return converted
+
+    for name, table in PARTITIONED_TABLES.items():
+        with engine.begin() as conn:
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+            _lock(conn)
+            if _relkind(conn, name) == "r":
+                converted[name] = _convert_table(conn, table)
+    with engine.begin() as conn:
+        ensure_partitions(conn)
+    return converted
+
+
+# ============================================================================
+# MANTENIMIENTO EN SEGUNDO PLANO
+# ============================================================================
+
+_thread = None
+_stop_event = threading.Event()
+
+
+def _maintenance_loop():
+    from app.database import engine
+
+    while not _stop_event.wait(PARTITION_MAINTENANCE_HOURS * 3600):
+        try:
+            with engine.begin() as conn:
+                created = ensure_partitions(conn)
+            if created:
+                print(f"✓ {created} particiones mensuales creadas")
+        except Exception as e:
+            print(f"⚠️ Error creando particiones: {e}")
+
+
+def start_partition_maintenance():
+    """Arranca el hilo de creación de particiones (evento startup, solo PostgreSQL)"""
+    global _thread
+    from app.database import engine
+
+    if engine.dialect.name != "postgresql" or _thread is not None:
+        return
+
+    _stop_event.clear()
+    _thread = threading.Thread(target=_maintenance_loop, name="partitions", daemon=True)
+    _thread.start()
+
+
+def stop_partition_maintenance():
+    global _thread
+    _stop_event.set()
+    _thread = None
+
+
+# ============================================================================
+# ARCHIVO DE CAMPAÑAS CERRADAS
+# ============================================================================
+
+def _arrow_type(column_type):
+    import pyarrow as pa
+
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us", tz="Europe/Madrid")
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    return pa.string()  # String, Enum (valor), JSON (texto)
+
+
+def _arrow_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+
+def _archive_path(table_name: str, month: date) -> Path:
+    """Mismo esquema de carpetas que analytics_snapshot"""
+    campaign_year = get_campaign_year(month)
+    return (ARCHIVE_DIR / table_name / f"campaign={campaign_year}-{campaign_year + 1}"
+            / f"month={month:%Y-%m}" / "part-0.parquet")
+
+
+def _export_partition(conn, table, name: str, path: Path) -> int:
+    """Partición archivada -> Parquet. Devuelve las filas exportadas"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source = sql_table(name, *[column(c.name, c.type) for c in table.columns], schema=ARCHIVE_SCHEMA)
+    schema = pa.schema([pa.field(c.name, _arrow_type(c.type)) for c in table.columns])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+
+    rows = 0
+    result = conn.execution_options(stream_results=True).execute(select(source).order_by(source.c.id))
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        for chunk in result.partitions(EXPORT_CHUNK_SIZE):
+            columns = list(zip(*[[_arrow_value(value) for value in row] for row in chunk]))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows += len(chunk)
+    tmp.replace(path)
+    return rows
+
+
+def _has_archive_schema(conn) -> bool:
+    return conn.execute(text("SELECT to_regnamespace(:schema)"), {"schema": ARCHIVE_SCHEMA}).scalar() is not None
+
+
+def archive_closed_campaigns(engine, keep_campaigns: int = ARCHIVE_KEEP_CAMPAIGNS,
+                             export: bool = False, drop: bool = False) -> List[dict]:
+    """
+    Separa las particiones de campañas cerradas anteriores a las
+    keep_campaigns más recientes y las mueve al esquema archive.
+    export: exporta a Parquet las archivadas que aún no lo estén;
+    drop: las elimina de la BD una vez exportadas.
+    """
+    if drop and not export:
+        raise ValueError("--drop solo junto con --export (si no, se pierden los datos)")
+    if engine.dialect.name != "postgresql":
+        return []
+
+    # Campaña en curso: get_campaign_year(hoy); cerradas: las anteriores
+    last_archived_campaign = get_campaign_year(_today()) - 1 - keep_campaigns
+
+    # 1. Separar: solo DDL, transacción corta. DETACH bloquea la tabla madre;
+    #    mejor fallar que dejar en cola a la recepción tras un informe largo
+    archived = []
+    with engine.begin() as conn:
+        _lock(conn)
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        for table_name in PARTITIONED_TABLES:
+            for name in attached_partitions(conn, table_name):
+                month = _partition_month(name)
+                if month is None or get_campaign_year(month) > last_archived_campaign:
+                    continue
+                conn.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+                conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                archived.append({"table": table_name, "partition": name, "month": month.strftime("%Y-%m")})
+
+    if not export:
+        return archived
+
+    # 2. Exportar (fuera de la transacción anterior: sin bloquear nada)
+    exported = {entry["partition"]: entry for entry in archived}
+    with engine.connect() as conn:
+        pending = [(table_name, name) for table_name in PARTITIONED_TABLES
+                   for name in archived_partitions(conn, table_name)]
+    for table_name, name in pending:
+        month = _partition_month(name)
+        path = _archive_path(table_name, month)
+        entry = exported.setdefault(name, {"table": table_name, "partition": name,
+                                           "month": month.strftime("%Y-%m")})
+        if not path.exists():
+            with engine.connect() as conn:
+                entry["rows"] = _export_partition(conn, PARTITIONED_TABLES[table_name], name, path)
+        entry["parquet"] = str(path)
+
+        # 3. Eliminar solo si el Parquet tiene todas las filas
+        if drop:
+            import pyarrow.parquet as pq
+
+            with engine.begin() as conn:
+                stored = conn.execute(text(f"SELECT count(*) FROM {ARCHIVE_SCHEMA}.{name}")).scalar()
+                written = pq.ParquetFile(path).metadata.num_rows
+                if stored != written:
+                    raise RuntimeError(f"{name}: {written} filas en {path} y {stored} en la BD")
+                conn.execute(text(f"DROP TABLE {ARCHIVE_SCHEMA}.{name}"))
+            entry["dropped"] = True
+    return list(exported.values())
+
+
+def restore_campaign(conn, campaign_year: int) -> List[str]:
+    """Vuelve a adjuntar las particiones archivadas (no eliminadas) de una campaña"""
+    if not _is_postgresql(conn):
+        return []
+    _lock(conn)
+
+    restored = []
+    if not _has_archive_schema(conn):
+        return restored
+    for table_name in PARTITIONED_TABLES:
+        for name in archived_partitions(conn, table_name):
+            month = _partition_month(name)
+            if month is None or get_campaign_year(month) != campaign_year:
+                continue
+            start, end = _bounds(month)
+            conn.execute(text(f"ALTER TABLE {ARCHIVE_SCHEMA}.{name} SET SCHEMA public"))
+            conn.execute(text(
+                f"ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+            ))
+            restored.append(name)
+    return restored
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def print_status(conn):
+    if not _is_postgresql(conn):
+        print("ℹ️ Particiones solo en PostgreSQL")
+        return
+    for table_name in PARTITIONED_TABLES:
+        kind = {"p": "particionada", "r": "sin particionar"}.get(_relkind(conn, table_name), "no existe")
+        print(f"\n{table_name} ({kind})")
+        for name in attached_partitions(conn, table_name):
+            rows = conn.execute(text(
+                "SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE oid = to_regclass(:name)"
+            ), {"name": name}).scalar()
+            print(f"  {name:<36} ~{rows:>9,} filas")
+        if _has_archive_schema(conn):
+            for name in archived_partitions(conn, table_name):
+                print(f"  {ARCHIVE_SCHEMA + '.' + name:<36} (archivada)")
+
+
+def main():
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Particiones de history_logs y cash_transactions")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--status", action="store_true", help="Particiones adjuntas y archivadas")
+    mode.add_argument("--convert", action="store_true",
+                      help="Convertir las tablas en particionadas (una vez, con la aplicación parada)")
+    mode.add_argument("--ensure", action="store_true", help="Crear las próximas particiones")
+    mode.add_argument("--archive", action="store_true", help="Archivar campañas cerradas")
+    mode.add_argument("--restore", metavar="CAMPAÑA", help="Volver a adjuntar una campaña ('2022/2023')")
+    parser.add_argument("--keep-campaigns", type=int, default=ARCHIVE_KEEP_CAMPAIGNS,
+                        help="Campañas cerradas que siguen adjuntas")
+    parser.add_argument("--export", action="store_true", help="Exportar a Parquet lo archivado")
+    parser.add_argument("--drop", action="store_true", help="Eliminar de la BD tras exportar")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.connect() as conn:
+            print_status(conn)
+    elif args.convert:
+        if engine.dialect.name != "postgresql":
+            print("ℹ️ Particiones solo en PostgreSQL")
+            return
+        converted = convert_tables(engine)
+        for name, rows in converted.items():
+            print(f"✓ {name} particionada por mes ({rows} filas)")
+        if not converted:
+            print("ℹ️ Las tablas ya estaban particionadas")
+    elif args.ensure:
+        with engine.begin() as conn:
+            update_partitions(conn)
+        print("✓ Particiones al día")
+    elif args.archive:
+        archived = archive_closed_campaigns(engine, args.keep_campaigns, args.export, args.drop)
+        for entry in archived:
+            extra = f" -> {entry['parquet']}" if "parquet" in entry else ""
+            if "rows" in entry:
+                extra += f" ({entry['rows']} filas)"
+            print(f"✓ {entry['partition']} archivada{' y eliminada' if entry.get('dropped') else ''}{extra}")
+        if not archived:
+            print("ℹ️ Nada que archivar")
+    else:
+        with engine.begin() as conn:
+            restored = restore_campaign(conn, parse_campaign_name(args.restore))
+        for name in restored:
+            print(f"✓ {name} adjuntada de nuevo")
+        if not restored:
+            print(f"ℹ️ No hay particiones archivadas de {args.restore} en la BD (¿exportadas y eliminadas?)")
+
+
+if __name__ == "__main__":
+    main()
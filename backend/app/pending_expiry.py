@@ -0,0 +1,67 @@
+"""
+Caducidad de detecciones pendientes
+
+Las lecturas del ANPR que nadie descarta (vehículos de paso, falsos
+positivos) se quedan PENDING para siempre e inflan /api/stays/pending y el
+dashboard. Un hilo de fondo las descarta cuando superan
+PENDING_EXPIRY_HOURS, con su entrada "Stay discarded - Expired" en el
+historial (crud.expire_stale_pending_stays). Así la lista de pendientes
+solo contiene llegadas reales.
+
+Cada worker arranca su hilo; el descarte es idempotente (UPDATE ...
+RETURNING), así que no se duplican descartes ni entradas del historial.
+PENDING_EXPIRY_HOURS=0 lo desactiva.
+"""
+
+import os
+import threading
+
+from app.database import SessionLocal
+
+PENDING_EXPIRY_HOURS = float(os.getenv("PENDING_EXPIRY_HOURS", "24"))
+PENDING_EXPIRY_INTERVAL_MINUTES = float(os.getenv("PENDING_EXPIRY_INTERVAL_MINUTES", "15"))
+
+_thread = None
+_stop_event = threading.Event()
+
+
+def expire_once() -> int:
+    """Una pasada: descarta las pendientes caducadas y devuelve cuántas"""
+    from app.crud import expire_stale_pending_stays
+
+    db = SessionLocal()
+    try:
+        expired = expire_stale_pending_stays(db, PENDING_EXPIRY_HOURS)
+        if expired:
+            print(f"✓ {expired} detecciones pendientes caducadas "
+                  f"(más de {PENDING_EXPIRY_HOURS:g} h) descartadas")
+        return expired
+    finally:
+        db.close()
+
+
+def _expiry_loop():
+    while not _stop_event.is_set():
+        try:
+            expire_once()
+        except Exception as e:
+            print(f"⚠️ Error caducando detecciones pendientes: {e}")
+        _stop_event.wait(PENDING_EXPIRY_INTERVAL_MINUTES * 60)
+
+
+def start_expiry():
+    """Arranca el hilo de caducidad (evento startup)"""
+    global _thread
+
+    if PENDING_EXPIRY_HOURS <= 0 or _thread is not None:
+        return
+
+    _stop_event.clear()
+    _thread = threading.Thread(target=_expiry_loop, name="pending-expiry", daemon=True)
+    _thread.start()
+
+
+def stop_expiry():
+    global _thread
+    _stop_event.set()
+    _thread = None
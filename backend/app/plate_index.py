@@ -0,0 +1,174 @@
+"""
+Índice en memoria de matrículas de vehículos para búsqueda aproximada
+
+PlateMatcher con las claves normalizadas de todos los vehículos conocidos.
+Se carga al arrancar, se amplía al crear vehículos y, con varios workers,
+se sincroniza por change_feed igual que la lista negra.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app import models, change_feed
+from app.database import SessionLocal
+from app.plates import PlateMatcher, MAX_MATCH_COST, normalize_plate, match_score
+
+CHANNEL = "vehicles_changed"
+
+
+class PlateIndex:
+    """Clave normalizada -> ids de vehículo, con búsqueda de similares"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matcher = PlateMatcher()
+        self._vehicles: Dict[str, List[int]] = {}
+        self.ready = False
+
+    def load(self, db: Session):
+        rows = db.query(models.Vehicle.id, models.Vehicle.license_plate).all()
+
+        vehicles: Dict[str, List[int]] = {}
+        for vehicle_id, license_plate in rows:
+            key = normalize_plate(license_plate)
+            if key:
+                vehicles.setdefault(key, []).append(vehicle_id)
+
+        matcher = PlateMatcher(vehicles)
+        with self._lock:
+            self._matcher = matcher
+            self._vehicles = vehicles
+            self.ready = True
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def add(self, vehicle_id: int, license_plate: str):
+        key = normalize_plate(license_plate)
+        if not key:
+            return
+        with self._lock:
+            ids = self._vehicles.setdefault(key, [])
+            if vehicle_id not in ids:
+                ids.append(vehicle_id)
+            self._matcher.add(key)
+
+    def search(self, license_plate: str, max_cost: int = MAX_MATCH_COST,
+               limit: int = 5, include_exact: bool = False) -> List[dict]:
+        """
+        Vehículos con matrícula parecida, del más al menos probable.
+        [{"plate_key", "vehicle_ids", "distance", "score"}, ...]
+        """
+        key = normalize_plate(license_plate)
+        if not key:
+            return []
+
+        with self._lock:
+            matches = self._matcher.search(key, max_cost)
+            candidates = []
+            for distance, match_key in matches:
+                if distance == 0 and not include_exact:
+                    continue
+                candidates.append({
+                    "plate_key": match_key,
+                    "vehicle_ids": list(self._vehicles.get(match_key, [])),
+                    "distance": distance,
+                    "score": match_score(distance)
+                })
+                if len(candidates) >= limit:
+                    break
+
+        return candidates
+
+
+plate_index = PlateIndex()
+
+
+def find_similar_vehicles(db: Session, license_plate: str, limit: int = 5) -> List[dict]:
+    """
+    Candidatos ordenados con los datos del vehículo:
+    [{"vehicle_id", "license_plate", "country", "distance", "score"}, ...]
+    """
+    return find_similar_vehicles_many(db, [license_plate], limit).get(license_plate, [])
+
+
+def find_similar_vehicles_many(db: Session, license_plates: Iterable[str],
+                               limit: int = 5) -> Dict[str, List[dict]]:
+    """
+    find_similar_vehicles de varias matrículas con una sola consulta.
+    Solo incluye las matrículas con algún candidato.
+    """
+    if not plate_index.ready:
+        return {}
+
+    searches = {plate: plate_index.search(plate, limit=limit) for plate in license_plates}
+    ids = {vehicle_id for candidates in searches.values() for c in candidates for vehicle_id in c["vehicle_ids"]}
+    if not ids:
+        return {}
+
+    vehicles = {
+        v.id: v for v in db.query(models.Vehicle).filter(models.Vehicle.id.in_(ids)).all()
+    }
+
+    results = {}
+    for plate, candidates in searches.items():
+        result = []
+        for candidate in candidates:
+            for vehicle_id in candidate["vehicle_ids"]:
+                vehicle = vehicles.get(vehicle_id)
+                if vehicle:
+                    result.append({
+                        "vehicle_id": vehicle.id,
+                        "license_plate": vehicle.license_plate,
+                        "country": vehicle.country,
+                        "distance": candidate["distance"],
+                        "score": candidate["score"]
+                    })
+        if result:
+            results[plate] = result[:limit]
+    return results
+
+
+def vehicle_created(vehicle: models.Vehicle):
+    """Llamar tras el commit de un vehículo nuevo"""
+    # Sin índice local (aún cargando) solo se avisa al resto de workers
+    if plate_index.ready:
+        plate_index.add(vehicle.id, vehicle.license_plate)
+    change_feed.notify(CHANNEL, str(vehicle.id))
+
+
+def vehicles_upserted(vehicles: Iterable[tuple]):
+    """Igual que vehicle_created para inserciones masivas: [(id, matrícula), ...]"""
+    for vehicle_id, license_plate in vehicles:
+        if plate_index.ready:
+            plate_index.add(vehicle_id, license_plate)
+        change_feed.notify(CHANNEL, str(vehicle_id))
+
+
+def _on_remote_change(payload: Optional[str]):
+    db = SessionLocal()
+    try:
+        if payload:
+            vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == int(payload)).first()
+            if vehicle:
+                plate_index.add(vehicle.id, vehicle.license_plate)
+        else:
+            plate_index.load(db)
+    finally:
+        db.close()
+
+
+def init_plate_index():
+    """Carga inicial (evento startup) y suscripción a cambios de otros workers"""
+    db = SessionLocal()
+    try:
+        plate_index.load(db)
+        print(f"✓ Índice de matrículas cargado ({len(plate_index)} claves)")
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el índice de matrículas: {e}")
+    finally:
+        db.close()
+
+    change_feed.subscribe(CHANNEL, _on_remote_change)
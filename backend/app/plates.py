@@ -0,0 +1,191 @@
+"""
+Normalización y comparación aproximada de matrículas
+
+Las lecturas de la cámara (ANPR) confunden caracteres parecidos ("0"/"O",
+"8"/"B"...) y meten espacios o guiones. Aquí se define:
+
+- normalize_plate: clave normalizada (mayúsculas, solo letras y números)
+- plate_distance: distancia de edición donde las confusiones típicas de OCR
+  cuestan menos que un cambio real
+- PlateMatcher: índice para buscar matrículas parecidas sin recorrer todas
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Costes en unidades enteras: un cambio "real" cuesta 4, una confusión OCR 1
+EDIT_COST = 4
+CONFUSION_COST = 1
+
+# Distancia máxima para considerar dos matrículas candidatas (4 = una edición)
+MAX_MATCH_COST = int(os.getenv("PLATE_MATCH_MAX_COST", "4"))
+
+OCR_CONFUSIONS = [
+    ("0", "O"), ("0", "D"), ("0", "Q"), ("O", "D"), ("O", "Q"),
+    ("1", "I"), ("1", "L"), ("1", "T"), ("I", "L"), ("I", "J"),
+    ("2", "Z"), ("5", "S"), ("6", "G"), ("8", "B"), ("3", "B"),
+    ("4", "A"), ("7", "T"), ("C", "G"), ("M", "N"), ("U", "V"),
+    ("K", "X"), ("E", "F"), ("P", "R"), ("H", "N"),
+]
+
+
+def _build_substitution_costs() -> Dict[Tuple[str, str], int]:
+    """
+    Coste de sustitución entre caracteres confundibles, cerrado por
+    caminos mínimos (Floyd-Warshall) para que la distancia sea coherente
+    (ir de O a D nunca cuesta más que pasar por 0).
+    """
+    chars = sorted({c for pair in OCR_CONFUSIONS for c in pair})
+    cost = {(a, b): (0 if a == b else EDIT_COST) for a in chars for b in chars}
+    for a, b in OCR_CONFUSIONS:
+        cost[(a, b)] = cost[(b, a)] = CONFUSION_COST
+
+    for k in chars:
+        for i in chars:
+            for j in chars:
+                via = cost[(i, k)] + cost[(k, j)]
+                if via < cost[(i, j)]:
+                    cost[(i, j)] = via
+
+    return {pair: c for pair, c in cost.items() if 0 < c < EDIT_COST}
+
+
+_SUBSTITUTION_COSTS = _build_substitution_costs()
+
+
+def normalize_plate(license_plate: Optional[str]) -> Optional[str]:
+    """'1234-abc ' -> '1234ABC'"""
+    if license_plate is None:
+        return None
+    return "".join(ch for ch in license_plate.upper() if ch.isalnum())
+
+
+def plate_distance(a: str, b: str) -> int:
+    """Distancia de edición ponderada entre dos claves normalizadas"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = [j * EDIT_COST for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        current = [i * EDIT_COST]
+        for j, cb in enumerate(b, 1):
+            if ca == cb:
+                substitution = previous[j - 1]
+            else:
+                substitution = previous[j - 1] + _SUBSTITUTION_COSTS.get((ca, cb), EDIT_COST)
+            current.append(min(
+                previous[j] + EDIT_COST,
+                current[j - 1] + EDIT_COST,
+                substitution
+            ))
+        previous = current
+
+    return previous[-1]
+
+
+def _build_canonical_map() -> Dict[str, str]:
+    """Cada carácter confundible -> representante de su grupo (O, D, Q -> 0...)"""
+    parent = {}
+
+    def find(c):
+        parent.setdefault(c, c)
+        while parent[c] != c:
+            c = parent[c]
+        return c
+
+    for a, b in OCR_CONFUSIONS:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return {c: find(c) for c in parent}
+
+
+_CANONICAL = _build_canonical_map()
+
+
+def canonical_plate(key: str) -> str:
+    """Clave con cada carácter sustituido por el representante de su grupo OCR"""
+    return "".join(_CANONICAL.get(ch, ch) for ch in key)
+
+
+def _deletion_variants(key: str, depth: int) -> Set[str]:
+    variants = {key}
+    frontier = {key}
+    for _ in range(depth):
+        frontier = {v[:i] + v[i + 1:] for v in frontier for i in range(len(v))}
+        variants |= frontier
+    return variants
+
+
+class PlateMatcher:
+    """
+    Índice para buscar matrículas parecidas sin recorrer todas.
+
+    Las confusiones OCR desaparecen en la forma canónica y cada edición
+    real cuesta EDIT_COST, así que dos claves a distancia <= max_cost tienen
+    formas canónicas a como mucho max_cost // EDIT_COST ediciones. Se
+    indexan las variantes por borrado de la forma canónica (estilo SymSpell)
+    y los candidatos se verifican con plate_distance.
+    """
+
+    def __init__(self, keys: Iterable[str] = (), max_cost: int = MAX_MATCH_COST):
+        self.max_cost = max_cost
+        self._depth = max_cost // EDIT_COST
+        self._variants: Dict[str, Set[str]] = {}
+        self._keys: Set[str] = set()
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str):
+        if not key or key in self._keys:
+            return
+        self._keys.add(key)
+        for variant in _deletion_variants(canonical_plate(key), self._depth):
+            self._variants.setdefault(variant, set()).add(key)
+
+    def search(self, key: str, max_cost: Optional[int] = None) -> List[Tuple[int, str]]:
+        """[(distancia, clave), ...] ordenado de más a menos parecido"""
+        if not key:
+            return []
+        max_cost = self.max_cost if max_cost is None else min(max_cost, self.max_cost)
+
+        candidates = set()
+        for variant in _deletion_variants(canonical_plate(key), self._depth):
+            candidates |= self._variants.get(variant, set())
+
+        results = []
+        for candidate in candidates:
+            distance = plate_distance(key, candidate)
+            if distance <= max_cost:
+                results.append((distance, candidate))
+
+        results.sort()
+        return results
+
+
+def rank_plates(license_plate: str, plates: Iterable[str],
+                max_cost: int = MAX_MATCH_COST) -> List[Tuple[int, str]]:
+    """Búsqueda lineal para conjuntos pequeños (p.ej. la lista negra)"""
+    key = normalize_plate(license_plate)
+    if not key:
+        return []
+
+    ranked = []
+    for plate in plates:
+        distance = plate_distance(key, normalize_plate(plate))
+        if distance <= max_cost:
+            ranked.append((distance, plate))
+
+    ranked.sort()
+    return ranked
+
+
+def match_score(distance: int) -> float:
+    """Distancia -> puntuación 0..1 para mostrar en pantalla"""
+    return round(max(0.0, 1 - distance / (2 * EDIT_COST)), 2)
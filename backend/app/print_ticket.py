@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 """
 Módulo de impresión térmica para Raspberry Pi
-Envía comandos ESC/POS directamente por USB
+Genera los comandos ESC/POS en proceso y los envía a la impresora
+(USB, red TCP 9100 o archivo) a través de un "sink" intercambiable
 """
 
 import os
+import socket
 from PIL import Image
 from pathlib import Path
 from datetime import datetime
@@ -15,57 +17,356 @@ LOGO_PATH = BASE_DIR / "static" / "logo_thermal.png"
 QR_PATH = BASE_DIR / "static" / "qr_thermal2.png"
 
 
+# Caché de rasters: los PNG casi nunca cambian, así que el raster GS v 0 se
+# genera una sola vez y se reutiliza en todos los tickets.
+RASTER_CACHE_DIR = Path(os.getenv("TICKET_RASTER_CACHE_DIR", "/tmp/ticket_raster_cache"))
+_raster_cache = {}
+
+# Tabla para invertir bits: en PIL modo '1' blanco=1, en ESC/POS negro=1
+_INVERT_TABLE = bytes(255 - i for i in range(256))
+
+
+def _load_monochrome(image_path):
+    """Abre la imagen, aplana la transparencia sobre blanco y la pasa a 1 bit"""
+    img = Image.open(image_path)
+    
+    if img.mode != '1':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            if img.mode == 'RGBA':
+                background.paste(img, mask=img.split()[3] if len(img.split()) > 3 else None)
+            img = background
+        
+        img = img.convert('L')
+        img = img.convert('1', dither=Image.Dither.FLOYDSTEINBERG)
+    
+    return img
+
+
+def _build_raster(image_path):
+    """Genera el comando GS v 0 completo empaquetando la imagen de una vez"""
+    img = _load_monochrome(image_path)
+    
+    width, height = img.size
+    width_bytes = (width + 7) // 8
+    
+    # Rellenar con blanco hasta múltiplo de 8 para que los bits de relleno
+    # no salgan negros al invertir
+    if width % 8:
+        padded = Image.new('1', (width_bytes * 8, height), 1)
+        padded.paste(img, (0, 0))
+        img = padded
+    
+    data = img.tobytes().translate(_INVERT_TABLE)
+    
+    header = b'\x1d\x76\x30' + bytes([
+        0,
+        width_bytes % 256, width_bytes // 256,
+        height % 256, height // 256
+    ])
+    return header + data
+
+
 def image_to_raster(image_path):
-    """Convierte imagen a formato GS v 0 (Raster Bit Image)"""
+    """
+    Convierte imagen a formato GS v 0 (Raster Bit Image).
+    
+    El resultado se cachea en memoria y en disco, indexado por la fecha de
+    modificación del PNG: si se sustituye el archivo, se regenera solo.
+    """
     if not os.path.exists(image_path):
         return b''
     
     try:
-        img = Image.open(image_path)
-        
-        if img.mode != '1':
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                if img.mode == 'RGBA':
-                    background.paste(img, mask=img.split()[3] if len(img.split()) > 3 else None)
-                img = background
-            
-            img = img.convert('L')
-            img = img.convert('1', dither=Image.Dither.FLOYDSTEINBERG)
-        
-        width, height = img.size
-        width_bytes = (width + 7) // 8
+        stat = os.stat(image_path)
+        key = (str(image_path), stat.st_mtime_ns, stat.st_size)
         
-        cmd = b'\x1d\x76\x30'
-        cmd += bytes([0])
-        cmd += bytes([width_bytes % 256, width_bytes // 256])
-        cmd += bytes([height % 256, height // 256])
+        cached = _raster_cache.get(key)
+        if cached is not None:
+            return cached
         
-        for y in range(height):
-            for x_byte in range(width_bytes):
-                byte_val = 0
-                for bit in range(8):
-                    x = x_byte * 8 + bit
-                    if x < width:
-                        pixel = img.getpixel((x, y))
-                        if pixel == 0:
-                            byte_val |= (1 << (7 - bit))
-                cmd += bytes([byte_val])
+        cache_file = RASTER_CACHE_DIR / f"{Path(image_path).stem}-{stat.st_mtime_ns}-{stat.st_size}.bin"
+        try:
+            raster = cache_file.read_bytes()
+        except OSError:
+            raster = _build_raster(image_path)
+            try:
+                RASTER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+                tmp_file.write_bytes(raster)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"[WARN] No se pudo guardar la caché de {Path(image_path).name}: {e}")
         
-        return cmd
+        _raster_cache[key] = raster
+        return raster
         
     except Exception as e:
         print(f"[WARN] Error procesando imagen: {e}")
         return b''
 
 
+# ============================================================================
+# DESTINOS DE IMPRESIÓN (SINKS)
+# ============================================================================
+
+class PrinterError(Exception):
+    """Error al enviar el ticket a la impresora (mensaje listo para el usuario)"""
+
+
+class UsbSink:
+    """Impresora conectada por USB (dispositivo de caracteres)"""
+    
+    def __init__(self, device: str = "/dev/usb/lp0"):
+        self.device = device
+    
+    def send(self, data: bytes):
+        try:
+            with open(self.device, 'wb') as printer:
+                printer.write(data)
+                printer.flush()
+        except FileNotFoundError:
+            raise PrinterError(f"Impresora USB no encontrada en {self.device}")
+        except PermissionError:
+            raise PrinterError("Sin permisos para acceder a la impresora USB. Ejecuta: sudo usermod -aG lp camperparkrpi")
+    
+    def __str__(self):
+        return f"USB {self.device}"
+
+
+class NetworkSink:
+    """Impresora de red en modo RAW (puerto 9100)"""
+    
+    def __init__(self, host: str, port: int = 9100, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+    
+    def send(self, data: bytes):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+                conn.sendall(data)
+        except OSError as e:
+            raise PrinterError(f"La impresora {self.host}:{self.port} no responde: {e}")
+    
+    def __str__(self):
+        return f"red {self.host}:{self.port}"
+
+
+class FileSink:
+    """Guarda el ticket en un archivo (testing sin impresora)"""
+    
+    def __init__(self, path: str = "/tmp/ticket_output.bin"):
+        self.path = path
+    
+    def send(self, data: bytes):
+        try:
+            with open(self.path, 'wb') as output:
+                output.write(data)
+        except OSError as e:
+            raise PrinterError(f"No se pudo escribir el ticket en {self.path}: {e}")
+    
+    def __str__(self):
+        return f"archivo {self.path}"
+
+
+def get_default_sink():
+    """
+    Destino de impresión según variables de entorno:
+    - PRINTER_TYPE: 'usb' (por defecto), 'network' o 'file'
+    - PRINTER_DEVICE: dispositivo USB (por defecto /dev/usb/lp0)
+    - PRINTER_HOST / PRINTER_PORT: impresora de red
+    - PRINTER_OUTPUT: archivo de salida en modo 'file'
+    """
+    printer_type = os.getenv("PRINTER_TYPE", "usb").lower()
+    
+    if printer_type == "network":
+        return NetworkSink(
+            os.getenv("PRINTER_HOST", "192.168.1.100"),
+            int(os.getenv("PRINTER_PORT", "9100"))
+        )
+    if printer_type == "file":
+        return FileSink(os.getenv("PRINTER_OUTPUT", "/tmp/ticket_output.bin"))
+    
+    return UsbSink(os.getenv("PRINTER_DEVICE", "/dev/usb/lp0"))
+
+
+# ============================================================================
+# PLANTILLA DEL TICKET
+# ============================================================================
+
+# Comandos ESC/POS
+ESC = b'\x1b'
+GS = b'\x1d'
+
+INIT = ESC + b'@'
+ALIGN_CENTER = ESC + b'a' + b'\x01'
+ALIGN_LEFT = ESC + b'a' + b'\x00'
+NORMAL = ESC + b'!' + b'\x00'
+DOUBLE_HEIGHT = ESC + b'!' + b'\x10'
+DOUBLE_WIDTH = ESC + b'!' + b'\x20'
+DOUBLE_BOTH = ESC + b'!' + b'\x30'
+BOLD_ON = ESC + b'E' + b'\x01'
+BOLD_OFF = ESC + b'E' + b'\x00'
+CUT = GS + b'V' + b'\x00'
+
+LINE = b'--------------------------------\n'
+DOUBLE_LINE = b'================================\n\n'
+BANK_ACCOUNT = b'ES57 0049 0097 8826 1124 1151'
+
+OPEN_EXIT_NOTICE = (
+    LINE + b'\n'
+    + ALIGN_CENTER + BOLD_ON
+    + b'ABONE SU CUENTA EL DIA ANTERIOR\n'
+    + b'A SU SALIDA:\n\n'
+    + BOLD_OFF
+    + b'- Efectivo: Dejar en el buzon\n'
+    + b'- Transferencia bancaria:\n'
+    + BOLD_ON + BANK_ACCOUNT + b'\n\n' + BOLD_OFF
+    + LINE + b'\n'
+    + BOLD_ON
+    + b'SETTLE YOUR ACCOUNT THE DAY\n'
+    + b'BEFORE YOUR DEPARTURE:\n\n'
+    + BOLD_OFF
+    + b'- Cash: Leave in mailbox\n'
+    + b'- Bank transfer:\n'
+    + BOLD_ON + BANK_ACCOUNT + b'\n\n' + BOLD_OFF
+)
+
+FOOTER = (
+    b'Escanee para comprobar el horario de autobuses\n\n'
+    + DOUBLE_LINE
+    + BOLD_ON + b'Autocaravanas Cordoba SLU\n' + BOLD_OFF
+    + b'CIF: B06952931\n'
+    + b'C/ Pintora Nuha Al Radi 14\n'
+    + b'Bloque 12, 4-1\n'
+    + b'14011 Cordoba\n\n'
+    + b'================================\n\n\n\n\n'
+    + CUT
+)
+
+
+def render_ticket(ticket_type: str, license_plate: str, check_in_time: str,
+                  amount: float, check_out_time: str = None, spot_type: str = None) -> bytes:
+    """
+    Construye el ticket completo en bytes ESC/POS (sin enviarlo).
+    
+    Las partes fijas (logo, QR, pie) vienen precalculadas y solo se
+    rellenan matrícula, fechas e importe.
+    """
+    # Formatear fechas
+    entry_dt = datetime.fromisoformat(check_in_time.replace('Z', '+00:00'))
+    entry_formatted = entry_dt.strftime('%d/%m/%Y').encode('utf-8')
+    
+    exit_formatted = None
+    nights = 0
+    if check_out_time:
+        exit_dt = datetime.fromisoformat(check_out_time.replace('Z', '+00:00'))
+        exit_formatted = exit_dt.strftime('%d/%m/%Y').encode('utf-8')
+        duration = exit_dt - entry_dt
+        nights = max(1, int(duration.total_seconds() / (24 * 3600)))
+    
+    parts = [INIT, ALIGN_CENTER]
+    
+    # LOGO
+    logo_data = image_to_raster(str(LOGO_PATH))
+    if logo_data:
+        parts += [logo_data, b'\n\n']
+    
+    # ENCABEZADO
+    parts += [DOUBLE_HEIGHT + BOLD_ON, b'TICKET DE PARKING\n\n', NORMAL + BOLD_OFF, LINE]
+    
+    # MATRÍCULA
+    parts += [
+        ALIGN_LEFT,
+        BOLD_ON + b'MATRICULA:       ' + BOLD_OFF,
+        DOUBLE_BOTH, license_plate.encode('utf-8'), b'\n', NORMAL
+    ]
+    
+    # PLAZA
+    if spot_type:
+        parts += [
+            BOLD_ON + b'PLAZA:           ' + BOLD_OFF,
+            DOUBLE_WIDTH, spot_type.encode('utf-8'), b'\n', NORMAL
+        ]
+    
+    parts.append(LINE)
+    
+    # FECHAS
+    parts += [BOLD_ON + b'ENTRADA:         ' + BOLD_OFF, entry_formatted, b'\n']
+    
+    if ticket_type == 'open_exit':
+        parts.append(OPEN_EXIT_NOTICE)
+    else:
+        if ticket_type in ['checkout', 'extension'] and exit_formatted:
+            parts += [
+                BOLD_ON + b'SALIDA:          ' + BOLD_OFF, exit_formatted, b'\n',
+                BOLD_ON + b'DURACION:        ' + BOLD_OFF, f'{nights} noches\n'.encode('utf-8')
+            ]
+        
+        # DESTACAR FECHA DE SALIDA en prepago y extensión
+        if ticket_type in ['prepayment', 'extension'] and exit_formatted:
+            parts += [
+                b'\n', ALIGN_CENTER, DOUBLE_BOTH + BOLD_ON,
+                b'SALIDA PREVISTA:\n', exit_formatted, b'\n',
+                NORMAL + BOLD_OFF, ALIGN_LEFT
+            ]
+        
+        parts.append(LINE + b'\n')
+        
+        # TIPO DE PAGO
+        parts += [
+            ALIGN_LEFT + BOLD_ON + b'TIPO DE PAGO:\n' + BOLD_OFF,
+            (b'[X] ' if ticket_type == 'prepayment' else b'[ ] ') + b'Pago adelantado\n',
+            (b'[X] ' if ticket_type == 'checkout' else b'[ ] ') + b'Checkout normal\n',
+            (b'[X] ' if ticket_type == 'extension' else b'[ ] ') + b'Extension de pago\n\n'
+        ]
+    
+    # TOTAL
+    if ticket_type != 'open_exit':
+        parts += [
+            ALIGN_CENTER + LINE,
+            DOUBLE_BOTH + BOLD_ON,
+            b'TOTAL PAGADO\n', f'{amount:.2f} EUR\n'.encode('utf-8'),
+            NORMAL + BOLD_OFF,
+            b'(IVA incluido)\n',
+            DOUBLE_LINE
+        ]
+        
+        # CUENTA BANCARIA en prepago y extensión
+        if ticket_type in ['prepayment', 'extension']:
+            parts += [
+                BOLD_ON + b'CUENTA BANCARIA / BANK ACCOUNT:\n' + BOLD_OFF,
+                BANK_ACCOUNT + b'\n',
+                DOUBLE_LINE
+            ]
+    else:
+        parts.append(ALIGN_CENTER + DOUBLE_LINE)
+    
+    # PIE
+    parts.append(b'Gracias por su visita\n')
+    
+    # QR
+    qr_data = image_to_raster(str(QR_PATH))
+    if qr_data:
+        parts += [qr_data, b'\n']
+    
+    parts.append(FOOTER)
+    
+    return b''.join(parts)
+
+
+# ============================================================================
+# IMPRESIÓN
+# ============================================================================
+
 def print_ticket(ticket_type: str, license_plate: str, check_in_time: str, 
                  amount: float, check_out_time: str = None, spot_type: str = None,
-                 printer_host: str = "192.168.1.100", printer_port: int = 9100):
+                 printer_host: str = None, printer_port: int = None, sink=None):
     """
-    Imprime ticket térmico directamente por USB
+    Imprime ticket térmico (en proceso, sin lanzar scripts externos)
     
     Args:
         ticket_type: 'checkout', 'prepayment', 'extension', 'open_exit'
@@ -74,183 +375,32 @@ def print_ticket(ticket_type: str, license_plate: str, check_in_time: str,
         amount: Importe total
         check_out_time: Fecha salida (ISO format, opcional)
         spot_type: Tipo de plaza ('A', 'B', 'C', 'Special')
-        printer_host: No se usa (compatibilidad)
-        printer_port: No se usa (compatibilidad)
+        printer_host: Si se indica, imprime por red en ese host
+        printer_port: Puerto de la impresora de red (por defecto 9100)
+        sink: Destino explícito (UsbSink, NetworkSink, FileSink).
+              Si no se indica, se usa get_default_sink()
     
     Returns:
         dict: {"success": bool, "message": str}
     """
+    if sink is None:
+        if printer_host:
+            sink = NetworkSink(printer_host, printer_port or 9100)
+        else:
+            sink = get_default_sink()
     
     try:
-        # Formatear fechas
-        entry_dt = datetime.fromisoformat(check_in_time.replace('Z', '+00:00'))
-        entry_formatted = entry_dt.strftime('%d/%m/%Y')
-        
-        exit_formatted = None
-        nights = 0
-        if check_out_time:
-            exit_dt = datetime.fromisoformat(check_out_time.replace('Z', '+00:00'))
-            exit_formatted = exit_dt.strftime('%d/%m/%Y')
-            duration = exit_dt - entry_dt
-            nights = max(1, int(duration.total_seconds() / (24 * 3600)))
-        
-        # Comandos ESC/POS
-        ESC = b'\x1b'
-        GS = b'\x1d'
-        
-        INIT = ESC + b'@'
-        ALIGN_CENTER = ESC + b'a' + b'\x01'
-        ALIGN_LEFT = ESC + b'a' + b'\x00'
-        NORMAL = ESC + b'!' + b'\x00'
-        DOUBLE_HEIGHT = ESC + b'!' + b'\x10'
-        DOUBLE_WIDTH = ESC + b'!' + b'\x20'
-        DOUBLE_BOTH = ESC + b'!' + b'\x30'
-        BOLD_ON = ESC + b'E' + b'\x01'
-        BOLD_OFF = ESC + b'E' + b'\x00'
-        CUT = GS + b'V' + b'\x00'
-        
-        # Conectar a impresora USB
-        printer_device = "/dev/usb/lp0"
-        printer = open(printer_device, 'wb')
-        
-        ticket = b''
-        ticket += INIT
-        ticket += ALIGN_CENTER
-        
-        # LOGO
-        if LOGO_PATH.exists():
-            logo_data = image_to_raster(str(LOGO_PATH))
-            if logo_data:
-                ticket += logo_data
-                ticket += b'\n\n'
-        
-        # ENCABEZADO
-        ticket += DOUBLE_HEIGHT + BOLD_ON
-        ticket += b'TICKET DE PARKING\n\n'
-        ticket += NORMAL + BOLD_OFF
-        ticket += b'--------------------------------\n'
-        
-        # MATRÍCULA
-        ticket += ALIGN_LEFT
-        ticket += BOLD_ON + b'MATRICULA:       ' + BOLD_OFF
-        ticket += DOUBLE_BOTH
-        ticket += license_plate.encode('utf-8') + b'\n'
-        ticket += NORMAL
-        
-        # PLAZA
-        if spot_type:
-            ticket += BOLD_ON + b'PLAZA:           ' + BOLD_OFF
-            ticket += DOUBLE_WIDTH
-            ticket += spot_type.encode('utf-8') + b'\n'
-            ticket += NORMAL
-        
-        ticket += b'--------------------------------\n'
-        
-        # FECHAS
-        ticket += BOLD_ON + b'ENTRADA:         ' + BOLD_OFF
-        ticket += entry_formatted.encode('utf-8') + b'\n'
-        
-        if ticket_type == 'open_exit':
-            ticket += b'--------------------------------\n\n'
-            ticket += ALIGN_CENTER + BOLD_ON
-            ticket += b'ABONE SU CUENTA EL DIA ANTERIOR\n'
-            ticket += b'A SU SALIDA:\n\n'
-            ticket += BOLD_OFF
-            ticket += b'- Efectivo: Dejar en el buzon\n'
-            ticket += b'- Transferencia bancaria:\n'
-            ticket += BOLD_ON
-            ticket += b'ES57 0049 0097 8826 1124 1151\n\n'
-            ticket += BOLD_OFF
-            ticket += b'--------------------------------\n\n'
-            ticket += BOLD_ON
-            ticket += b'SETTLE YOUR ACCOUNT THE DAY\n'
-            ticket += b'BEFORE YOUR DEPARTURE:\n\n'
-            ticket += BOLD_OFF
-            ticket += b'- Cash: Leave in mailbox\n'
-            ticket += b'- Bank transfer:\n'
-            ticket += BOLD_ON
-            ticket += b'ES57 0049 0097 8826 1124 1151\n\n'
-            ticket += BOLD_OFF
-        else:
-            if ticket_type in ['checkout', 'extension'] and exit_formatted:
-                ticket += BOLD_ON + b'SALIDA:          ' + BOLD_OFF
-                ticket += exit_formatted.encode('utf-8') + b'\n'
-                ticket += BOLD_ON + b'DURACION:        ' + BOLD_OFF
-                ticket += f'{nights} noches\n'.encode('utf-8')
-            
-            # ← NUEVO: DESTACAR FECHA DE SALIDA en prepago y extensión
-            if ticket_type in ['prepayment', 'extension'] and exit_formatted:
-                ticket += b'\n'
-                ticket += ALIGN_CENTER
-                ticket += DOUBLE_BOTH + BOLD_ON
-                ticket += b'SALIDA PREVISTA:\n'
-                ticket += exit_formatted.encode('utf-8') + b'\n'
-                ticket += NORMAL + BOLD_OFF
-                ticket += ALIGN_LEFT
-            
-            ticket += b'--------------------------------\n\n'
-        
-        # TIPO DE PAGO
-        if ticket_type != 'open_exit':
-            ticket += ALIGN_LEFT + BOLD_ON + b'TIPO DE PAGO:\n' + BOLD_OFF
-            ticket += (b'[X] ' if ticket_type == 'prepayment' else b'[ ] ') + b'Pago adelantado\n'
-            ticket += (b'[X] ' if ticket_type == 'checkout' else b'[ ] ') + b'Checkout normal\n'
-            ticket += (b'[X] ' if ticket_type == 'extension' else b'[ ] ') + b'Extension de pago\n\n'
-        
-        # TOTAL
-        if ticket_type != 'open_exit':
-            ticket += ALIGN_CENTER + b'--------------------------------\n'
-            ticket += DOUBLE_BOTH + BOLD_ON
-            ticket += b'TOTAL PAGADO\n'
-            ticket += f'{amount:.2f} EUR\n'.encode('utf-8')
-            ticket += NORMAL + BOLD_OFF
-            ticket += b'(IVA incluido)\n'
-            ticket += b'================================\n\n'
-            
-            # ← NUEVO: CUENTA BANCARIA en prepago y extensión
-            if ticket_type in ['prepayment', 'extension']:
-                ticket += BOLD_ON + b'CUENTA BANCARIA / BANK ACCOUNT:\n' + BOLD_OFF
-                ticket += b'ES57 0049 0097 8826 1124 1151\n'
-                ticket += b'================================\n\n'
-        else:
-            ticket += ALIGN_CENTER + b'================================\n\n'
-        
-        # PIE
-        ticket += b'Gracias por su visita\n'
-        
-        # QR
-        if QR_PATH.exists():
-            qr_data = image_to_raster(str(QR_PATH))
-            if qr_data:
-                ticket += qr_data
-                ticket += b'\n'
-        
-        ticket += b'Escanee para comprobar el horario de autobuses\n\n'
-        ticket += b'================================\n\n'
-        
-        # DATOS EMPRESA
-        ticket += BOLD_ON + b'Autocaravanas Cordoba SLU\n' + BOLD_OFF
-        ticket += b'CIF: B06952931\n'
-        ticket += b'C/ Pintora Nuha Al Radi 14\n'
-        ticket += b'Bloque 12, 4-1\n'
-        ticket += b'14011 Cordoba\n\n'
-        ticket += b'================================\n\n\n\n\n'
-        
-        # Cortar
-        ticket += CUT
-        
-        # Enviar a USB
-        printer.write(ticket)
-        printer.flush()
-        printer.close()
+        ticket = render_ticket(
+            ticket_type, license_plate, check_in_time, amount,
+            check_out_time=check_out_time, spot_type=spot_type
+        )
+        sink.send(ticket)
         
-        print(f"✓ Ticket {ticket_type} impreso correctamente por USB")
+        print(f"✓ Ticket {ticket_type} impreso correctamente ({sink})")
         return {"success": True, "message": "Ticket impreso correctamente"}
         
-    except FileNotFoundError:
-        return {"success": False, "message": "Impresora USB no encontrada en /dev/usb/lp0"}
-    except PermissionError:
-        return {"success": False, "message": "Sin permisos para acceder a la impresora USB. Ejecuta: sudo usermod -aG lp camperparkrpi"}
+    except PrinterError as e:
+        return {"success": False, "message": str(e)}
     except Exception as e:
         print(f"✗ Error al imprimir: {e}")
-        return {"success": False, "message": f"Error al imprimir: {str(e)}"}
\ No newline at end of file
+        return {"success": False, "message": f"Error al imprimir: {str(e)}"}
@@ -0,0 +1,91 @@
+"""
+Actualizaciones de esquema sobre bases de datos ya existentes
+
+create_all() solo crea tablas nuevas: no añade columnas ni índices a
+tablas que ya existen. Aquí se aplican esos cambios de forma idempotente
+al arrancar (se pueden ejecutar tantas veces como haga falta).
+"""
+
+from sqlalchemy import inspect, literal_column, text
+
+from app import models
+from app.plates import normalize_plate
+from app.local_dates import local_date
+from app.vehicle_stats import STAT_COLUMNS, recompute_vehicle_stats
+from app.partitions import update_partitions
+
+
+def _add_column(conn, table: str, column: str, ddl_type: str):
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        print(f"✓ Columna {table}.{column} añadida")
+        return True
+    return False
+
+
+def _backfill_plate_keys(conn, table: str):
+    rows = conn.execute(text(
+        f"SELECT id, license_plate FROM {table} WHERE plate_key IS NULL AND license_plate IS NOT NULL"
+    )).fetchall()
+
+    if rows:
+        conn.execute(
+            text(f"UPDATE {table} SET plate_key = :plate_key WHERE id = :id"),
+            [{"id": row.id, "plate_key": normalize_plate(row.license_plate)} for row in rows]
+        )
+        print(f"✓ {len(rows)} claves de matrícula calculadas en {table}")
+
+
+def update_plate_keys(conn):
+    """Matrícula normalizada en vehicles y blacklist (fuzzy matching ANPR)"""
+    for table in ("vehicles", "blacklist"):
+        _add_column(conn, table, "plate_key", "VARCHAR")
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_plate_key ON {table} (plate_key)"
+        ))
+        _backfill_plate_keys(conn, table)
+
+
+def update_stay_local_dates(conn):
+    """Índices de check-in/check-out y su día local de Madrid como columnas generadas"""
+    # SQLite no permite añadir columnas generadas STORED a una tabla existente
+    kind = "STORED" if conn.dialect.name == "postgresql" else "VIRTUAL"
+    for prefix in ("check_in", "check_out"):
+        expression = local_date(literal_column(f"{prefix}_time")).compile(dialect=conn.dialect)
+        _add_column(conn, "stays", f"{prefix}_local_date",
+                    f"DATE GENERATED ALWAYS AS ({expression}) {kind}")
+        for column in (f"{prefix}_time", f"{prefix}_local_date"):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_stays_{column} ON stays ({column})"))
+
+
+def update_pending_index(conn):
+    """Índice parcial de detecciones pendientes (enum guardado por nombre)"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_stays_pending ON stays (detection_time) WHERE status = 'PENDING'"
+    ))
+
+
+def update_vehicle_stats(conn):
+    """Estadísticas de cliente en vehicles; al añadirlas se calculan desde las estancias"""
+    table = models.Vehicle.__table__
+    added = False
+    for column in STAT_COLUMNS:
+        ddl_type = table.c[column].type.compile(dialect=conn.dialect)
+        added |= _add_column(conn, "vehicles", column, ddl_type)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_stays_vehicle_id ON stays (vehicle_id)"))
+    if added:
+        print(f"✓ Estadísticas de cliente calculadas ({recompute_vehicle_stats(conn)} vehículos)")
+
+
+def apply_schema_updates(engine):
+    """Ejecutar después de create_all()"""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Backfills y reescrituras de tabla: sin el statement_timeout de recepción
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+        update_plate_keys(conn)
+        update_stay_local_dates(conn)
+        update_pending_index(conn)
+        update_vehicle_stats(conn)
+        update_partitions(conn)
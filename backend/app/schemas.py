@@ -466,4 +466,33 @@ class PrintTicketRequest(BaseModel):
     check_in_time: str
     check_out_time: Optional[str] = None
     amount: float
-    spot_type: Optional[str] = None
\ No newline at end of file
+    spot_type: Optional[str] = None
+
+# ============================================================================
+# SCHEMAS PARA INGESTA DE DETECCIONES ANPR
+# ============================================================================
+
+class Detection(BaseModel):
+    license_plate: str
+    detected_at: Optional[datetime] = None  # Sin zona horaria = hora de Madrid
+    vehicle_type: str = "Unknown"
+    country: Optional[str] = None
+
+class DetectionBatch(BaseModel):
+    detections: List[Detection] = Field(..., max_length=5000)
+
+class PlateCandidate(BaseModel):
+    vehicle_id: int
+    license_plate: str
+    country: Optional[str] = None
+    distance: int
+    score: float
+
+class DetectionBatchResult(BaseModel):
+    received: int
+    collapsed: int  # Repeticiones descartadas (misma matrícula dentro de la ventana)
+    vehicles_created: int
+    stays_created: int
+    stay_ids: List[int]
+    # Vehículos nuevos que pueden ser una mala lectura de uno conocido (matrícula -> candidatos)
+    plate_candidates: Dict[str, List[PlateCandidate]] = {}
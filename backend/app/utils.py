@@ -16,22 +16,29 @@ def get_current_campaign_dates():
             "end_date": date(2026, 6, 30)
         }
     """
-    now = datetime.now()
-    month = now.month
-    year = now.year
-    
-    if month >= 9:  # Sept-Dic
-        campaign_year = year
-    elif month <= 6:  # Ene-Jun
-        campaign_year = year - 1
-    else:  # Jul-Ago (cerrado)
-        campaign_year = year - 1
-    
-    start_date = date(campaign_year, 9, 1)
-    end_date = date(campaign_year + 1, 6, 30)
-    
+    return get_campaign_dates(get_campaign_year(datetime.now()))
+
+
+def get_campaign_year(day) -> int:
+    """Año de inicio de la campaña a la que pertenece una fecha (Jul-Ago -> la anterior)"""
+    if day.month >= 9:  # Sept-Dic
+        return day.year
+    return day.year - 1  # Ene-Jun, o Jul-Ago (cerrado)
+
+
+def get_campaign_dates(campaign_year: int):
+    """Fechas de la campaña que empieza en septiembre de campaign_year"""
     return {
         "campaign_name": f"{campaign_year}/{campaign_year + 1}",
-        "start_date": start_date,
-        "end_date": end_date
-    }
\ No newline at end of file
+        "start_date": date(campaign_year, 9, 1),
+        "end_date": date(campaign_year + 1, 6, 30)
+    }
+
+
+def parse_campaign_name(campaign_name: str) -> int:
+    """'2025/2026' (o '2025-2026') -> 2025"""
+    start, _, end = campaign_name.replace("-", "/").partition("/")
+    campaign_year = int(start)
+    if end and int(end) != campaign_year + 1:
+        raise ValueError(f"Campaña no válida: {campaign_name}")
+    return campaign_year
\ No newline at end of file
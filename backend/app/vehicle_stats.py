@@ -0,0 +1,180 @@
+"""
+Estadísticas de cliente por vehículo (visitas, gasto, noches, última visita)
+
+El aviso de "cliente habitual" al recibir una detección leía todas las
+estancias completadas del vehículo y las sumaba en Python en cada consulta.
+Ahora los totales viven en columnas de vehicles y se mantienen al cerrar o
+deshacer una estancia:
+
+- record_checkout: una estancia pasa a COMPLETED (checkout, SINPA). Suma en
+  el propio vehículo, sin consultas; va en la misma transacción que el
+  checkout.
+- refresh_vehicle_stats: recalcula los vehículos indicados a partir de sus
+  estancias (checkout eliminado, re-checkout de una estancia ya cerrada).
+- recompute_vehicle_stats / check_vehicle_stats: recálculo completo y
+  comprobación de coherencia (rebuild_vehicle_stats.py, carga de datos).
+
+Las cifras son las mismas que calculaba crud.get_customer_history: visitas =
+estancias COMPLETED, noches = días completos entre entrada y salida (solo
+estancias con al menos una noche), última visita = mayor check_out_time.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, select, update
+
+from app import models
+from app.local_dates import MADRID
+
+STAT_COLUMNS = ("visit_count", "total_spent", "total_nights", "nights_visit_count",
+                "last_visit_at", "last_payment_status")
+
+
+def _local_naive(value: datetime) -> datetime:
+    """Hora local sin zona: SQLite devuelve las fechas sin zona y las nuevas llevan zona"""
+    if value.tzinfo is not None:
+        return value.astimezone(MADRID).replace(tzinfo=None)
+    return value
+
+
+def stay_nights(check_in_time: Optional[datetime], check_out_time: Optional[datetime]) -> int:
+    if not (check_in_time and check_out_time):
+        return 0
+    return (_local_naive(check_out_time) - _local_naive(check_in_time)).days
+
+
+def _empty_stats() -> dict:
+    return {"visit_count": 0, "total_spent": 0.0, "total_nights": 0, "nights_visit_count": 0,
+            "last_visit_at": None, "last_payment_status": None}
+
+
+def _add_stay(stats: dict, check_in_time, check_out_time, final_price, payment_status):
+    stats["visit_count"] = (stats["visit_count"] or 0) + 1
+    if final_price:
+        stats["total_spent"] = (stats["total_spent"] or 0.0) + final_price
+
+    nights = stay_nights(check_in_time, check_out_time)
+    if nights > 0:
+        stats["total_nights"] = (stats["total_nights"] or 0) + nights
+        stats["nights_visit_count"] = (stats["nights_visit_count"] or 0) + 1
+
+    last = stats["last_visit_at"]
+    if check_out_time and (last is None or _local_naive(check_out_time) > _local_naive(last)):
+        stats["last_visit_at"] = check_out_time
+        stats["last_payment_status"] = payment_status
+
+
+# ============================================================================
+# MANTENIMIENTO INCREMENTAL
+# ============================================================================
+
+def record_checkout(db, stay: models.Stay, was_completed: bool = False):
+    """
+    Llamar al pasar una estancia a COMPLETED, antes del commit.
+    was_completed: la estancia ya estaba cerrada (sus cifras ya contaban).
+    """
+    if was_completed:
+        refresh_vehicle_stats(db, [stay.vehicle_id])
+        return
+
+    vehicle = stay.vehicle
+    if vehicle is None:
+        return
+
+    stats = {column: getattr(vehicle, column) for column in STAT_COLUMNS}
+    _add_stay(stats, stay.check_in_time, stay.check_out_time, stay.final_price, stay.payment_status)
+    for column, value in stats.items():
+        setattr(vehicle, column, value)
+
+
+def _completed_stays(vehicle_ids: Optional[List[int]] = None):
+    query = select(
+        models.Stay.vehicle_id, models.Stay.check_in_time, models.Stay.check_out_time,
+        models.Stay.final_price, models.Stay.payment_status
+    ).where(models.Stay.status == models.StayStatus.COMPLETED)
+    if vehicle_ids is not None:
+        query = query.where(models.Stay.vehicle_id.in_(vehicle_ids))
+    return query
+
+
+def compute_vehicle_stats(conn, vehicle_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+    """Cifras calculadas desde las estancias (vehículos sin visitas: ausentes)"""
+    result = {}
+    for row in conn.execute(_completed_stays(vehicle_ids)):
+        stats = result.setdefault(row.vehicle_id, _empty_stats())
+        _add_stay(stats, row.check_in_time, row.check_out_time, row.final_price, row.payment_status)
+    return result
+
+
+def _write_stats(conn, vehicle_ids: Iterable[int], stats: Dict[int, dict]):
+    params = [
+        {"vehicle_id": vehicle_id,
+         **{f"new_{column}": value for column, value in stats.get(vehicle_id, _empty_stats()).items()}}
+        for vehicle_id in vehicle_ids
+    ]
+    if params:
+        table = models.Vehicle.__table__
+        conn.execute(
+            update(table).where(table.c.id == bindparam("vehicle_id"))
+            .values({column: bindparam(f"new_{column}") for column in STAT_COLUMNS}),
+            params
+        )
+
+
+def refresh_vehicle_stats(db, vehicle_ids: Iterable[Optional[int]]):
+    """Recalcula las estadísticas de los vehículos indicados (antes del commit)"""
+    vehicle_ids = sorted({vehicle_id for vehicle_id in vehicle_ids if vehicle_id is not None})
+    if not vehicle_ids:
+        return
+    db.flush()  # Las sesiones no hacen autoflush: incluir los cambios pendientes
+    _write_stats(db, vehicle_ids, compute_vehicle_stats(db, vehicle_ids))
+    # Los vehículos ya cargados en la sesión releen las columnas actualizadas
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, models.Vehicle) and obj.id in vehicle_ids:
+            db.expire(obj, list(STAT_COLUMNS))
+
+
+# ============================================================================
+# RECÁLCULO COMPLETO Y COMPROBACIÓN
+# ============================================================================
+
+def recompute_vehicle_stats(conn) -> int:
+    """Recalcula todos los vehículos (Session o Connection). Devuelve cuántos"""
+    vehicle_ids = list(conn.execute(select(models.Vehicle.id)).scalars())
+    _write_stats(conn, vehicle_ids, compute_vehicle_stats(conn))
+    return len(vehicle_ids)
+
+
+def _differs(column: str, stored, expected) -> bool:
+    if column == "total_spent":
+        return abs((stored or 0.0) - expected) > 0.005
+    if column == "last_visit_at":
+        if stored is None or expected is None:
+            return stored is not expected
+        return _local_naive(stored) != _local_naive(expected)
+    if column == "last_payment_status":
+        return stored != expected
+    return (stored or 0) != expected
+
+
+def check_vehicle_stats(conn) -> List[dict]:
+    """Vehículos cuyas columnas no coinciden con sus estancias"""
+    expected_by_id = compute_vehicle_stats(conn)
+    table = models.Vehicle.__table__
+    mismatches = []
+    rows = conn.execute(select(table.c.id, table.c.license_plate,
+                               *[table.c[column] for column in STAT_COLUMNS]))
+    for row in rows:
+        expected = expected_by_id.get(row.id, _empty_stats())
+        for column in STAT_COLUMNS:
+            stored = getattr(row, column)
+            if _differs(column, stored, expected[column]):
+                mismatches.append({
+                    "vehicle_id": row.id,
+                    "license_plate": row.license_plate,
+                    "column": column,
+                    "stored": stored,
+                    "expected": expected[column]
+                })
+    return mismatches
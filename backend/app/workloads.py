@@ -0,0 +1,220 @@
+"""
+Aislamiento de cargas: informes de analytics frente a recepción
+
+Los endpoints son async pero llaman a SQLAlchemy síncrono, así que un informe
+pesado (ocupación de una temporada, rendimiento por usuario...) bloquea el
+bucle de eventos del worker y la recepción espera detrás.
+
+Con @workloads.analytics un endpoint:
+- se ejecuta en un executor propio de ANALYTICS_WORKERS hilos (tope de
+  informes simultáneos por worker; el resto espera en su cola sin bloquear
+  el bucle de eventos)
+- usa el pool de conexiones de analytics (app.database.analytics_engine),
+  con su propio statement_timeout; si se agota se responde 503
+
+El resto de rutas son de recepción ("gate"): pool principal y
+GATE_STATEMENT_TIMEOUT_MS. La sesión de la petición (RoutingSession) elige
+el engine según la clase en curso, y antes de encolar el informe se libera
+la conexión usada para autenticar: un informe esperando turno no retiene
+conexiones de ningún pool.
+
+Los informes más caros llevan además @workloads.admission(cost=...):
+- el coste se estima con los parámetros (días de datos del rango; sin
+  fechas, todo el histórico) antes de tocar el executor
+- si el coste en curso supera ANALYTICS_COST_BUDGET, o ya hay
+  ANALYTICS_MAX_QUEUE informes esperando, se responde 429 con Retry-After
+  (estimado con el tiempo medio por día de datos de ese informe)
+- las peticiones idénticas en curso (mismo informe y parámetros) comparten
+  un único cálculo: N pestañas de admin cuestan lo que una
+"""
+
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import metrics
+from app.database import (
+    ANALYTICS_WORKERS, ANALYTICS_STATEMENT_TIMEOUT_MS, current_workload, SessionLocal
+)
+
+# Días de datos que pueden estar calculándose a la vez en un worker
+ANALYTICS_COST_BUDGET = float(os.getenv("ANALYTICS_COST_BUDGET", "730"))
+# Informes admitidos esperando hilo libre, además de los que se ejecutan
+ANALYTICS_MAX_QUEUE = int(os.getenv("ANALYTICS_MAX_QUEUE", "4"))
+# Segundos por día de datos hasta tener mediciones reales
+DEFAULT_SECONDS_PER_DAY = 0.05
+
+_executor = ThreadPoolExecutor(max_workers=ANALYTICS_WORKERS, thread_name_prefix="analytics")
+_thread_state = threading.local()
+
+
+def _run_coroutine(coro):
+    """Ejecuta un endpoint async dentro de un hilo del executor (un bucle por hilo)"""
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None:
+        loop = _thread_state.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+
+def _call_as_analytics(call, args, kwargs):
+    token = current_workload.set("analytics")
+    try:
+        return call(*args, **kwargs)
+    finally:
+        current_workload.reset(token)
+
+
+def _is_statement_timeout(error: OperationalError) -> bool:
+    # 57014 = query_canceled (statement_timeout)
+    return getattr(getattr(error, "orig", None), "pgcode", None) == "57014"
+
+
+def analytics(endpoint):
+    """Decorador de endpoint: clase analytics (executor y pool propios)"""
+    if asyncio.iscoroutinefunction(endpoint):
+        def call(*args, **kwargs):
+            return _run_coroutine(endpoint(*args, **kwargs))
+    else:
+        call = endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        # Devolver al pool la conexión de la autenticación (los objetos ya
+        # cargados, como current_user, siguen accesibles)
+        for value in kwargs.values():
+            if isinstance(value, Session):
+                value.close()
+
+        context = contextvars.copy_context()  # Métricas de la petición
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                _executor, functools.partial(context.run, _call_as_analytics, call, args, kwargs)
+            )
+        except OperationalError as e:
+            if not _is_statement_timeout(e):
+                raise
+            raise HTTPException(
+                status_code=503,
+                detail=f"Informe cancelado: superó {ANALYTICS_STATEMENT_TIMEOUT_MS / 1000:.0f} s. "
+                       f"Prueba con un rango de fechas menor."
+            )
+
+    wrapper.workload = "analytics"
+    return wrapper
+
+
+# ============================================================================
+# CONTROL DE ADMISIÓN Y AGRUPACIÓN DE PETICIONES IDÉNTICAS
+# ============================================================================
+# Todo se ejecuta en el bucle de eventos: sin locks
+
+_inflight: Dict[tuple, "asyncio.Task"] = {}
+_inflight_cost: Dict[tuple, float] = {}
+_seconds_per_day: Dict[str, float] = {}
+_history_start = {"day": None, "checked_at": 0.0}
+
+
+def _history_days() -> float:
+    """Días desde la primera estancia (se consulta como mucho una vez por hora)"""
+    if time.monotonic() - _history_start["checked_at"] > 3600 or _history_start["day"] is None:
+        from app import models
+
+        db = SessionLocal()  # Consulta mínima: sin esperar al pool de analytics
+        try:
+            first = db.query(func.min(models.Stay.check_in_time)).scalar()
+        finally:
+            db.close()
+        _history_start["day"] = first.date() if first else date.today()
+        _history_start["checked_at"] = time.monotonic()
+    return (datetime.now(ZoneInfo("Europe/Madrid")).date() - _history_start["day"]).days + 1
+
+
+def range_days(start_date: Optional[str] = None, end_date: Optional[str] = None, **_) -> float:
+    """Coste de un informe por rango de fechas: días incluidos (sin rango, todo el histórico)"""
+    if not (start_date and end_date):
+        return _history_days()
+    try:
+        start = date.fromisoformat(start_date[:10])
+        end = date.fromisoformat(end_date[:10])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas con formato YYYY-MM-DD")
+    return max(1, (end - start).days + 1)
+
+
+def _retry_after(name: str) -> int:
+    """Segundos estimados hasta que se libere presupuesto"""
+    per_day = _seconds_per_day.get(name, DEFAULT_SECONDS_PER_DAY)
+    pending = sum(_inflight_cost.values()) * per_day / ANALYTICS_WORKERS
+    return min(300, max(1, math.ceil(pending)))
+
+
+def _shed(name: str, reason: str, detail: str):
+    metrics.ANALYTICS_SHED.inc(name, reason)
+    raise HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(_retry_after(name))}
+    )
+
+
+def admission(cost):
+    """
+    Decorador de endpoint (encima de @analytics): control de admisión y
+    agrupación. cost(**parámetros) devuelve el coste estimado en días de datos.
+    """
+    def decorator(endpoint):
+        name = endpoint.__name__
+
+        async def run(key, estimated, args, kwargs):
+            started = time.perf_counter()
+            try:
+                result = await endpoint(*args, **kwargs)
+            finally:
+                _inflight.pop(key, None)
+                _inflight_cost.pop(key, None)
+                metrics.ANALYTICS_INFLIGHT_COST.inc(amount=-estimated)
+            # Media móvil de segundos por día de datos (para Retry-After)
+            per_day = (time.perf_counter() - started) / estimated
+            _seconds_per_day[name] = 0.7 * _seconds_per_day.get(name, per_day) + 0.3 * per_day
+            return result
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            # Parámetros de la petición (sin sesión ni usuario): identifican el informe
+            params = {k: v for k, v in kwargs.items()
+                      if v is None or isinstance(v, (str, int, float, bool))}
+            key = (name, tuple(sorted(params.items())))
+
+            task = _inflight.get(key)
+            if task is not None:
+                metrics.ANALYTICS_COALESCED.inc(name)
+            else:
+                estimated = float(cost(**params))
+                if len(_inflight) >= ANALYTICS_WORKERS + ANALYTICS_MAX_QUEUE:
+                    _shed(name, "queue", "Demasiados informes en cola. Reintenta en unos segundos.")
+                if _inflight and sum(_inflight_cost.values()) + estimated > ANALYTICS_COST_BUDGET:
+                    _shed(name, "budget", f"Informe demasiado costoso ahora ({estimated:.0f} días de datos "
+                                          f"con otros en curso). Reintenta en unos segundos.")
+
+                _inflight_cost[key] = estimated
+                metrics.ANALYTICS_INFLIGHT_COST.inc(amount=estimated)
+                task = _inflight[key] = asyncio.ensure_future(run(key, estimated, args, kwargs))
+
+            # shield: si un cliente se va, el resto sigue esperando el mismo cálculo
+            return await asyncio.shield(task)
+
+        return wrapper
+    return decorator
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Sistema de Backups Automáticos con OAuth
-- Backups de PostgreSQL cada 24h
+- Backups de PostgreSQL cada 24h (pg_dump -Fc, o -Fd -j N)
+- Comprimidos en streaming (zstd, o gzip si no está instalado) con SHA-256
+- Subida a Google Drive en paralelo mientras se genera el dump
 - Guarda localmente (7 días)
 - Sube a Google Drive (TODOS, sin borrar)
 - Exportación mensual a Excel
@@ -9,30 +11,40 @@ Sistema de Backups Automáticos con OAuth
 """
 
 import os
+import re
 import sys
+import json
+import time
+import queue
 import pickle
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
 import subprocess
+import zlib
+from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from pathlib import Path
 
-# Google Drive con OAuth
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-
 # Add app to path
 sys.path.insert(0, '/app')
-from app.database import SessionLocal
+from app.database import AnalyticsSessionLocal
 from app import models
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
 
 # Carpetas locales
-BACKUP_DIR = Path("/app/backups")
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "/app/backups"))
 BACKUP_DIR.mkdir(exist_ok=True)
 
 DB_BACKUP_DIR = BACKUP_DIR / "database"
@@ -52,19 +64,52 @@ EXCEL_FOLDER_ID = "1UxKFx8rauvAloR3z3E8qj8nsRkNfnesr"  # Excel-Historico
 # Retención LOCAL (Drive guarda TODOS)
 LOCAL_RETENTION_DAYS = 7
 
+# Formato del dump: 'custom' (pg_dump -Fc), 'directory' (-Fd -j N) o 'plain' (.sql)
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "custom")
+BACKUP_JOBS = int(os.getenv("BACKUP_JOBS", "2"))  # Solo formato 'directory'
+
+# Compresión externa: 'zstd' (si está instalado zstandard) o 'gzip'
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "zstd" if zstandard else "gzip")
+
+# El dump se corta en partes de este tamaño: cada parte terminada se sube
+# mientras se sigue generando la siguiente
+BACKUP_PART_SIZE_MB = int(os.getenv("BACKUP_PART_SIZE_MB", "64"))
+
+# Destino remoto: 'drive' o 'local' (carpeta, para pruebas sin Google Drive)
+BACKUP_STORAGE = os.getenv("BACKUP_STORAGE", "drive")
+BACKUP_LOCAL_TARGET = os.getenv("BACKUP_LOCAL_TARGET", "/app/backups/remote")
+
+DUMP_EXTENSIONS = {"custom": "dump", "directory": "dir.tar", "plain": "sql"}
+COMPRESSION_EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
 # ============================================================================
-# GOOGLE DRIVE HELPER (OAuth)
+# ALMACENAMIENTO REMOTO
 # ============================================================================
 
-class GoogleDriveService:
+class BackupStorage(ABC):
+    """Interfaz del destino remoto de los backups"""
+    bd_folder_id = BD_FOLDER_ID
+    excel_folder_id = EXCEL_FOLDER_ID
+    
+    def authenticate(self):
+        return True
+    
+    @abstractmethod
+    def upload_file(self, file_path, folder_id):
+        """Sube un archivo y devuelve su id remoto (o None si falla)"""
+
+
+class GoogleDriveService(BackupStorage):
     def __init__(self):
         self.service = None
-        self.bd_folder_id = BD_FOLDER_ID
-        self.excel_folder_id = EXCEL_FOLDER_ID
         
     def authenticate(self):
         """Autenticar con Google Drive usando OAuth"""
         try:
+            # Google Drive con OAuth
+            from google.auth.transport.requests import Request
+            from googleapiclient.discovery import build
+            
             if not os.path.exists(TOKEN_FILE):
                 print("❌ Token no encontrado. Ejecuta primero:")
                 print("   docker-compose exec backend python3 authenticate_oauth.py")
@@ -91,11 +136,13 @@ class GoogleDriveService:
     def upload_file(self, file_path, folder_id):
         """Subir archivo a Google Drive"""
         try:
+            from googleapiclient.http import MediaFileUpload
+            
             file_metadata = {
                 'name': Path(file_path).name,
                 'parents': [folder_id]
             }
-            media = MediaFileUpload(file_path, resumable=True)
+            media = MediaFileUpload(file_path, resumable=True, chunksize=8 * 1024 * 1024)
             file = self.service.files().create(
                 body=file_metadata,
                 media_body=media,
@@ -107,54 +154,274 @@ class GoogleDriveService:
             print(f"❌ Error subiendo {Path(file_path).name}: {e}")
             return None
 
+
+class LocalDirectoryStorage(BackupStorage):
+    """Sustituto de Drive que copia a una carpeta local (pruebas, NAS montado...)"""
+    
+    def __init__(self, root=BACKUP_LOCAL_TARGET):
+        self.root = Path(root)
+    
+    def authenticate(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        print(f"✓ Destino local: {self.root}")
+        return True
+    
+    def upload_file(self, file_path, folder_id):
+        try:
+            target_dir = self.root / folder_id
+            target_dir.mkdir(parents=True, exist_ok=True)
+            target = target_dir / Path(file_path).name
+            shutil.copyfile(file_path, target)
+            print(f"✓ Copiado a {target}")
+            return str(target)
+        except Exception as e:
+            print(f"❌ Error copiando {Path(file_path).name}: {e}")
+            return None
+
+
+def get_storage():
+    """Destino remoto según BACKUP_STORAGE"""
+    if BACKUP_STORAGE == "local":
+        return LocalDirectoryStorage()
+    return GoogleDriveService()
+
+
+class BackgroundUploader:
+    """Sube archivos en un hilo aparte, en el orden en que se encolan"""
+    
+    def __init__(self, storage, folder_id):
+        self.storage = storage
+        self.folder_id = folder_id
+        self.failed = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            if not self.storage.upload_file(path, self.folder_id):
+                self.failed.append(path)
+    
+    def submit(self, path):
+        self._queue.put(path)
+    
+    def finish(self):
+        """Espera a que terminen las subidas; devuelve True si no hubo fallos"""
+        self._queue.put(None)
+        self._thread.join()
+        return not self.failed
+
 # ============================================================================
 # BACKUP DE BASE DE DATOS
 # ============================================================================
 
-def create_db_backup():
-    """Crear backup de PostgreSQL"""
+def _new_compressor(compression):
+    if compression == "zstd":
+        if not zstandard:
+            raise RuntimeError("Compresión zstd no disponible: pip install zstandard")
+        return zstandard.ZstdCompressor(level=3, threads=-1).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = formato gzip
+
+
+class CompressedPartWriter:
+    """
+    Objeto tipo archivo: comprime lo que se escribe, calcula el SHA-256 al
+    vuelo y lo reparte en partes de tamaño fijo. Cada parte cerrada se
+    entrega a on_part_ready (p.ej. para subirla mientras sigue el dump).
+    
+    Si solo hay una parte se llama igual que el backup (sin sufijo .partNNN).
+    """
+    
+    def __init__(self, base_path, compression, part_size, on_part_ready=None):
+        self.base_path = Path(base_path)
+        self.part_size = part_size
+        self.on_part_ready = on_part_ready
+        self.compressor = _new_compressor(compression)
+        self.sha256 = hashlib.sha256()
+        self.raw_bytes = 0
+        self.parts = []
+        self._part_index = 0
+        self._part_file = None
+        self._part_hash = None
+        self._part_bytes = 0
+    
+    def _part_path(self, index):
+        return self.base_path.with_name(f"{self.base_path.name}.part{index:03d}")
+    
+    def _close_part(self, final):
+        if self._part_file is None:
+            return
+        self._part_file.close()
+        
+        path = self._part_path(self._part_index)
+        if final and self._part_index == 0:
+            path.rename(self.base_path)
+            path = self.base_path
+        
+        self.parts.append({
+            "name": path.name,
+            "bytes": self._part_bytes,
+            "sha256": self._part_hash.hexdigest()
+        })
+        self._part_file = None
+        self._part_index += 1
+        
+        if self.on_part_ready:
+            self.on_part_ready(path)
+    
+    def _emit(self, data):
+        while data:
+            if self._part_file is not None and self._part_bytes >= self.part_size:
+                self._close_part(final=False)
+            if self._part_file is None:
+                self._part_file = open(self._part_path(self._part_index), "wb")
+                self._part_hash = hashlib.sha256()
+                self._part_bytes = 0
+            
+            chunk = data[:self.part_size - self._part_bytes]
+            data = data[len(chunk):]
+            self._part_file.write(chunk)
+            self._part_hash.update(chunk)
+            self.sha256.update(chunk)
+            self._part_bytes += len(chunk)
+    
+    def write(self, data):
+        self.raw_bytes += len(data)
+        self._emit(self.compressor.compress(data))
+        return len(data)
+    
+    def close(self):
+        self._emit(self.compressor.flush())
+        if self._part_file is None and not self.parts:
+            self._part_file = open(self._part_path(0), "wb")
+            self._part_hash = hashlib.sha256()
+            self._part_bytes = 0
+        self._close_part(final=True)
+    
+    @property
+    def compressed_bytes(self):
+        return sum(part["bytes"] for part in self.parts)
+
+
+def _db_connection():
+    """Configuración de BD desde variables de entorno"""
+    env = os.environ.copy()
+    env['PGPASSWORD'] = os.getenv("POSTGRES_PASSWORD", "postgres")
+    args = [
+        '-h', os.getenv("POSTGRES_HOST", "db"),
+        '-p', os.getenv("POSTGRES_PORT", "5432"),
+        '-U', os.getenv("POSTGRES_USER", "postgres"),
+    ]
+    return args, env, os.getenv("POSTGRES_DB", "parking_db")
+
+
+def _stream_command(cmd, env, writer):
+    """Ejecuta cmd y vuelca su stdout en writer por bloques de 1 MB"""
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=stderr)
+        for chunk in iter(lambda: proc.stdout.read(1024 * 1024), b''):
+            writer.write(chunk)
+        proc.stdout.close()
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr.read())
+
+
+def _dump_directory(conn_args, env, db_name, writer, jobs):
+    """pg_dump -Fd -j N a una carpeta temporal y empaquetado tar en streaming"""
+    with tempfile.TemporaryDirectory(dir=DB_BACKUP_DIR) as tmp:
+        dump_dir = Path(tmp) / "dump"
+        cmd = ['pg_dump', *conn_args, '-d', db_name, '-F', 'd', '-j', str(jobs), '-Z', '0', '-f', str(dump_dir)]
+        subprocess.run(cmd, env=env, check=True, capture_output=True)
+        
+        with tarfile.open(fileobj=writer, mode='w|') as tar:
+            tar.add(dump_dir, arcname="dump")
+
+
+def create_db_backup(storage=None):
+    """
+    Crear backup de PostgreSQL.
+    
+    Genera backup_<fecha>.<formato>.<compresión> (en partes si es grande)
+    y un manifiesto .manifest.json con los SHA-256. Si se pasa storage,
+    cada parte se sube en cuanto está cerrada, mientras sigue el dump.
+    
+    Returns:
+        Path del manifiesto, o None si falla
+    """
     print("\n📦 Creando backup de base de datos...")
     
     timestamp = datetime.now(ZoneInfo("Europe/Madrid")).strftime("%Y%m%d_%H%M%S")
-    filename = f"backup_{timestamp}.sql"
+    dump_format = BACKUP_FORMAT if BACKUP_FORMAT in DUMP_EXTENSIONS else "custom"
+    compression = BACKUP_COMPRESSION if BACKUP_COMPRESSION in COMPRESSION_EXTENSIONS else "gzip"
+    filename = f"backup_{timestamp}.{DUMP_EXTENSIONS[dump_format]}.{COMPRESSION_EXTENSIONS[compression]}"
     filepath = DB_BACKUP_DIR / filename
+    manifest_path = DB_BACKUP_DIR / f"backup_{timestamp}.manifest.json"
     
-    # Configuración de BD desde variables de entorno
-    db_host = os.getenv("POSTGRES_HOST", "db")
-    db_port = os.getenv("POSTGRES_PORT", "5432")
-    db_name = os.getenv("POSTGRES_DB", "parking_db")
-    db_user = os.getenv("POSTGRES_USER", "postgres")
-    db_password = os.getenv("POSTGRES_PASSWORD", "postgres")
+    conn_args, env, db_name = _db_connection()
     
-    # Crear backup con pg_dump
-    env = os.environ.copy()
-    env['PGPASSWORD'] = db_password
+    uploader = BackgroundUploader(storage, storage.bd_folder_id) if storage else None
+    writer = CompressedPartWriter(
+        filepath, compression, BACKUP_PART_SIZE_MB * 1024 * 1024,
+        on_part_ready=uploader.submit if uploader else None
+    )
     
+    start = time.perf_counter()
     try:
-        cmd = [
-            'pg_dump',
-            '-h', db_host,
-            '-p', db_port,
-            '-U', db_user,
-            '-d', db_name,
-            '-F', 'p',  # Formato plano (plain)
-            '-f', str(filepath)
-        ]
+        if dump_format == "directory":
+            _dump_directory(conn_args, env, db_name, writer, BACKUP_JOBS)
+        else:
+            # Sin compresión interna (-Z 0): se comprime fuera, en streaming
+            pg_format = 'c' if dump_format == "custom" else 'p'
+            cmd = ['pg_dump', *conn_args, '-d', db_name, '-F', pg_format, '-Z', '0']
+            _stream_command(cmd, env, writer)
         
-        subprocess.run(cmd, env=env, check=True, capture_output=True)
-        print(f"✓ Backup creado: {filename}")
+        writer.close()
         
-        # Obtener tamaño
-        size_mb = filepath.stat().st_size / (1024 * 1024)
-        print(f"  Tamaño: {size_mb:.2f} MB")
+        manifest = {
+            "created_at": datetime.now(ZoneInfo("Europe/Madrid")).isoformat(),
+            "database": db_name,
+            "format": dump_format,
+            "compression": compression,
+            "dump_bytes": writer.raw_bytes,
+            "compressed_bytes": writer.compressed_bytes,
+            "sha256": writer.sha256.hexdigest(),
+            "parts": writer.parts
+        }
+        manifest_path.write_text(json.dumps(manifest, indent=2))
         
-        return filepath
+        elapsed = time.perf_counter() - start
+        print(f"✓ Backup creado: {filename} ({len(writer.parts)} parte/s, {elapsed:.1f}s)")
+        print(f"  Tamaño: {writer.raw_bytes / (1024 * 1024):.2f} MB → "
+              f"{writer.compressed_bytes / (1024 * 1024):.2f} MB ({compression})")
+        print(f"  SHA-256: {manifest['sha256']}")
+        
+        if uploader:
+            uploader.submit(manifest_path)
+            if uploader.finish():
+                print(f"✓ Subida completada ({time.perf_counter() - start:.1f}s en total)")
+            else:
+                print(f"⚠️  {len(uploader.failed)} archivo/s no se pudieron subir")
+        
+        return manifest_path
     except subprocess.CalledProcessError as e:
-        print(f"❌ Error creando backup: {e.stderr.decode()}")
-        return None
+        print(f"❌ Error creando backup: {e.stderr.decode(errors='replace') if e.stderr else e}")
     except Exception as e:
         print(f"❌ Error: {e}")
-        return None
+    
+    # Limpiar restos del backup fallido
+    if uploader:
+        uploader.finish()
+    for leftover in DB_BACKUP_DIR.glob(f"backup_{timestamp}.*"):
+        leftover.unlink()
+    return None
+
+
+BACKUP_NAME_RE = re.compile(r"^backup_(\d{8}_\d{6})\.")
+
 
 def cleanup_local_backups():
     """Eliminar backups locales antiguos (>7 días)"""
@@ -163,16 +430,13 @@ def cleanup_local_backups():
     cutoff_date = datetime.now(ZoneInfo("Europe/Madrid")) - timedelta(days=LOCAL_RETENTION_DAYS)
     deleted = 0
     
-    for backup_file in DB_BACKUP_DIR.glob("backup_*.sql"):
+    for backup_file in DB_BACKUP_DIR.glob("backup_*"):
         try:
             # Extraer fecha y hora del nombre del archivo
-            parts = backup_file.stem.split('_')
-            if len(parts) >= 3:
-                date_str = parts[1]  # YYYYMMDD
-                time_str = parts[2]  # HHMMSS
-                
+            match = BACKUP_NAME_RE.match(backup_file.name)
+            if match and backup_file.is_file():
                 # Parsear con timezone
-                file_datetime = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
+                file_datetime = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
                 file_datetime = file_datetime.replace(tzinfo=ZoneInfo("Europe/Madrid"))
                 
                 if file_datetime < cutoff_date:
@@ -189,22 +453,57 @@ def cleanup_local_backups():
 # EXPORTACIÓN A EXCEL
 # ============================================================================
 
+EXPORT_CHUNK_SIZE = 1000  # Filas por lote leídas del cursor del servidor
+
+
+def _excel_datetime(value):
+    """Excel no admite zonas horarias: hora local de Madrid sin tzinfo"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(ZoneInfo("Europe/Madrid"))
+    return value.replace(tzinfo=None)
+
+
+def _enum_value(value):
+    return value.value if value is not None else ''
+
+
+def _stream_sheet(workbook, title, headers, query, build_row):
+    """
+    Vuelca una consulta a una hoja en modo write-only, por lotes de
+    EXPORT_CHUNK_SIZE filas (cursor del servidor: memoria acotada).
+    
+    build_row recibe cada fila y devuelve la lista de celdas.
+    """
+    sheet = workbook.create_sheet(title)
+    sheet.append(headers)
+    
+    count = 0
+    for row in query.yield_per(EXPORT_CHUNK_SIZE):
+        sheet.append(build_row(row))
+        count += 1
+    return count
+
+
 def export_monthly_excel():
     """Exportar datos del mes pasado a Excel"""
     print("\n📊 Exportando datos a Excel...")
     
     try:
-        import pandas as pd
+        from openpyxl import Workbook
+        from sqlalchemy.orm import aliased
     except ImportError:
-        print("❌ Instala pandas y openpyxl: pip install pandas openpyxl")
+        print("❌ Instala openpyxl: pip install openpyxl")
         return None
     
-    db = SessionLocal()
+    # Pool y statement_timeout de analytics (app/workloads.py)
+    db = AnalyticsSessionLocal()
     
     try:
-        # Mes pasado
+        # Mes pasado [día 1 00:00, día 1 del mes actual 00:00)
         today = datetime.now(ZoneInfo("Europe/Madrid"))
-        first_day_current_month = today.replace(day=1)
+        first_day_current_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         last_day_prev_month = first_day_current_month - timedelta(days=1)
         first_day_prev_month = last_day_prev_month.replace(day=1)
         
@@ -219,189 +518,275 @@ def export_monthly_excel():
         
         print(f"📅 Exportando mes: {last_day_prev_month.strftime('%B %Y')}")
         
+        # Modo write-only: las filas van a disco según se añaden
+        workbook = Workbook(write_only=True)
+        
+        # La hoja de resumen va primero pero se rellena al final
+        summary_sheet = workbook.create_sheet('Resumen')
+        
+        totals = {
+            "ingresos": 0.0, "efectivo": 0.0, "tarjeta": 0.0, "retiros": 0.0,
+            "sinpas": 0.0, "sesiones_cerradas": 0
+        }
+        
         # ========================================================================
-        # CONSULTAS
+        # ESTANCIAS (proyección con JOIN, sin cargar objetos ORM)
         # ========================================================================
         
-        # Estancias
-        stays = db.query(models.Stay).filter(
+        stays_query = db.query(
+            models.Stay.id,
+            models.Vehicle.license_plate,
+            models.Vehicle.country,
+            models.Vehicle.vehicle_type,
+            models.Stay.check_in_time,
+            models.Stay.check_out_time,
+            models.ParkingSpot.spot_type,
+            models.ParkingSpot.spot_number,
+            models.Stay.final_price,
+            models.Stay.payment_method,
+            models.Stay.amount_paid,
+            models.Stay.change_given,
+            models.Stay.payment_status,
+            models.Stay.prepaid_amount,
+            models.Stay.cash_registered
+        ).join(
+            models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+        ).outerjoin(
+            models.ParkingSpot, models.Stay.parking_spot_id == models.ParkingSpot.id
+        ).filter(
             models.Stay.check_in_time >= first_day_prev_month,
             models.Stay.check_in_time < first_day_current_month,
             models.Stay.status == models.StayStatus.COMPLETED
-        ).all()
+        ).order_by(models.Stay.id)
         
-        # Lista negra
-        blacklist = db.query(models.Blacklist).filter(
-            models.Blacklist.incident_date >= first_day_prev_month,
-            models.Blacklist.incident_date < first_day_current_month
-        ).all()
+        def stay_row(s):
+            totals["ingresos"] += s.final_price or 0
+            return [
+                s.id,
+                s.license_plate,
+                s.country or '',
+                s.vehicle_type,
+                _excel_datetime(s.check_in_time),
+                _excel_datetime(s.check_out_time),
+                f"{s.spot_type.value}-{s.spot_number}" if s.spot_type else '',
+                s.final_price,
+                _enum_value(s.payment_method),
+                s.amount_paid or 0,
+                s.change_given or 0,
+                _enum_value(s.payment_status),
+                s.prepaid_amount or 0,
+                'Sí' if s.cash_registered else 'No'
+            ]
         
-        # Historial
-        history = db.query(models.HistoryLog).filter(
-            models.HistoryLog.timestamp >= first_day_prev_month,
-            models.HistoryLog.timestamp < first_day_current_month
-        ).all()
+        total_stays = _stream_sheet(workbook, 'Estancias', [
+            'ID', 'Matrícula', 'País', 'Tipo Vehículo', 'Check-in', 'Check-out', 'Plaza',
+            'Precio', 'Método Pago', 'Importe Pagado', 'Cambio Devuelto', 'Estado Pago',
+            'Pago Adelantado', 'Registrado en Caja'
+        ], stays_query, stay_row)
         
-        # Sesiones de caja
-        cash_sessions = db.query(models.CashSession).filter(
+        # ========================================================================
+        # SESIONES DE CAJA
+        # ========================================================================
+        
+        opened_by = aliased(models.User)
+        closed_by = aliased(models.User)
+        
+        sessions_query = db.query(
+            models.CashSession.id,
+            models.CashSession.opened_at,
+            models.CashSession.closed_at,
+            opened_by.username.label("opened_by"),
+            closed_by.username.label("closed_by"),
+            models.CashSession.initial_amount,
+            models.CashSession.expected_final_amount,
+            models.CashSession.actual_final_amount,
+            models.CashSession.difference,
+            models.CashSession.status,
+            models.CashSession.notes
+        ).outerjoin(
+            opened_by, models.CashSession.opened_by_user_id == opened_by.id
+        ).outerjoin(
+            closed_by, models.CashSession.closed_by_user_id == closed_by.id
+        ).filter(
             models.CashSession.opened_at >= first_day_prev_month,
             models.CashSession.opened_at < first_day_current_month
-        ).all()
+        ).order_by(models.CashSession.id)
+        
+        def session_row(cs):
+            if cs.status == models.CashSessionStatus.CLOSED:
+                totals["sesiones_cerradas"] += 1
+            return [
+                cs.id,
+                _excel_datetime(cs.opened_at),
+                _excel_datetime(cs.closed_at),
+                cs.opened_by or '',
+                cs.closed_by or '',
+                cs.initial_amount,
+                cs.expected_final_amount or 0,
+                cs.actual_final_amount or 0,
+                cs.difference or 0,
+                _enum_value(cs.status),
+                cs.notes or ''
+            ]
+        
+        total_sessions = _stream_sheet(workbook, 'Sesiones Caja', [
+            'ID', 'Fecha Apertura', 'Fecha Cierre', 'Usuario Apertura', 'Usuario Cierre',
+            'Importe Inicial', 'Esperado Final', 'Real Final', 'Diferencia', 'Estado', 'Notas'
+        ], sessions_query, session_row)
         
-        # Transacciones de caja
-        cash_transactions = db.query(models.CashTransaction).filter(
+        # ========================================================================
+        # TRANSACCIONES DE CAJA
+        # ========================================================================
+        
+        transactions_query = db.query(
+            models.CashTransaction.id,
+            models.CashTransaction.cash_session_id,
+            models.CashTransaction.timestamp,
+            models.CashTransaction.transaction_type,
+            models.CashTransaction.stay_id,
+            models.Vehicle.license_plate,
+            models.CashTransaction.amount_due,
+            models.CashTransaction.amount_paid,
+            models.CashTransaction.change_given,
+            models.CashTransaction.payment_method,
+            models.User.username,
+            models.CashTransaction.notes
+        ).outerjoin(
+            models.Stay, models.CashTransaction.stay_id == models.Stay.id
+        ).outerjoin(
+            models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+        ).outerjoin(
+            models.User, models.CashTransaction.user_id == models.User.id
+        ).filter(
             models.CashTransaction.timestamp >= first_day_prev_month,
             models.CashTransaction.timestamp < first_day_current_month
-        ).all()
+        ).order_by(models.CashTransaction.id)
+        
+        def transaction_row(ct):
+            transaction_type = _enum_value(ct.transaction_type)
+            payment_method = _enum_value(ct.payment_method)
+            if transaction_type in ['checkout', 'prepayment']:
+                if payment_method == 'cash':
+                    totals["efectivo"] += ct.amount_due or 0
+                elif payment_method == 'card':
+                    totals["tarjeta"] += ct.amount_due or 0
+            elif transaction_type == 'withdrawal':
+                totals["retiros"] += ct.amount_due or 0
+            return [
+                ct.id,
+                ct.cash_session_id,
+                _excel_datetime(ct.timestamp),
+                transaction_type,
+                ct.stay_id or '',
+                ct.license_plate or '',
+                ct.amount_due,
+                ct.amount_paid or 0,
+                ct.change_given or 0,
+                payment_method,
+                ct.username or '',
+                ct.notes or ''
+            ]
+        
+        _stream_sheet(workbook, 'Transacciones Caja', [
+            'ID', 'Sesión ID', 'Fecha', 'Tipo', 'Stay ID', 'Matrícula', 'Importe Debido',
+            'Importe Pagado', 'Cambio Dado', 'Método Pago', 'Usuario', 'Notas'
+        ], transactions_query, transaction_row)
         
         # ========================================================================
-        # CREAR DATAFRAMES
+        # LISTA NEGRA
         # ========================================================================
         
-        # Estancias
-        df_stays = pd.DataFrame([{
-            'ID': s.id,
-            'Matrícula': s.vehicle.license_plate,
-            'País': s.vehicle.country or '',
-            'Tipo Vehículo': s.vehicle.vehicle_type,
-            'Check-in': s.check_in_time,
-            'Check-out': s.check_out_time,
-            'Plaza': f"{s.parking_spot.spot_type}-{s.parking_spot.spot_number}" if s.parking_spot else '',
-            'Precio': s.final_price,
-            'Método Pago': s.payment_method.value if s.payment_method else '',
-            'Importe Pagado': s.amount_paid or 0,
-            'Cambio Devuelto': s.change_given or 0,
-            'Estado Pago': s.payment_status.value,
-            'Pago Adelantado': s.prepaid_amount or 0,
-            'Registrado en Caja': 'Sí' if s.cash_registered else 'No'
-        } for s in stays])
-        
-        # Lista negra
-        df_blacklist = pd.DataFrame([{
-            'ID': b.id,
-            'Matrícula': b.license_plate,
-            'Motivo': b.reason,
-            'Deuda': b.amount_owed,
-            'Fecha': b.incident_date,
-            'Notas': b.notes or '',
-            'Resuelto': 'Sí' if b.resolved else 'No'
-        } for b in blacklist])
-        
-        # Historial
-        df_history = pd.DataFrame([{
-            'ID': h.id,
-            'Stay ID': h.stay_id,
-            'Acción': h.action,
-            'Fecha': h.timestamp,
-            'Usuario': h.user.username if h.user else '',
-            'Detalles': str(h.details) if h.details else ''
-        } for h in history])
-        
-        # Sesiones de caja
-        df_cash_sessions = pd.DataFrame([{
-            'ID': cs.id,
-            'Fecha Apertura': cs.opened_at,
-            'Fecha Cierre': cs.closed_at,
-            'Usuario Apertura': cs.opened_by.username if cs.opened_by else '',
-            'Usuario Cierre': cs.closed_by.username if cs.closed_by else '',
-            'Importe Inicial': cs.initial_amount,
-            'Esperado Final': cs.expected_final_amount or 0,
-            'Real Final': cs.actual_final_amount or 0,
-            'Diferencia': cs.difference or 0,
-            'Estado': cs.status.value,
-            'Notas': cs.notes or ''
-        } for cs in cash_sessions])
-        
-        # Transacciones de caja
-        df_cash_transactions = pd.DataFrame([{
-            'ID': ct.id,
-            'Sesión ID': ct.cash_session_id,
-            'Fecha': ct.timestamp,
-            'Tipo': ct.transaction_type.value,
-            'Stay ID': ct.stay_id or '',
-            'Matrícula': ct.stay.vehicle.license_plate if ct.stay else '',
-            'Importe Debido': ct.amount_due,
-            'Importe Pagado': ct.amount_paid or 0,
-            'Cambio Dado': ct.change_given or 0,
-            'Método Pago': ct.payment_method.value,
-            'Usuario': ct.user.username if ct.user else '',
-            'Notas': ct.notes or ''
-        } for ct in cash_transactions])
+        blacklist_query = db.query(
+            models.Blacklist.id,
+            models.Blacklist.license_plate,
+            models.Blacklist.reason,
+            models.Blacklist.amount_owed,
+            models.Blacklist.incident_date,
+            models.Blacklist.notes,
+            models.Blacklist.resolved
+        ).filter(
+            models.Blacklist.incident_date >= first_day_prev_month,
+            models.Blacklist.incident_date < first_day_current_month
+        ).order_by(models.Blacklist.id)
+        
+        def blacklist_row(b):
+            totals["sinpas"] += b.amount_owed or 0
+            return [
+                b.id,
+                b.license_plate,
+                b.reason,
+                b.amount_owed,
+                _excel_datetime(b.incident_date),
+                b.notes or '',
+                'Sí' if b.resolved else 'No'
+            ]
+        
+        total_blacklist = _stream_sheet(workbook, 'SINPAS', [
+            'ID', 'Matrícula', 'Motivo', 'Deuda', 'Fecha', 'Notas', 'Resuelto'
+        ], blacklist_query, blacklist_row)
         
         # ========================================================================
-        # RESUMEN
+        # HISTORIAL (la tabla más grande)
         # ========================================================================
         
-        total_ingresos = sum([s.final_price for s in stays if s.final_price])
-        total_sinpas = sum([b.amount_owed for b in blacklist])
-        
-        # Métricas de caja
-        total_efectivo = sum([
-            ct.amount_due for ct in cash_transactions 
-            if ct.transaction_type.value in ['checkout', 'prepayment'] 
-            and ct.payment_method.value == 'cash'
-        ])
+        history_query = db.query(
+            models.HistoryLog.id,
+            models.HistoryLog.stay_id,
+            models.HistoryLog.action,
+            models.HistoryLog.timestamp,
+            models.User.username,
+            models.HistoryLog.details
+        ).outerjoin(
+            models.User, models.HistoryLog.user_id == models.User.id
+        ).filter(
+            models.HistoryLog.timestamp >= first_day_prev_month,
+            models.HistoryLog.timestamp < first_day_current_month
+        ).order_by(models.HistoryLog.id)
         
-        total_tarjeta = sum([
-            ct.amount_due for ct in cash_transactions 
-            if ct.transaction_type.value in ['checkout', 'prepayment'] 
-            and ct.payment_method.value == 'card'
+        _stream_sheet(workbook, 'Historial', [
+            'ID', 'Stay ID', 'Acción', 'Fecha', 'Usuario', 'Detalles'
+        ], history_query, lambda h: [
+            h.id,
+            h.stay_id,
+            h.action,
+            _excel_datetime(h.timestamp),
+            h.username or '',
+            str(h.details) if h.details else ''
         ])
         
-        total_retiros = sum([
-            ct.amount_due for ct in cash_transactions 
-            if ct.transaction_type.value == 'withdrawal'
-        ])
+        # ========================================================================
+        # RESUMEN
+        # ========================================================================
         
-        sesiones_cerradas = len([cs for cs in cash_sessions if cs.status.value == 'closed'])
-        
-        df_resumen = pd.DataFrame([{
-            'Métrica': 'Total Vehículos',
-            'Valor': len(stays)
-        }, {
-            'Métrica': 'Total Ingresos (€)',
-            'Valor': f"{total_ingresos:.2f}"
-        }, {
-            'Métrica': 'Ingresos Efectivo (€)',
-            'Valor': f"{total_efectivo:.2f}"
-        }, {
-            'Métrica': 'Ingresos Tarjeta (€)',
-            'Valor': f"{total_tarjeta:.2f}"
-        }, {
-            'Métrica': 'Total Retiros (€)',
-            'Valor': f"{total_retiros:.2f}"
-        }, {
-            'Métrica': 'Sesiones de Caja',
-            'Valor': len(cash_sessions)
-        }, {
-            'Métrica': 'Sesiones Cerradas',
-            'Valor': sesiones_cerradas
-        }, {
-            'Métrica': 'Nuevos SINPAS',
-            'Valor': len(blacklist)
-        }, {
-            'Métrica': 'Deuda SINPAS (€)',
-            'Valor': f"{total_sinpas:.2f}"
-        }])
+        summary_sheet.append(['Métrica', 'Valor'])
+        for row in [
+            ['Total Vehículos', total_stays],
+            ['Total Ingresos (€)', f"{totals['ingresos']:.2f}"],
+            ['Ingresos Efectivo (€)', f"{totals['efectivo']:.2f}"],
+            ['Ingresos Tarjeta (€)', f"{totals['tarjeta']:.2f}"],
+            ['Total Retiros (€)', f"{totals['retiros']:.2f}"],
+            ['Sesiones de Caja', total_sessions],
+            ['Sesiones Cerradas', totals["sesiones_cerradas"]],
+            ['Nuevos SINPAS', total_blacklist],
+            ['Deuda SINPAS (€)', f"{totals['sinpas']:.2f}"],
+        ]:
+            summary_sheet.append(row)
         
         # ========================================================================
         # GUARDAR EXCEL
         # ========================================================================
         
-        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-            df_resumen.to_excel(writer, sheet_name='Resumen', index=False)
-            df_stays.to_excel(writer, sheet_name='Estancias', index=False)
-            df_cash_sessions.to_excel(writer, sheet_name='Sesiones Caja', index=False)
-            df_cash_transactions.to_excel(writer, sheet_name='Transacciones Caja', index=False)
-            df_blacklist.to_excel(writer, sheet_name='SINPAS', index=False)
-            df_history.to_excel(writer, sheet_name='Historial', index=False)
+        # Se escribe a un temporal para no dejar un Excel a medias si algo falla
+        tmp_path = filepath.with_suffix(".xlsx.tmp")
+        workbook.save(tmp_path)
+        tmp_path.replace(filepath)
         
         print(f"✓ Excel creado: {filename}")
-        print(f"  - {len(stays)} estancias")
-        print(f"  - {total_ingresos:.2f}€ ingresos totales")
-        print(f"  - {total_efectivo:.2f}€ efectivo")
-        print(f"  - {len(cash_sessions)} sesiones de caja")
-        print(f"  - {len(blacklist)} sinpas")
+        print(f"  - {total_stays} estancias")
+        print(f"  - {totals['ingresos']:.2f}€ ingresos totales")
+        print(f"  - {totals['efectivo']:.2f}€ efectivo")
+        print(f"  - {total_sessions} sesiones de caja")
+        print(f"  - {total_blacklist} sinpas")
         
         return filepath
         
@@ -424,24 +809,27 @@ def main():
     print("=" * 60)
     print(f"Fecha: {datetime.now(ZoneInfo('Europe/Madrid')).strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # 1. Crear backup de BD
-    backup_file = create_db_backup()
+    # 1. Conectar con el destino remoto - NO CRASHEA SI FALLA
+    storage = None
+    try:
+        storage = get_storage()
+        if not storage.authenticate():
+            print("⚠️  No se pudo autenticar con el destino remoto, solo backup local")
+            storage = None
+    except Exception as e:
+        print(f"⚠️  Error con Google Drive: {e}")
+        storage = None
+    
+    # 2. Crear backup de BD (las partes se suben mientras se genera)
+    backup_file = create_db_backup(storage)
     
     if not backup_file:
         print("\n❌ No se pudo crear el backup")
         return 1
     
-    # 2. Subir a Google Drive (SIN BORRAR NADA) - NO CRASHEA SI FALLA
-    try:
-        drive = GoogleDriveService()
-        if drive.authenticate():
-            drive.upload_file(backup_file, drive.bd_folder_id)
-            print("💾 Todos los backups se guardan en Drive permanentemente")
-        else:
-            print("⚠️  No se pudo autenticar con Google Drive")
-            print("✓ Backup local guardado correctamente")
-    except Exception as e:
-        print(f"⚠️  Error con Google Drive: {e}")
+    if storage:
+        print("💾 Todos los backups se guardan en Drive permanentemente")
+    else:
         print("✓ Backup local guardado correctamente")
     
     # 3. Limpiar backups locales antiguos (solo local, Drive mantiene todos)
@@ -451,11 +839,9 @@ def main():
     if datetime.now(ZoneInfo("Europe/Madrid")).day == 1:
         try:
             excel_file = export_monthly_excel()
-            if excel_file:
+            if excel_file and storage:
                 try:
-                    drive = GoogleDriveService()
-                    if drive.authenticate():
-                        drive.upload_file(excel_file, drive.excel_folder_id)
+                    storage.upload_file(excel_file, storage.excel_folder_id)
                 except Exception as e:
                     print(f"⚠️  No se pudo subir Excel a Drive: {e}")
                     print("✓ Excel local guardado correctamente")
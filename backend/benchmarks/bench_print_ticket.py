@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia por ticket
+
+Compara el camino antiguo (lanzar un intérprete nuevo por ticket, que
+importa PIL y procesa las imágenes desde cero) con el renderizado en
+proceso actual. Ambos escriben en un FileSink para no depender de la
+impresora.
+
+Uso:
+    python benchmarks/bench_print_ticket.py [--runs 20]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.print_ticket import print_ticket, FileSink
+
+TICKET = {
+    "ticket_type": "checkout",
+    "license_plate": "1234ABC",
+    "check_in_time": "2025-01-10T12:00:00+01:00",
+    "amount": 45.0,
+    "check_out_time": "2025-01-13T11:00:00+01:00",
+    "spot_type": "A",
+}
+
+# Equivalente al antiguo crud.print_ticket: un proceso por ticket y sin caché
+SUBPROCESS_SCRIPT = """
+import sys
+sys.path.insert(0, {backend!r})
+from app import print_ticket as pt
+pt._raster_cache.clear()
+pt.RASTER_CACHE_DIR = pt.Path({cache_dir!r})
+pt.print_ticket(sink=pt.FileSink({output!r}), **{ticket!r})
+"""
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<22} media {statistics.mean(samples) * 1000:8.2f} ms | "
+          f"p50 {statistics.median(samples) * 1000:8.2f} ms | p95 {p95 * 1000:8.2f} ms")
+    return statistics.mean(samples)
+
+
+def bench_subprocess(runs, output):
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            script = SUBPROCESS_SCRIPT.format(
+                backend=BACKEND_DIR, cache_dir=cache_dir, output=output, ticket=TICKET
+            )
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", script], check=True, capture_output=True)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_in_process(runs, output):
+    sink = FileSink(output)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = print_ticket(sink=sink, **TICKET)
+        samples.append(time.perf_counter() - start)
+        assert result["success"], result["message"]
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de impresión de tickets")
+    parser.add_argument("--runs", type=int, default=20, help="Tickets por escenario")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "ticket.bin")
+        
+        print(f"Tickets por escenario: {args.runs}\n")
+        before = summarize("Antes (subproceso)", bench_subprocess(args.runs, output))
+        after = summarize("Ahora (en proceso)", bench_in_process(args.runs, output))
+        print(f"\nMejora: x{before / after:.0f}")
+
+
+if __name__ == "__main__":
+    main()
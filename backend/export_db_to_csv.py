@@ -1,21 +1,36 @@
 #!/usr/bin/env python3
 """
-Exportar TODA la base de datos a archivos CSV
+Exportar TODA la base de datos a archivos CSV (o Parquet)
 Uso:
     docker-compose exec backend python3 export_db_to_csv.py
-    
+    docker-compose exec backend python3 export_db_to_csv.py --jobs 4 --compress zstd
+    docker-compose exec backend python3 export_db_to_csv.py --format parquet
+
 Los archivos se guardarán en /app/backups/csv/FECHA/
+
+En PostgreSQL cada tabla se vuelca con COPY (SELECT ...) TO STDOUT WITH CSV
+directamente al archivo: sin objetos ORM ni DataFrames, memoria constante.
+Con --jobs > 1 las tablas se exportan en paralelo, todas desde la misma
+instantánea (pg_export_snapshot), así que el conjunto es coherente.
 """
 
 import sys
 import os
+import argparse
+import csv
+import gzip
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
 # Add app to path
 sys.path.insert(0, '/app')
-from app.database import SessionLocal
+from sqlalchemy import select, case, cast, func, String, Integer, Float, Boolean, DateTime
+from sqlalchemy.pool import NullPool
+from app.database import create_analytics_engine
 from app import models
 
 # Configuración
@@ -30,210 +45,388 @@ BACKUP_DIR.mkdir(exist_ok=True)
 CSV_DIR = BACKUP_DIR / "csv"
 CSV_DIR.mkdir(exist_ok=True)
 
-def export_to_csv():
-    """Exportar todas las tablas a CSV"""
-    
+CHUNK_SIZE = 10000  # Filas por lote (modo Parquet y bases de datos sin COPY)
+EXPORT_TIMEZONE = "Europe/Madrid"
+
+# statement_timeout de analytics (un COPY de una tabla entera supera el de
+# recepción). Sin pool: una conexión por hilo de --jobs más la coordinadora
+engine = create_analytics_engine(poolclass=NullPool)
+
+# ============================================================================
+# CONSULTAS DE EXPORTACIÓN
+# ============================================================================
+
+def _enum_value(column, enum_cls, name):
+    """Los Enum se guardan por NOMBRE; en el CSV va el valor ('COMPLETED' -> 'completed')"""
+    return case(
+        {member.name: member.value for member in enum_cls},
+        value=cast(column, String),
+        else_=cast(column, String)
+    ).label(name)
+
+
+def _or_zero(column, name):
+    return func.coalesce(column, 0).label(name)
+
+
+def _or_empty(column, name):
+    return func.coalesce(column, '').label(name)
+
+
+def _users_query():
+    return select(
+        models.User.id,
+        models.User.username,
+        models.User.is_active,
+        _enum_value(models.User.role, models.UserRole, "role")
+    ).order_by(models.User.id)
+
+
+def _vehicles_query():
+    return select(
+        models.Vehicle.id,
+        models.Vehicle.license_plate,
+        models.Vehicle.vehicle_type,
+        _or_empty(models.Vehicle.brand, "brand"),
+        _or_empty(models.Vehicle.country, "country"),
+        models.Vehicle.is_blacklisted
+    ).order_by(models.Vehicle.id)
+
+
+def _spots_query():
+    return select(
+        models.ParkingSpot.id,
+        models.ParkingSpot.spot_number,
+        _enum_value(models.ParkingSpot.spot_type, models.SpotType, "spot_type"),
+        models.ParkingSpot.is_occupied
+    ).order_by(models.ParkingSpot.id)
+
+
+def _stays_query():
+    Stay = models.Stay
+    return select(
+        Stay.id,
+        Stay.vehicle_id,
+        models.Vehicle.license_plate,
+        Stay.parking_spot_id,
+        models.ParkingSpot.spot_number,
+        Stay.detection_time,
+        Stay.check_in_time,
+        Stay.check_out_time,
+        _enum_value(Stay.status, models.StayStatus, "status"),
+        _or_zero(Stay.final_price, "final_price"),
+        _enum_value(Stay.payment_status, models.PaymentStatus, "payment_status"),
+        _enum_value(Stay.payment_method, models.PaymentMethod, "payment_method"),
+        _or_zero(Stay.amount_paid, "amount_paid"),
+        _or_zero(Stay.change_given, "change_given"),
+        _or_zero(Stay.prepaid_amount, "prepaid_amount"),
+        Stay.cash_registered,
+        Stay.prepayment_cash_registered,
+        Stay.user_id
+    ).join(
+        models.Vehicle, Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.ParkingSpot, Stay.parking_spot_id == models.ParkingSpot.id
+    ).order_by(Stay.id)
+
+
+def _history_query():
+    return select(
+        models.HistoryLog.id,
+        models.HistoryLog.stay_id,
+        models.HistoryLog.action,
+        models.HistoryLog.timestamp,
+        cast(models.HistoryLog.details, String).label("details"),
+        models.HistoryLog.user_id,
+        models.User.username
+    ).outerjoin(
+        models.User, models.HistoryLog.user_id == models.User.id
+    ).order_by(models.HistoryLog.id)
+
+
+def _blacklist_query():
+    return select(
+        models.Blacklist.id,
+        models.Blacklist.vehicle_id,
+        models.Blacklist.license_plate,
+        models.Blacklist.reason,
+        models.Blacklist.amount_owed,
+        models.Blacklist.incident_date,
+        models.Blacklist.stay_id,
+        _or_empty(models.Blacklist.notes, "notes"),
+        models.Blacklist.resolved
+    ).order_by(models.Blacklist.id)
+
+
+def _cash_sessions_query():
+    from sqlalchemy.orm import aliased
+
+    opened_by = aliased(models.User)
+    closed_by = aliased(models.User)
+    CashSession = models.CashSession
+    return select(
+        CashSession.id,
+        CashSession.opened_at,
+        CashSession.closed_at,
+        CashSession.opened_by_user_id,
+        opened_by.username.label("opened_by_username"),
+        CashSession.closed_by_user_id,
+        closed_by.username.label("closed_by_username"),
+        CashSession.initial_amount,
+        _or_zero(CashSession.expected_final_amount, "expected_final_amount"),
+        _or_zero(CashSession.actual_final_amount, "actual_final_amount"),
+        _or_zero(CashSession.difference, "difference"),
+        _enum_value(CashSession.status, models.CashSessionStatus, "status"),
+        _or_empty(CashSession.notes, "notes")
+    ).outerjoin(
+        opened_by, CashSession.opened_by_user_id == opened_by.id
+    ).outerjoin(
+        closed_by, CashSession.closed_by_user_id == closed_by.id
+    ).order_by(CashSession.id)
+
+
+def _cash_transactions_query():
+    CashTransaction = models.CashTransaction
+    return select(
+        CashTransaction.id,
+        CashTransaction.cash_session_id,
+        CashTransaction.timestamp,
+        _enum_value(CashTransaction.transaction_type, models.TransactionType, "transaction_type"),
+        CashTransaction.stay_id,
+        models.Vehicle.license_plate,
+        CashTransaction.amount_due,
+        _or_zero(CashTransaction.amount_paid, "amount_paid"),
+        _or_zero(CashTransaction.change_given, "change_given"),
+        _enum_value(CashTransaction.payment_method, models.PaymentMethod, "payment_method"),
+        CashTransaction.user_id,
+        models.User.username,
+        _or_empty(CashTransaction.notes, "notes")
+    ).outerjoin(
+        models.Stay, CashTransaction.stay_id == models.Stay.id
+    ).outerjoin(
+        models.Vehicle, models.Stay.vehicle_id == models.Vehicle.id
+    ).outerjoin(
+        models.User, CashTransaction.user_id == models.User.id
+    ).order_by(CashTransaction.id)
+
+
+# (archivo, descripción, consulta) en el orden de exportación
+EXPORTS = [
+    ("users", "usuarios", _users_query),
+    ("vehicles", "vehículos", _vehicles_query),
+    ("parking_spots", "plazas", _spots_query),
+    ("stays", "estancias", _stays_query),
+    ("history_logs", "registros de historial", _history_query),
+    ("blacklist", "entradas de lista negra", _blacklist_query),
+    ("cash_sessions", "sesiones de caja", _cash_sessions_query),
+    ("cash_transactions", "transacciones de caja", _cash_transactions_query),
+]
+
+# ============================================================================
+# ESCRITURA
+# ============================================================================
+
+def _open_output(path: Path, compress: str):
+    """Archivo binario de salida, comprimido si se pide"""
+    if compress == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compress == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, "wb"))
+    return open(path, "wb")
+
+
+def _output_name(name: str, fmt: str, compress: str) -> str:
+    if fmt == "parquet":
+        return f"{name}.parquet"
+    suffix = {"gzip": ".gz", "zstd": ".zst"}.get(compress, "")
+    return f"{name}.csv{suffix}"
+
+
+def _begin_snapshot_transaction(raw, snapshot=None):
+    """Transacción de solo lectura; con snapshot, la misma vista que el coordinador"""
+    cur = raw.cursor()
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    if snapshot:
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+    cur.execute("SET LOCAL TIME ZONE %s", (EXPORT_TIMEZONE,))
+    return cur
+
+
+def _copy_csv(stmt, path: Path, compress: str, snapshot) -> int:
+    """COPY (SELECT ...) TO STDOUT directo al archivo (solo PostgreSQL)"""
+    sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+    raw = engine.raw_connection()
     try:
-        import pandas as pd
-    except ImportError:
-        print("❌ Instala pandas: pip install pandas")
-        return False
-    
+        cur = _begin_snapshot_transaction(raw, snapshot)
+        with _open_output(path, compress) as out:
+            out.write("\ufeff".encode("utf-8"))  # BOM: Excel abre bien los acentos
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", out)
+        rows = cur.rowcount
+        raw.rollback()
+        return rows
+    finally:
+        raw.close()
+
+
+def _stream_csv(stmt, path: Path, compress: str) -> int:
+    """Alternativa sin COPY (SQLite en desarrollo): cursor del servidor por lotes"""
+    rows = 0
+    with engine.connect() as conn, _open_output(path, compress) as raw_out:
+        out = io.TextIOWrapper(raw_out, encoding="utf-8-sig", newline="")
+        writer = csv.writer(out)
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK_SIZE).execute(stmt)
+        writer.writerow(result.keys())
+        for chunk in result.partitions():
+            writer.writerows(chunk)
+            rows += len(chunk)
+        out.flush()
+        out.detach()
+    return rows
+
+
+def _arrow_schema(stmt):
+    import pyarrow as pa
+
+    fields = []
+    for column in stmt.selected_columns:
+        sql_type = column.type
+        if isinstance(sql_type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(sql_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(sql_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(sql_type, DateTime):
+            arrow_type = pa.timestamp("us", tz=EXPORT_TIMEZONE if sql_type.timezone else None)
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.key, arrow_type))
+    return pa.schema(fields)
+
+
+def _write_parquet(stmt, path: Path, compress: str, snapshot) -> int:
+    """Parquet por lotes de CHUNK_SIZE filas (un row group por lote)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(stmt)
+    codec = compress if compress != "none" else "snappy"
+    rows = 0
+
+    with engine.connect() as conn:
+        if snapshot:
+            conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            conn.exec_driver_sql(f"SET TRANSACTION SNAPSHOT '{snapshot}'")
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK_SIZE).execute(stmt)
+
+        with pq.ParquetWriter(path, schema, compression=codec) as writer:
+            for chunk in result.partitions():
+                columns = list(zip(*chunk))
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                rows += len(chunk)
+        conn.rollback()
+    return rows
+
+
+def _export_table(name, query, export_dir, fmt, compress, snapshot):
+    stmt = query()
+    path = export_dir / _output_name(name, fmt, compress)
+    start = time.monotonic()
+
+    if fmt == "parquet":
+        rows = _write_parquet(stmt, path, compress, snapshot)
+    elif engine.dialect.name == "postgresql":
+        rows = _copy_csv(stmt, path, compress, snapshot)
+    else:
+        rows = _stream_csv(stmt, path, compress)
+
+    return rows, time.monotonic() - start
+
+
+def export_to_csv(fmt: str = "csv", jobs: int = 1, compress: str = "none"):
+    """Exportar todas las tablas a CSV (o Parquet)"""
+
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("❌ Instala pyarrow: pip install pyarrow")
+            return False
+
     # Crear carpeta con timestamp
     timestamp = datetime.now(ZoneInfo("Europe/Madrid")).strftime("%Y%m%d_%H%M%S")
     export_dir = CSV_DIR / f"export_{timestamp}"
     export_dir.mkdir(exist_ok=True)
-    
+
     print("=" * 70)
-    print("📤 EXPORTANDO BASE DE DATOS A CSV")
+    print(f"📤 EXPORTANDO BASE DE DATOS A {fmt.upper()}")
     print("=" * 70)
     print(f"Directorio: {export_dir}")
+    print(f"Tablas en paralelo: {jobs} | Compresión: {compress}")
     print()
-    
-    db = SessionLocal()
-    
+
+    # En PostgreSQL todas las tablas se leen desde la misma instantánea
+    coordinator = None
+    snapshot = None
+    if engine.dialect.name == "postgresql":
+        coordinator = engine.raw_connection()
+        cur = _begin_snapshot_transaction(coordinator)
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot = cur.fetchone()[0]
+
     try:
-        # ====================================================================
-        # USUARIOS
-        # ====================================================================
-        print("📋 Exportando usuarios...")
-        users = db.query(models.User).all()
-        df_users = pd.DataFrame([{
-            'id': u.id,
-            'username': u.username,
-            'is_active': u.is_active,
-            'role': u.role.value
-        } for u in users])
-        df_users.to_csv(export_dir / "users.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(users)} usuarios exportados")
-        
-        # ====================================================================
-        # VEHÍCULOS
-        # ====================================================================
-        print("📋 Exportando vehículos...")
-        vehicles = db.query(models.Vehicle).all()
-        df_vehicles = pd.DataFrame([{
-            'id': v.id,
-            'license_plate': v.license_plate,
-            'vehicle_type': v.vehicle_type,
-            'brand': v.brand or '',
-            'country': v.country or '',
-            'is_blacklisted': v.is_blacklisted
-        } for v in vehicles])
-        df_vehicles.to_csv(export_dir / "vehicles.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(vehicles)} vehículos exportados")
-        
-        # ====================================================================
-        # PLAZAS DE PARKING
-        # ====================================================================
-        print("📋 Exportando plazas de parking...")
-        spots = db.query(models.ParkingSpot).all()
-        df_spots = pd.DataFrame([{
-            'id': s.id,
-            'spot_number': s.spot_number,
-            'spot_type': s.spot_type.value,
-            'is_occupied': s.is_occupied
-        } for s in spots])
-        df_spots.to_csv(export_dir / "parking_spots.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(spots)} plazas exportadas")
-        
-        # ====================================================================
-        # ESTANCIAS
-        # ====================================================================
-        print("📋 Exportando estancias...")
-        stays = db.query(models.Stay).all()
-        df_stays = pd.DataFrame([{
-            'id': s.id,
-            'vehicle_id': s.vehicle_id,
-            'license_plate': s.vehicle.license_plate,
-            'parking_spot_id': s.parking_spot_id,
-            'spot_number': s.parking_spot.spot_number if s.parking_spot else '',
-            'detection_time': s.detection_time,
-            'check_in_time': s.check_in_time,
-            'check_out_time': s.check_out_time,
-            'status': s.status.value,
-            'final_price': s.final_price or 0,
-            'payment_status': s.payment_status.value,
-            'payment_method': s.payment_method.value if s.payment_method else '',
-            'amount_paid': s.amount_paid or 0,
-            'change_given': s.change_given or 0,
-            'prepaid_amount': s.prepaid_amount or 0,
-            'cash_registered': s.cash_registered,
-            'prepayment_cash_registered': s.prepayment_cash_registered,
-            'user_id': s.user_id
-        } for s in stays])
-        df_stays.to_csv(export_dir / "stays.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(stays)} estancias exportadas")
-        
-        # ====================================================================
-        # HISTORIAL
-        # ====================================================================
-        print("📋 Exportando historial...")
-        history = db.query(models.HistoryLog).all()
-        df_history = pd.DataFrame([{
-            'id': h.id,
-            'stay_id': h.stay_id,
-            'action': h.action,
-            'timestamp': h.timestamp,
-            'details': str(h.details) if h.details else '',
-            'user_id': h.user_id,
-            'username': h.user.username if h.user else ''
-        } for h in history])
-        df_history.to_csv(export_dir / "history_logs.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(history)} registros de historial exportados")
-        
-        # ====================================================================
-        # LISTA NEGRA
-        # ====================================================================
-        print("📋 Exportando lista negra...")
-        blacklist = db.query(models.Blacklist).all()
-        df_blacklist = pd.DataFrame([{
-            'id': b.id,
-            'vehicle_id': b.vehicle_id,
-            'license_plate': b.license_plate,
-            'reason': b.reason,
-            'amount_owed': b.amount_owed,
-            'incident_date': b.incident_date,
-            'stay_id': b.stay_id,
-            'notes': b.notes or '',
-            'resolved': b.resolved
-        } for b in blacklist])
-        df_blacklist.to_csv(export_dir / "blacklist.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(blacklist)} entradas de lista negra exportadas")
-        
-        # ====================================================================
-        # SESIONES DE CAJA
-        # ====================================================================
-        print("📋 Exportando sesiones de caja...")
-        cash_sessions = db.query(models.CashSession).all()
-        df_cash_sessions = pd.DataFrame([{
-            'id': cs.id,
-            'opened_at': cs.opened_at,
-            'closed_at': cs.closed_at,
-            'opened_by_user_id': cs.opened_by_user_id,
-            'opened_by_username': cs.opened_by.username if cs.opened_by else '',
-            'closed_by_user_id': cs.closed_by_user_id,
-            'closed_by_username': cs.closed_by.username if cs.closed_by else '',
-            'initial_amount': cs.initial_amount,
-            'expected_final_amount': cs.expected_final_amount or 0,
-            'actual_final_amount': cs.actual_final_amount or 0,
-            'difference': cs.difference or 0,
-            'status': cs.status.value,
-            'notes': cs.notes or ''
-        } for cs in cash_sessions])
-        df_cash_sessions.to_csv(export_dir / "cash_sessions.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(cash_sessions)} sesiones de caja exportadas")
-        
-        # ====================================================================
-        # TRANSACCIONES DE CAJA
-        # ====================================================================
-        print("📋 Exportando transacciones de caja...")
-        cash_transactions = db.query(models.CashTransaction).all()
-        df_cash_transactions = pd.DataFrame([{
-            'id': ct.id,
-            'cash_session_id': ct.cash_session_id,
-            'timestamp': ct.timestamp,
-            'transaction_type': ct.transaction_type.value,
-            'stay_id': ct.stay_id or '',
-            'license_plate': ct.stay.vehicle.license_plate if ct.stay else '',
-            'amount_due': ct.amount_due,
-            'amount_paid': ct.amount_paid or 0,
-            'change_given': ct.change_given or 0,
-            'payment_method': ct.payment_method.value,
-            'user_id': ct.user_id,
-            'username': ct.user.username if ct.user else '',
-            'notes': ct.notes or ''
-        } for ct in cash_transactions])
-        df_cash_transactions.to_csv(export_dir / "cash_transactions.csv", index=False, encoding='utf-8-sig')
-        print(f"   ✓ {len(cash_transactions)} transacciones de caja exportadas")
-        
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = [
+                (name, label, pool.submit(_export_table, name, query, export_dir, fmt, compress, snapshot))
+                for name, label, query in EXPORTS
+            ]
+            for name, label, future in futures:
+                rows, elapsed = future.result()
+                print(f"   ✓ {rows} {label} exportados ({elapsed:.1f}s)")
+
         # ====================================================================
         # RESUMEN
         # ====================================================================
         print("\n" + "=" * 70)
-        print("✅ EXPORTACIÓN COMPLETADA")
+        print(f"✅ EXPORTACIÓN COMPLETADA en {time.monotonic() - start:.1f}s")
         print("=" * 70)
         print(f"\nArchivos guardados en: {export_dir}")
         print("\nArchivos creados:")
-        for csv_file in sorted(export_dir.glob("*.csv")):
-            size_kb = csv_file.stat().st_size / 1024
-            print(f"  - {csv_file.name:<30} ({size_kb:>8.2f} KB)")
-        
+        for export_file in sorted(export_dir.iterdir()):
+            size_kb = export_file.stat().st_size / 1024
+            print(f"  - {export_file.name:<30} ({size_kb:>8.2f} KB)")
+
         print("\n💡 Para ver los archivos:")
         print(f"   Los archivos están en: backend/backups/csv/export_{timestamp}/")
         print("\n   O desde Docker:")
         print(f"   docker-compose exec backend ls -lh /app/backups/csv/export_{timestamp}/")
-        
+
         return True
-        
+
     except Exception as e:
         print(f"\n❌ Error exportando: {e}")
         import traceback
         traceback.print_exc()
         return False
     finally:
-        db.close()
+        if coordinator is not None:
+            coordinator.rollback()
+            coordinator.close()
+
 
 if __name__ == "__main__":
-    success = export_to_csv()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Exportar la base de datos completa")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--jobs", "-j", type=int, default=int(os.getenv("EXPORT_JOBS", "1")),
+                        help="Tablas exportadas en paralelo")
+    parser.add_argument("--compress", choices=["none", "gzip", "zstd"], default="none")
+    args = parser.parse_args()
+
+    success = export_to_csv(fmt=args.format, jobs=args.jobs, compress=args.compress)
+    sys.exit(0 if success else 1)
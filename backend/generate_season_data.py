@@ -0,0 +1,766 @@
+#!/usr/bin/env python3
+"""
+Generador de temporadas sintéticas (datos de carga y de benchmarks)
+
+Simula campañas completas (Sept - Jun) día a día con datos realistas:
+- Llegadas según estacionalidad mensual (y fines de semana algo más fuertes)
+- Mezcla de países, matrículas por país, alquiler y clientes que repiten
+- Distribución de noches por estancia y plaza según su tipo (sin solapes)
+- Prepagos, extensiones, transferencias (pendientes y confirmadas) y SINPAs
+- Una caja por día con sus transacciones, cierre y desglose de billetes
+- history_logs con las mismas acciones que registra la aplicación
+
+La carga usa COPY en PostgreSQL: 5 temporadas se cargan en segundos. Es el
+fixture de los tests de rendimiento (benchmarks/): misma semilla, mismos datos.
+
+⚠️ Con --truncate se BORRAN estancias, vehículos, caja e historial.
+
+Uso:
+    docker-compose exec backend python3 generate_season_data.py --truncate
+    python3 generate_season_data.py --seasons 3 --arrivals 40 --prepay 0.5 --seed 7
+    python3 generate_season_data.py --seasonality "9:0.5,10:0.8,11:1,12:1" --countries "Spain:0.6,France:0.4"
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import json
+import math
+import os
+import random
+import string
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from enum import Enum
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, text
+
+from app import models
+from app.plates import normalize_plate
+from app.utils import get_campaign_year, get_campaign_dates
+from app.partitions import ensure_partitions
+from app.schema_updates import apply_schema_updates
+from app.vehicle_stats import recompute_vehicle_stats
+
+MADRID = ZoneInfo("Europe/Madrid")
+
+# ============================================================================
+# CONFIGURACIÓN POR DEFECTO
+# ============================================================================
+
+DEFAULTS = {
+    "seasons": 5,
+    "start_year": None,            # None: las últimas N campañas (incluida la actual)
+    "seed": 42,
+    "arrivals": 16,                # Llegadas/día en el mes de más demanda
+    # Peso de cada mes de campaña (1.0 = pico)
+    "seasonality": {9: 0.45, 10: 0.7, 11: 0.85, 12: 0.9, 1: 0.95, 2: 1.0,
+                    3: 0.95, 4: 0.8, 5: 0.55, 6: 0.35},
+    "weekend_boost": 1.2,
+    "countries": {"Spain": 0.30, "France": 0.20, "Germany": 0.15, "Netherlands": 0.08,
+                  "United Kingdom": 0.07, "Belgium": 0.05, "Italy": 0.05,
+                  "Portugal": 0.04, "Switzerland": 0.03, "Poland": 0.03},
+    # Noches por estancia
+    "stay_lengths": {1: 0.30, 2: 0.22, 3: 0.15, 4: 0.08, 5: 0.05, 6: 0.03,
+                     7: 0.08, 10: 0.03, 14: 0.04, 21: 0.01, 30: 0.01},
+    "prepay": 0.35,                # Estancias que pagan por adelantado
+    "extension": 0.15,             # Prepagadas que amplían su estancia
+    "transfer": 0.05,              # Pagos por transferencia
+    "card": 0.45,                  # Pagos con tarjeta (el resto, efectivo)
+    "sinpa": 0.01,                 # Se van sin pagar
+    "rental": 0.15,                # Vehículos de alquiler
+    "returning": 0.20,             # Llegadas de vehículos que ya vinieron
+    "discard": 0.06,               # Detecciones descartadas (visitantes)
+    "pending": 3,                  # Detecciones pendientes hoy (campaña en curso)
+}
+
+# Precio por noche según tipo de plaza (mismos que el frontend)
+PRICES = {
+    models.SpotType.A: 12.0,
+    models.SpotType.B: 14.0,
+    models.SpotType.CB: 18.0,
+    models.SpotType.C: 18.0,
+    models.SpotType.CPLUS: 36.0,
+}
+
+# Demanda por tipo de plaza (si no hay libre del preferido, cualquier otra)
+SPOT_DEMAND = {
+    models.SpotType.A: 0.45,
+    models.SpotType.B: 0.25,
+    models.SpotType.CB: 0.05,
+    models.SpotType.C: 0.22,
+    models.SpotType.CPLUS: 0.03,
+}
+
+VEHICLE_TYPES = {"Autocaravana": 0.6, "Camper": 0.3, "Caravana": 0.1}
+BRANDS = ["Hymer", "Adria", "Knaus", "Dethleffs", "Bürstner", "Carthago", "Pilote",
+          "Rapido", "Benimar", "Fiat", "VW", "Mercedes", "Ford", "Citroën"]
+
+# Formato de matrícula por país (# dígito, @ letra)
+PLATE_FORMATS = {
+    "Spain": "####@@@",
+    "France": "@@-###-@@",
+    "Germany": "@@-@@ ####",
+    "Netherlands": "@@-###-@",
+    "United Kingdom": "@@## @@@",
+    "Belgium": "#-@@@-###",
+    "Italy": "@@###@@",
+    "Portugal": "##-@@-##",
+    "Switzerland": "@@ ######",
+    "Poland": "@@ #####",
+}
+
+DENOMINATIONS = ["500", "200", "100", "50", "20", "10", "5",
+                 "2", "1", "0.50", "0.20", "0.10", "0.05", "0.02", "0.01"]
+
+CASH_FLOAT = 300.0  # Cambio que se deja en caja al cerrar
+
+SESSION_CLOSING_COLUMNS = (
+    "expected_cash", "expected_card", "expected_transfer", "expected_final_amount",
+    "actual_cash", "actual_card", "actual_transfer", "actual_final_amount", "cash_breakdown",
+    "suggested_withdrawal", "actual_withdrawal", "remaining_in_register",
+    "difference", "cash_difference",
+)
+
+# Orden de carga (claves foráneas) y tablas que se vacían con --truncate
+LOAD_ORDER = ["vehicles", "stays", "history_logs", "blacklist",
+              "cash_sessions", "cash_transactions", "pending_transfers"]
+TRUNCATE_TABLES = LOAD_ORDER + ["campaign_aggregates"]
+
+
+def parse_weights(value: str, key=str) -> dict:
+    """'9:0.6,10:0.9' -> {9: 0.6, 10: 0.9}"""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.rpartition(":")
+        if not name:
+            raise argparse.ArgumentTypeError(f"Formato 'clave:peso' esperado: {item!r}")
+        weights[key(name.strip())] = float(weight)
+    return weights
+
+
+# ============================================================================
+# SIMULACIÓN
+# ============================================================================
+
+class _Dataset:
+    """Filas por tabla (dicts) con ids asignados en memoria"""
+
+    def __init__(self, next_ids: dict):
+        self.rows = {table: [] for table in LOAD_ORDER}
+        self._next_ids = dict(next_ids)
+
+    def add(self, table: str, **values) -> dict:
+        row = {"id": self._next_ids[table], **values}
+        self._next_ids[table] += 1
+        self.rows[table].append(row)
+        return row
+
+
+class _SeasonSimulator:
+
+    def __init__(self, options: dict, users: dict, spots: list, next_ids: dict):
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.data = _Dataset(next_ids)
+        self.now = datetime.now(MADRID)
+        self.today = self.now.date()
+        self.usernames = users                 # user_id -> username
+        self.workers = list(users)
+        self.spots = spots                     # [(id, spot_number, spot_type)]
+        self.free_at = {spot[0]: date.min for spot in spots}
+        self.vehicles = []                     # Vehículos que pueden volver
+        self.parked_until = {}                 # vehicle_id -> día de salida
+        self.used_plates = set()
+        self.sessions = {}                     # día -> fila de cash_sessions
+        self.session_days = []
+        self.staff = {}                        # día -> user_id del turno
+
+    # ---------------------------------------------------------------- azar
+
+    def _choice(self, weights: dict):
+        return self.rng.choices(list(weights), weights=list(weights.values()))[0]
+
+    def _poisson(self, mean: float) -> int:
+        if mean <= 0:
+            return 0
+        limit, k, p = math.exp(-mean), 0, 1.0
+        while True:
+            p *= self.rng.random()
+            if p <= limit:
+                return k
+            k += 1
+
+    def _at(self, day: date, start_hour: float, end_hour: float) -> datetime:
+        minutes = self.rng.uniform(start_hour * 60, end_hour * 60)
+        return datetime.combine(day, datetime.min.time(), tzinfo=MADRID) + timedelta(minutes=minutes)
+
+    # ---------------------------------------------------------------- caja
+
+    def _open_sessions(self, days):
+        """Una caja por día de campaña (la de hoy queda abierta)"""
+        for day in days:
+            user_id = self.rng.choice(self.workers)
+            self.staff[day] = user_id
+            self.sessions[day] = self.data.add(
+                "cash_sessions",
+                opened_at=self._at(day, 8.5, 8.75),
+                closed_at=None,
+                opened_by_user_id=user_id,
+                closed_by_user_id=None,
+                initial_amount=CASH_FLOAT,
+                **{column: None for column in SESSION_CLOSING_COLUMNS},
+                status=models.CashSessionStatus.OPEN,
+                notes=None
+            )
+        self.session_days = sorted(self.sessions)
+
+    def _session_day(self, when: datetime):
+        """Primer día con caja desde 'when' (None si cae en el futuro)"""
+        if when > self.now:
+            return None
+        index = bisect.bisect_left(self.session_days, when.date())
+        if index == len(self.session_days):
+            return None
+        return self.session_days[index]
+
+    def _log(self, stay: dict, action: str, when: datetime, details: dict):
+        self.data.add(
+            "history_logs", stay_id=stay["id"], action=action, timestamp=when,
+            details=details, user_id=self.staff.get(when.date(), self.workers[0])
+        )
+
+    def _payment_method(self):
+        roll = self.rng.random()
+        if roll < self.options["transfer"]:
+            return models.PaymentMethod.TRANSFER
+        if roll < self.options["transfer"] + self.options["card"]:
+            return models.PaymentMethod.CARD
+        return models.PaymentMethod.CASH
+
+    def _pay(self, stay: dict, tx_type, amount: float, method, when: datetime,
+             notes: str, plate: str) -> bool:
+        """
+        Cobro como lo hace la aplicación: efectivo/tarjeta a la caja del día,
+        transferencia a pendientes (confirmada días después si ya ha pasado).
+        Devuelve si el cobro quedó registrado en caja.
+        """
+        if method == models.PaymentMethod.TRANSFER:
+            pending = self.data.add(
+                "pending_transfers", stay_id=stay["id"], transaction_type=tx_type,
+                amount=amount, payment_method=models.PaymentMethod.TRANSFER,
+                created_at=when, created_by_user_id=self.staff[when.date()],
+                confirmed=False, confirmed_at=None, confirmed_by_user_id=None,
+                notes=f"{notes} - {plate}"
+            )
+            confirmed_at = self._at(when.date() + timedelta(days=self.rng.randint(1, 4)), 9, 13)
+            day = self._session_day(confirmed_at)
+            if day is None:
+                return False
+            confirmed_at = self._at(day, 9, 13)
+            if confirmed_at > self.now:
+                return False
+            pending.update(confirmed=True, confirmed_at=confirmed_at,
+                           confirmed_by_user_id=self.staff[day])
+            self.data.add(
+                "cash_transactions", cash_session_id=self.sessions[day]["id"],
+                timestamp=confirmed_at, transaction_type=tx_type, stay_id=stay["id"],
+                product_id=None, product_name=None, amount_due=amount, amount_paid=amount,
+                change_given=0.0, payment_method=models.PaymentMethod.TRANSFER,
+                user_id=self.staff[day], notes=f"Transferencia confirmada - {pending['notes']}"
+            )
+            self._log(stay, "Transferencia bancaria confirmada", confirmed_at, {
+                "amount": amount,
+                "transaction_type": tx_type.value,
+                "confirmed_by": self.usernames[self.staff[day]]
+            })
+            return True
+
+        amount_paid, change = amount, 0.0
+        if method == models.PaymentMethod.CASH and self.rng.random() < 0.6:
+            # Paga con un billete mayor y se le da cambio
+            amount_paid = float(next((n for n in (5, 10, 20, 50, 100, 200, 500) if n >= amount), amount))
+            change = round(amount_paid - amount, 2)
+        day = when.date()
+        self.data.add(
+            "cash_transactions", cash_session_id=self.sessions[day]["id"], timestamp=when,
+            transaction_type=tx_type, stay_id=stay["id"], product_id=None, product_name=None,
+            amount_due=amount, amount_paid=amount_paid, change_given=change,
+            payment_method=method, user_id=self.staff[day], notes=notes
+        )
+        return True
+
+    def _close_sessions(self):
+        """Cierre de cada caja pasada con lo esperado, lo contado y el retiro"""
+        totals = defaultdict(lambda: {"cash": 0.0, "card": 0.0, "transfer": 0.0})
+        for tx in self.data.rows["cash_transactions"]:
+            key = tx["payment_method"].value
+            totals[tx["cash_session_id"]][key] += tx["amount_due"]
+
+        initial = CASH_FLOAT
+        for day in self.session_days:
+            session = self.sessions[day]
+            session["initial_amount"] = initial
+            if day >= self.today:
+                continue  # Caja de hoy: abierta
+
+            t = totals[session["id"]]
+            expected_cash = round(initial + t["cash"], 2)
+            actual_cash = expected_cash
+            if self.rng.random() < 0.05:
+                actual_cash = round(expected_cash + self.rng.choice([-1, 1]) * self.rng.randint(1, 10), 2)
+            withdrawal = max(0.0, round(actual_cash - CASH_FLOAT, 2))
+            remaining = round(actual_cash - withdrawal, 2)
+
+            session.update(
+                closed_at=self._at(day, 21, 21.5),
+                closed_by_user_id=session["opened_by_user_id"],
+                expected_cash=expected_cash,
+                expected_card=round(t["card"], 2),
+                expected_transfer=round(t["transfer"], 2),
+                expected_final_amount=expected_cash,
+                actual_cash=actual_cash,
+                actual_card=round(t["card"], 2),
+                actual_transfer=round(t["transfer"], 2),
+                actual_final_amount=actual_cash,
+                cash_breakdown=_cash_breakdown(actual_cash),
+                suggested_withdrawal=max(0.0, round(expected_cash - CASH_FLOAT, 2)),
+                actual_withdrawal=withdrawal,
+                remaining_in_register=remaining,
+                difference=round(actual_cash - expected_cash, 2),
+                cash_difference=round(actual_cash - expected_cash, 2),
+                status=models.CashSessionStatus.CLOSED
+            )
+            initial = remaining
+
+    # ---------------------------------------------------------------- vehículos
+
+    def _new_plate(self, country: str) -> str:
+        pattern = PLATE_FORMATS.get(country, "@@####")
+        while True:
+            plate = "".join(
+                self.rng.choice(string.digits) if ch == "#"
+                else self.rng.choice("BCDFGHJKLMNPRSTVWXYZ") if ch == "@" else ch
+                for ch in pattern
+            )
+            key = normalize_plate(plate)
+            if key not in self.used_plates:
+                self.used_plates.add(key)
+                return plate
+
+    def _vehicle(self, day: date) -> dict:
+        if self.vehicles and self.rng.random() < self.options["returning"]:
+            vehicle = self.rng.choice(self.vehicles)
+            if not vehicle["is_blacklisted"] and self.parked_until.get(vehicle["id"], date.min) <= day:
+                return vehicle
+
+        country = self._choice(self.options["countries"])
+        plate = self._new_plate(country)
+        vehicle = self.data.add(
+            "vehicles", license_plate=plate, plate_key=normalize_plate(plate),
+            vehicle_type=self._choice(VEHICLE_TYPES), brand=self.rng.choice(BRANDS),
+            country=country, is_blacklisted=False,
+            is_rental=self.rng.random() < self.options["rental"]
+        )
+        self.vehicles.append(vehicle)
+        return vehicle
+
+    def _spot(self, day: date):
+        free = [spot for spot in self.spots if self.free_at[spot[0]] <= day]
+        if not free:
+            return None
+        wanted = self._choice(SPOT_DEMAND)
+        preferred = [spot for spot in free if spot[2] == wanted]
+        return self.rng.choice(preferred or free)
+
+    # ---------------------------------------------------------------- estancias
+
+    def _new_stay(self, vehicle: dict, detection: datetime, **values) -> dict:
+        fields = {
+            "vehicle_id": vehicle["id"], "parking_spot_id": None, "detection_time": detection,
+            "check_in_time": None, "check_out_time": None, "status": models.StayStatus.PENDING,
+            "final_price": None, "payment_status": models.PaymentStatus.PENDING,
+            "prepaid_amount": None, "user_id": None, "payment_method": None,
+            "amount_paid": None, "change_given": None, "cash_registered": False,
+            "prepayment_cash_registered": False,
+        }
+        fields.update(values)
+        return self.data.add("stays", **fields)
+
+    def _arrival(self, day: date, last_day: date):
+        vehicle = self._vehicle(day)
+        detection = self._at(day, 12, 20)  # Entradas tras las salidas (9-12h)
+        if detection > self.now:
+            return
+        staff = self.staff[day]
+
+        if self.rng.random() < self.options["discard"]:
+            stay = self._new_stay(vehicle, detection, status=models.StayStatus.DISCARDED, user_id=staff)
+            self._log(stay, "Stay discarded - Visitor", detection + timedelta(minutes=2), {
+                "reason": "Visitante", "vehicle_blacklisted": False, "is_visitor": True
+            })
+            return
+
+        spot = self._spot(day)
+        if spot is None:
+            stay = self._new_stay(vehicle, detection, status=models.StayStatus.DISCARDED, user_id=staff)
+            self._log(stay, "Stay discarded - Other reason", detection + timedelta(minutes=2), {
+                "reason": "Parking completo", "vehicle_blacklisted": False, "is_visitor": False
+            })
+            return
+
+        spot_id, spot_number, spot_type = spot
+        price_per_night = PRICES[spot_type]
+        nights = min(self._choice(self.options["stay_lengths"]), (last_day - day).days)
+        check_in = detection + timedelta(minutes=self.rng.randint(2, 15))
+        departure_day = day + timedelta(days=nights)
+        prepaid = self.rng.random() < self.options["prepay"]
+        sinpa = not prepaid and self.rng.random() < self.options["sinpa"]
+
+        stay = self._new_stay(
+            vehicle, detection, parking_spot_id=spot_id, check_in_time=check_in,
+            status=models.StayStatus.ACTIVE, user_id=staff
+        )
+        plate = vehicle["license_plate"]
+
+        if prepaid:
+            method = self._payment_method()
+            amount = nights * price_per_night
+            stay.update(
+                payment_status=models.PaymentStatus.PREPAID, prepaid_amount=amount,
+                payment_method=method, check_out_time=self._at(departure_day, 12, 12)
+            )
+            self._log(stay, "Prepayment received (check-in implícito)", check_in, {
+                "amount": amount,
+                "payment_method": method.value,
+                "check_in_time": check_in.isoformat(),
+                "check_out_time_prevista": stay["check_out_time"].isoformat(),
+                "nights_previstas": nights
+            })
+            stay["prepayment_cash_registered"] = self._pay(
+                stay, models.TransactionType.PREPAYMENT, amount, method, check_in, "Prepago", plate
+            )
+
+            # Extensión: la mañana de la salida prevista, si la plaza sigue libre
+            extended_at = self._at(departure_day, 9, 11.5)
+            if (self.rng.random() < self.options["extension"] and extended_at <= self.now
+                    and departure_day < last_day):
+                extra = min(self.rng.choice([1, 1, 2, 3, 7]), (last_day - departure_day).days)
+                extra_amount = extra * price_per_night
+                extra_method = self._payment_method()
+                original_checkout = stay["check_out_time"]
+                stay.update(prepaid_amount=amount + extra_amount,
+                            check_out_time=original_checkout + timedelta(days=extra))
+                self._log(stay, "Estancia extendida", extended_at, {
+                    "nights_added": extra,
+                    "additional_amount": extra_amount,
+                    "payment_method_extension": extra_method.value,
+                    "original_payment_method": method.value,
+                    "original_prepaid_amount": amount,
+                    "new_total_prepaid_amount": amount + extra_amount,
+                    "original_checkout": original_checkout.isoformat(),
+                    "new_checkout": stay["check_out_time"].isoformat()
+                })
+                if not self._pay(stay, models.TransactionType.PREPAYMENT, extra_amount, extra_method,
+                                 extended_at, f"Extensión +{extra} noches", plate):
+                    stay["prepayment_cash_registered"] = False
+                nights += extra
+                departure_day += timedelta(days=extra)
+        else:
+            self._log(stay, "Check-in performed", check_in, {
+                "spot_type": spot_type.value, "spot_number": spot_number, "sinpa_removed": False
+            })
+
+        self.free_at[spot_id] = departure_day
+        self.parked_until[vehicle["id"]] = departure_day
+
+        check_out = self._at(departure_day, 9, 12)
+        if check_out > self.now:
+            return  # Sigue dentro (estancia activa)
+
+        price = nights * price_per_night
+        stay.update(status=models.StayStatus.COMPLETED, check_out_time=check_out)
+
+        if sinpa:
+            stay.update(final_price=price, payment_status=models.PaymentStatus.UNPAID)
+            vehicle["is_blacklisted"] = True
+            entry = self.data.add(
+                "blacklist", vehicle_id=vehicle["id"], license_plate=plate,
+                plate_key=vehicle["plate_key"], reason="sinpa", amount_owed=price,
+                incident_date=check_out, stay_id=stay["id"], notes=None, resolved=False
+            )
+            self._log(stay, "Marked as SINPA - Added to blacklist", check_out, {
+                "reason": "sinpa", "amount_owed": price, "notes": None, "blacklist_id": entry["id"]
+            })
+            return
+
+        if prepaid:
+            method = stay["payment_method"]
+            stay.update(final_price=stay["prepaid_amount"], amount_paid=stay["prepaid_amount"],
+                        change_given=0.0, payment_status=models.PaymentStatus.PAID,
+                        cash_registered=True)
+        else:
+            method = self._payment_method()
+            stay.update(final_price=price, amount_paid=price, change_given=0.0,
+                        payment_method=method, payment_status=models.PaymentStatus.PAID)
+            stay["cash_registered"] = self._pay(
+                stay, models.TransactionType.CHECKOUT, price, method, check_out, "Checkout", plate
+            )
+
+        self._log(stay, "Check-out completed", check_out, {
+            "final_price": stay["final_price"],
+            "payment_method": method.value,
+            "check_in_time": check_in.isoformat(),
+            "check_out_time": check_out.isoformat(),
+            "nights": nights,
+            "payment_status": stay["payment_status"].value
+        })
+
+    def run(self, start_year: int, seasons: int) -> _Dataset:
+        campaigns = []
+        for year in range(start_year, start_year + seasons):
+            dates = get_campaign_dates(year)
+            if dates["start_date"] > self.today:
+                break
+            days = []
+            day = dates["start_date"]
+            while day <= min(dates["end_date"], self.today):
+                days.append(day)
+                day += timedelta(days=1)
+            campaigns.append((days, dates["end_date"]))
+
+        self._open_sessions([day for days, _ in campaigns for day in days])
+
+        for days, end_date in campaigns:
+            for day in days[:-1] if days[-1] == end_date else days:  # El último día solo hay salidas
+                mean = (self.options["arrivals"]
+                        * self.options["seasonality"].get(day.month, 0.0)
+                        * (self.options["weekend_boost"] if day.weekday() >= 4 else 1.0))
+                for _ in range(self._poisson(mean)):
+                    self._arrival(day, end_date)
+
+        # Detecciones pendientes de hoy (solo con la campaña en curso)
+        if self.today in self.sessions:
+            for _ in range(self.options["pending"]):
+                vehicle = self._vehicle(self.today)
+                if self.parked_until.get(vehicle["id"], date.min) > self.today:
+                    continue
+                self._new_stay(vehicle, self.now - timedelta(minutes=self.rng.randint(1, 90)))
+
+        self._close_sessions()
+        return self.data
+
+
+def _cash_breakdown(amount: float) -> dict:
+    """Desglose en billetes y monedas (formato de cash_breakdown)"""
+    cents = int(round(amount * 100))
+    breakdown = {}
+    for denomination in DENOMINATIONS:
+        value = int(round(float(denomination) * 100))
+        count, cents = divmod(cents, value)
+        if count:
+            breakdown[denomination] = count
+    return breakdown
+
+
+# ============================================================================
+# CARGA
+# ============================================================================
+
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, Enum):
+        return value.name  # Los Enum de SQLAlchemy guardan el NOMBRE
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _copy_rows(cursor, table: str, rows: list):
+    """COPY FROM STDIN en CSV (NULL = campo vacío sin comillas)"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+
+def _load(engine, data: _Dataset):
+    tables = models.Base.metadata.tables
+    if engine.dialect.name == "postgresql":
+        raw = engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                for table in LOAD_ORDER:
+                    if data.rows[table]:
+                        _copy_rows(cursor, table, data.rows[table])
+                    cursor.execute(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+                    )
+            raw.commit()
+        finally:
+            raw.close()
+    else:
+        with engine.begin() as conn:
+            for table in LOAD_ORDER:
+                if data.rows[table]:
+                    conn.execute(tables[table].insert(), data.rows[table])
+
+
+def _truncate(engine):
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text(f"TRUNCATE {', '.join(TRUNCATE_TABLES)} RESTART IDENTITY CASCADE"))
+        else:
+            for table in reversed(TRUNCATE_TABLES):
+                conn.execute(models.Base.metadata.tables[table].delete())
+        conn.execute(models.ParkingSpot.__table__.update().values(is_occupied=False))
+
+
+def _ensure_users_and_spots(db) -> tuple:
+    """Usuarios y plazas existentes; si no hay, los de create_users/create_parking_spots"""
+    if db.query(models.User).count() == 0:
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        for username in ("worker1", "worker2", "worker3"):
+            db.add(models.User(username=username, hashed_password=pwd_context.hash(username),
+                               role=models.UserRole.WORKER))
+        print("  ✓ Creados worker1, worker2 y worker3")
+
+    if db.query(models.ParkingSpot).count() == 0:
+        spots_config = [(models.SpotType.A, 27), (models.SpotType.B, 16), (models.SpotType.CB, 3),
+                        (models.SpotType.C, 20), (models.SpotType.CPLUS, 1)]
+        for spot_type, count in spots_config:
+            for i in range(1, count + 1):
+                db.add(models.ParkingSpot(spot_number=f"{spot_type.value}{i:02d}", spot_type=spot_type))
+        print("  ✓ Creadas las 67 plazas")
+    db.commit()
+
+    users = {u.id: u.username for u in db.query(models.User).filter(
+        models.User.is_active == True, models.User.role == models.UserRole.WORKER
+    ).order_by(models.User.id)}
+    if not users:
+        users = {u.id: u.username for u in db.query(models.User).order_by(models.User.id)}
+    spots = [(s.id, s.spot_number, s.spot_type)
+             for s in db.query(models.ParkingSpot).order_by(models.ParkingSpot.id)]
+    return users, spots
+
+
+def generate_dataset(engine, truncate: bool = False, verbose: bool = True, **options) -> dict:
+    """
+    Genera y carga las temporadas. Devuelve las filas cargadas por tabla.
+    Es el punto de entrada de los benchmarks (opciones = claves de DEFAULTS).
+    """
+    from sqlalchemy.orm import sessionmaker
+
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Opciones desconocidas: {', '.join(sorted(unknown))}")
+    options = {**DEFAULTS, **options}
+
+    models.Base.metadata.create_all(bind=engine)
+    apply_schema_updates(engine)
+    if truncate:
+        _truncate(engine)
+
+    db = sessionmaker(bind=engine)()
+    try:
+        if db.query(models.Stay.id).first() is not None:
+            raise RuntimeError("Ya hay estancias en la base de datos (usar --truncate)")
+        users, spots = _ensure_users_and_spots(db)
+        next_ids = {
+            table: (db.query(func.max(models.Base.metadata.tables[table].c.id)).scalar() or 0) + 1
+            for table in LOAD_ORDER
+        }
+    finally:
+        db.close()
+
+    start = time.perf_counter()
+    current_year = get_campaign_year(datetime.now(MADRID).date())
+    start_year = options["start_year"] or current_year - options["seasons"] + 1
+    data = _SeasonSimulator(options, users, spots, next_ids).run(start_year, options["seasons"])
+    simulated = time.perf_counter() - start
+
+    # Particiones mensuales de las temporadas generadas (PostgreSQL)
+    with engine.begin() as conn:
+        ensure_partitions(conn, first_month=date(start_year, 9, 1))
+    _load(engine, data)
+
+    # Plazas ocupadas por las estancias que siguen dentro
+    occupied = [row["parking_spot_id"] for row in data.rows["stays"]
+                if row["status"] == models.StayStatus.ACTIVE]
+    with engine.begin() as conn:
+        if occupied:
+            conn.execute(models.ParkingSpot.__table__.update().where(
+                models.ParkingSpot.id.in_(occupied)).values(is_occupied=True))
+        # Estadísticas de cliente de los vehículos (la carga masiva no pasa por crud)
+        recompute_vehicle_stats(conn)
+
+    loaded = time.perf_counter() - start - simulated
+    counts = {table: len(rows) for table, rows in data.rows.items()}
+    if verbose:
+        print(f"✓ Campañas {start_year}/{start_year + 1} a "
+              f"{start_year + options['seasons'] - 1}/{start_year + options['seasons']} "
+              f"(simulación {simulated:.1f} s, carga {loaded:.1f} s)")
+        for table, count in counts.items():
+            print(f"  {table:<20} {count:>9,}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de temporadas sintéticas")
+    parser.add_argument("--database-url", help="BD destino (por defecto DATABASE_URL)")
+    parser.add_argument("--truncate", action="store_true",
+                        help="Vaciar antes estancias, vehículos, caja e historial")
+    parser.add_argument("--seasons", type=int, default=DEFAULTS["seasons"])
+    parser.add_argument("--start-year", type=int, help="Primera campaña (2021 = 2021/2022)")
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"])
+    parser.add_argument("--arrivals", type=float, default=DEFAULTS["arrivals"],
+                        help="Llegadas por día en el mes pico")
+    parser.add_argument("--seasonality", type=lambda v: parse_weights(v, int),
+                        help="Peso por mes, p.ej. '9:0.5,10:0.8,...,6:0.3'")
+    parser.add_argument("--countries", type=parse_weights, help="'Spain:0.4,France:0.3,...'")
+    parser.add_argument("--stay-lengths", type=lambda v: parse_weights(v, int),
+                        help="Noches:peso, p.ej. '1:0.4,2:0.3,7:0.1'")
+    for name in ("prepay", "extension", "transfer", "card", "sinpa", "rental", "returning", "discard"):
+        parser.add_argument(f"--{name}", type=float, default=DEFAULTS[name],
+                            help=f"Proporción (por defecto {DEFAULTS[name]})")
+    parser.add_argument("--pending", type=int, default=DEFAULTS["pending"])
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    from app.database import engine
+
+    options = {
+        name: getattr(args, name)
+        for name in DEFAULTS
+        if getattr(args, name, None) is not None
+    }
+
+    try:
+        generate_dataset(engine, truncate=args.truncate, **options)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print("ℹ️  Reinicia el backend para recargar los índices en memoria (matrículas, lista negra)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Estadísticas de cliente de los vehículos (app/vehicle_stats.py)
+Uso:
+    docker-compose exec backend python3 rebuild_vehicle_stats.py --check
+    docker-compose exec backend python3 rebuild_vehicle_stats.py --backfill
+
+--check compara las columnas de vehicles con lo que sale de sus estancias
+y lista las diferencias (código de salida 1 si hay alguna). --backfill las
+recalcula todas en una transacción (tras restaurar un backup, importar datos
+a mano o si --check encuentra diferencias).
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import engine
+from app.vehicle_stats import check_vehicle_stats, recompute_vehicle_stats
+
+MAX_LISTED = 20
+
+
+def check() -> bool:
+    with engine.connect() as conn:
+        mismatches = check_vehicle_stats(conn)
+
+    if not mismatches:
+        print("✓ Estadísticas de cliente coherentes con las estancias")
+        return True
+
+    vehicles = {m["vehicle_id"] for m in mismatches}
+    print(f"⚠️ {len(vehicles)} vehículos con estadísticas desfasadas ({len(mismatches)} columnas)")
+    for m in mismatches[:MAX_LISTED]:
+        print(f"  {m['license_plate']:<12} {m['column']:<20} "
+              f"guardado={m['stored']!r} esperado={m['expected']!r}")
+    if len(mismatches) > MAX_LISTED:
+        print(f"  ... y {len(mismatches) - MAX_LISTED} más")
+    print("ℹ️ Ejecuta con --backfill para recalcularlas")
+    return False
+
+
+def backfill() -> bool:
+    with engine.begin() as conn:
+        updated = recompute_vehicle_stats(conn)
+    print(f"✓ Estadísticas de cliente recalculadas ({updated} vehículos)")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estadísticas de cliente de los vehículos")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--check", action="store_true", help="Comprobar sin modificar")
+    mode.add_argument("--backfill", action="store_true", help="Recalcular todos los vehículos")
+    args = parser.parse_args()
+
+    success = backfill() if args.backfill else check()
+    sys.exit(0 if success else 1)
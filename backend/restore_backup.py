@@ -4,181 +4,508 @@ Script para listar y restaurar backups de PostgreSQL
 Uso:
     # Listar backups disponibles
     docker-compose exec backend python3 restore_backup.py --list
-    
-    # Restaurar un backup específico
+
+    # Restaurar un backup específico (en BD temporal y cambio de nombre al final)
+    docker-compose exec backend python3 restore_backup.py --restore backup_20251121_093850.manifest.json
+
+    # Con 4 procesos de pg_restore
+    docker-compose exec backend python3 restore_backup.py --restore backup_20251121_093850.manifest.json --jobs 4
+
+    # Backups antiguos en SQL plano
     docker-compose exec backend python3 restore_backup.py --restore backup_20251121_093850.sql
+
+Formatos soportados (ver backup_service.py):
+    - custom (.dump.zst / .dump.gz): pg_restore -j N
+    - directory (.dir.tar.zst / .dir.tar.gz): pg_restore -j N
+    - plain (.sql, .sql.zst, .sql.gz): psql
+
+Por defecto se restaura en una BD temporal (<bd>_restore_<fecha>) y solo si
+termina bien se renombra a la BD real. La BD anterior se conserva como
+<bd>_old_<fecha> hasta que se borre a mano (o con --drop-old).
+Si pg_restore termina con errores, la BD temporal solo se activa con
+confirmación interactiva o --force; con --yes se descarta.
 """
 
 import os
+import re
 import sys
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import tempfile
 import subprocess
 import argparse
 from pathlib import Path
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Configuración
-BACKUP_DIR = Path("/app/backups/database")
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "/app/backups")) / "database"
+
+BACKUP_NAME_RE = re.compile(r"^backup_(\d{8}_\d{6})\.")
+
+# ============================================================================
+# LOCALIZAR Y LEER BACKUPS
+# ============================================================================
+
+def _backup_date(name):
+    match = BACKUP_NAME_RE.match(name)
+    if not match:
+        return "Fecha desconocida"
+    file_date = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+    return file_date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _find_backups():
+    """
+    Backups disponibles: manifiestos (backups nuevos) y .sql sueltos (antiguos).
+    Returns: lista de (nombre, formato, tamaño en bytes)
+    """
+    backups = []
+
+    for manifest_path in BACKUP_DIR.glob("backup_*.manifest.json"):
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            size = manifest.get("compressed_bytes", 0)
+            label = f"{manifest['format']}+{manifest['compression']}"
+        except Exception:
+            size, label = 0, "manifiesto ilegible"
+        backups.append((manifest_path.name, label, size))
+
+    for sql_file in BACKUP_DIR.glob("backup_*.sql"):
+        backups.append((sql_file.name, "plain", sql_file.stat().st_size))
+
+    return sorted(backups, reverse=True)
+
 
 def list_backups():
     """Listar todos los backups disponibles"""
-    print("\n" + "=" * 70)
+    print("\n" + "=" * 80)
     print("📋 BACKUPS DISPONIBLES")
-    print("=" * 70)
-    
+    print("=" * 80)
+
     if not BACKUP_DIR.exists():
         print("❌ No existe el directorio de backups")
         return
-    
-    backups = sorted(BACKUP_DIR.glob("backup_*.sql"), reverse=True)
-    
+
+    backups = _find_backups()
+
     if not backups:
         print("No hay backups disponibles")
         return
-    
-    print(f"\n{'#':<5} {'Archivo':<35} {'Tamaño':<12} {'Fecha'}")
-    print("-" * 70)
-    
-    for i, backup in enumerate(backups, 1):
-        size_mb = backup.stat().st_size / (1024 * 1024)
-        
-        # Extraer fecha del nombre
+
+    print(f"\n{'#':<5} {'Archivo':<42} {'Formato':<14} {'Tamaño':<12} {'Fecha'}")
+    print("-" * 80)
+
+    for i, (name, label, size) in enumerate(backups, 1):
+        size_mb = size / (1024 * 1024)
+        print(f"{i:<5} {name:<42} {label:<14} {size_mb:>8.2f} MB   {_backup_date(name)}")
+
+    print("\n" + "=" * 80)
+
+
+def _load_backup(filename):
+    """
+    Devuelve el manifiesto del backup (o uno equivalente para .sql antiguos).
+    Acepta el nombre del manifiesto o el del propio backup.
+    """
+    path = BACKUP_DIR / filename
+
+    if filename.endswith(".manifest.json"):
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    match = BACKUP_NAME_RE.match(filename)
+    if match:
+        manifest_path = BACKUP_DIR / f"backup_{match.group(1)}.manifest.json"
+        if manifest_path.exists():
+            return json.loads(manifest_path.read_text())
+
+    if path.exists() and filename.endswith(".sql"):
+        return {
+            "format": "plain",
+            "compression": None,
+            "dump_bytes": path.stat().st_size,
+            "compressed_bytes": path.stat().st_size,
+            "sha256": None,
+            "parts": [{"name": filename, "bytes": path.stat().st_size, "sha256": None}]
+        }
+
+    return None
+
+
+class PartsReader:
+    """
+    Lee las partes de un backup como un único flujo, comprobando el SHA-256
+    de cada parte y del total al llegar al final.
+    """
+
+    def __init__(self, manifest, on_progress=None):
+        self.parts = manifest["parts"]
+        self.expected_sha256 = manifest.get("sha256")
+        self.total_bytes = manifest.get("compressed_bytes") or 0
+        self.on_progress = on_progress
+        self.read_bytes = 0
+        self._sha256 = hashlib.sha256()
+        self._index = 0
+        self._file = None
+        self._part_hash = None
+
+    def _check_part(self):
+        expected = self.parts[self._index]["sha256"]
+        if expected and self._part_hash.hexdigest() != expected:
+            raise ValueError(f"SHA-256 incorrecto en {self.parts[self._index]['name']}: backup corrupto")
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while self._index < len(self.parts):
+            if self._file is None:
+                part_path = BACKUP_DIR / self.parts[self._index]["name"]
+                if not part_path.exists():
+                    raise FileNotFoundError(f"Falta la parte {part_path.name}")
+                self._file = open(part_path, "rb")
+                self._part_hash = hashlib.sha256()
+
+            data = self._file.read(size if size and size > 0 else 1024 * 1024)
+            if data:
+                self._part_hash.update(data)
+                self._sha256.update(data)
+                self.read_bytes += len(data)
+                if self.on_progress:
+                    self.on_progress(self.read_bytes, self.total_bytes)
+                return data
+
+            self._file.close()
+            self._file = None
+            self._check_part()
+            self._index += 1
+
+        if self.expected_sha256 and self._sha256.hexdigest() != self.expected_sha256:
+            raise ValueError("SHA-256 total incorrecto: backup corrupto")
+        return b""
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def _open_decompressed(manifest, on_progress=None):
+    """Flujo con el dump ya descomprimido (y verificado al leerlo entero)"""
+    reader = PartsReader(manifest, on_progress)
+    compression = manifest.get("compression")
+
+    if compression == "zstd":
+        if not zstandard:
+            raise RuntimeError("Backup en zstd: instala zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(reader, read_across_frames=True)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=reader, mode="rb")
+    return reader
+
+
+class Progress:
+    """Línea de progreso que se sobrescribe en la terminal"""
+
+    def __init__(self, label):
+        self.label = label
+        self.start = time.perf_counter()
+        self._last = 0
+
+    def update(self, done, total, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last < 0.5:
+            return
+        self._last = now
+        percent = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+        print(f"\r     {self.label}: {percent} ({done}/{total}) {now - self.start:6.1f}s", end="", flush=True)
+
+    def done(self):
+        print(f"\r     {self.label}: 100.0% en {time.perf_counter() - self.start:.1f}s" + " " * 20)
+
+# ============================================================================
+# POSTGRESQL
+# ============================================================================
+
+def _db_connection():
+    env = os.environ.copy()
+    env['PGPASSWORD'] = os.getenv("POSTGRES_PASSWORD", "postgres")
+    args = [
+        '-h', os.getenv("POSTGRES_HOST", "db"),
+        '-p', os.getenv("POSTGRES_PORT", "5432"),
+        '-U', os.getenv("POSTGRES_USER", "postgres"),
+    ]
+    return args, env, os.getenv("POSTGRES_DB", "parking_db")
+
+
+def _psql_admin(conn_args, env, sql, check=True):
+    """Ejecuta SQL contra la BD 'postgres' (administración)"""
+    cmd = ['psql', *conn_args, '-d', 'postgres', '-v', 'ON_ERROR_STOP=1', '-c', sql]
+    return subprocess.run(cmd, env=env, check=check, capture_output=True)
+
+
+def _terminate_connections(conn_args, env, db_name):
+    _psql_admin(conn_args, env,
+                f"SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                f"WHERE datname = '{db_name}' AND pid <> pg_backend_pid();",
+                check=False)
+
+
+def _run_pg_restore(conn_args, env, target_db, source, jobs, directory):
+    """pg_restore -j N con progreso (elementos del TOC procesados / total)"""
+    format_flag = ['-F', 'd'] if directory else ['-F', 'c']
+
+    toc = subprocess.run(['pg_restore', *format_flag, '-l', str(source)],
+                         env=env, check=True, capture_output=True, text=True)
+    total = sum(1 for line in toc.stdout.splitlines() if line and not line.startswith(';'))
+
+    cmd = ['pg_restore', *conn_args, '-d', target_db, *format_flag,
+           '-j', str(jobs), '-v', str(source)]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+
+    # Fase serie: cuenta "creating/processing". Fase paralela: el proceso
+    # principal anuncia "launching item"/"finished item" por cada elemento
+    progress = Progress("Restaurando")
+    done = 0
+    parallel = False
+    errors = []
+    for line in proc.stderr:
+        if "launching item" in line:
+            parallel = True
+        elif "finished item" in line:
+            done += 1
+        elif not parallel and re.search(r"pg_restore: (creating|processing)", line):
+            done += 1
+        elif "error" in line.lower():
+            errors.append(line.strip())
+        progress.update(min(done, total), total)
+    returncode = proc.wait()
+    progress.done()
+
+    return returncode, errors
+
+
+def _run_psql_stream(conn_args, env, target_db, stream, total_bytes):
+    """SQL plano: se alimenta psql por stdin con progreso por bytes"""
+    cmd = ['psql', *conn_args, '-d', target_db, '-q', '-v', 'ON_ERROR_STOP=1']
+    proc = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    progress = Progress("Restaurando")
+    fed = 0
+    try:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            proc.stdin.write(chunk)
+            fed += len(chunk)
+            progress.update(fed, total_bytes)
+    except BrokenPipeError:
+        pass
+    finally:
+        proc.stdin.close()
+
+    stderr = proc.stderr.read().decode(errors="replace")
+    returncode = proc.wait()
+    progress.done()
+
+    errors = [line for line in stderr.splitlines() if "ERROR" in line]
+    return returncode, errors
+
+
+def _restore_into(conn_args, env, target_db, manifest, jobs, workdir):
+    """Descomprime, verifica y restaura el backup en target_db (ya creada)"""
+    dump_format = manifest["format"]
+
+    if dump_format == "plain":
+        stream = _open_decompressed(manifest)
         try:
-            date_str = backup.stem.split('_')[1]
-            time_str = backup.stem.split('_')[2]
-            file_date = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
-            date_formatted = file_date.strftime("%Y-%m-%d %H:%M:%S")
-        except:
-            date_formatted = "Fecha desconocida"
-        
-        print(f"{i:<5} {backup.name:<35} {size_mb:>8.2f} MB   {date_formatted}")
-    
-    print("\n" + "=" * 70)
+            return _run_psql_stream(conn_args, env, target_db, stream, manifest.get("dump_bytes"))
+        finally:
+            stream.close()
+
+    # custom / directory: pg_restore -j necesita un archivo/carpeta local
+    print("     Descomprimiendo y verificando SHA-256...")
+    progress = Progress("Descomprimiendo")
+    stream = _open_decompressed(manifest, on_progress=progress.update)
+    try:
+        if dump_format == "directory":
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                tar.extractall(workdir, filter="data")
+            source = Path(workdir) / "dump"
+        else:
+            source = Path(workdir) / "backup.dump"
+            with open(source, "wb") as out:
+                shutil.copyfileobj(stream, out, 1024 * 1024)
+
+        # Leer hasta el final para que se compruebe el SHA-256 total
+        while stream.read(1024 * 1024):
+            pass
+    finally:
+        stream.close()
+    progress.done()
+
+    return _run_pg_restore(conn_args, env, target_db, source, jobs, dump_format == "directory")
+
+# ============================================================================
+# RESTAURAR
+# ============================================================================
 
-def restore_backup(filename):
-    """Restaurar un backup específico"""
-    backup_path = BACKUP_DIR / filename
-    
-    if not backup_path.exists():
+def restore_backup(filename, jobs=2, staging=True, drop_old=False, assume_yes=False, force=False):
+    """
+    Restaurar un backup específico.
+    force: activar la BD temporal aunque la restauración termine con errores
+    """
+    manifest = _load_backup(filename)
+
+    if not manifest:
         print(f"❌ Backup no encontrado: {filename}")
         print("\nUsa --list para ver backups disponibles")
         return False
-    
+
+    conn_args, env, db_name = _db_connection()
+    timestamp = datetime.now(ZoneInfo("Europe/Madrid")).strftime("%Y%m%d_%H%M%S")
+
     print("\n" + "=" * 70)
     print("⚠️  ADVERTENCIA: RESTAURAR BACKUP")
     print("=" * 70)
     print(f"Archivo: {filename}")
-    print(f"Tamaño: {backup_path.stat().st_size / (1024 * 1024):.2f} MB")
+    print(f"Formato: {manifest['format']} ({manifest.get('compression') or 'sin comprimir'})")
+    print(f"Tamaño: {(manifest.get('compressed_bytes') or 0) / (1024 * 1024):.2f} MB")
+    print(f"Modo: {'BD temporal + cambio de nombre' if staging else 'directo sobre la BD actual'}")
     print("\n⚠️  Esta operación:")
-    print("   1. BORRARÁ TODOS los datos actuales de la base de datos")
-    print("   2. Los reemplazará con los datos del backup")
-    print("   3. NO SE PUEDE DESHACER")
+    if staging:
+        print("   1. Restaura el backup en una BD temporal (la actual sigue funcionando)")
+        print(f"   2. Si todo va bien, la BD actual pasa a llamarse {db_name}_old_{timestamp}")
+        print("   3. Y la restaurada ocupa su lugar")
+    else:
+        print("   1. BORRARÁ TODOS los datos actuales de la base de datos")
+        print("   2. Los reemplazará con los datos del backup")
+        print("   3. NO SE PUEDE DESHACER")
     print("\n" + "=" * 70)
-    
+
     # Confirmación
-    confirm = input("\n¿Estás SEGURO de continuar? Escribe 'SI' para confirmar: ")
-    
-    if confirm != "SI":
-        print("❌ Operación cancelada")
-        return False
-    
-    # Configuración de BD
-    db_host = os.getenv("POSTGRES_HOST", "db")
-    db_port = os.getenv("POSTGRES_PORT", "5432")
-    db_name = os.getenv("POSTGRES_DB", "parking_db")
-    db_user = os.getenv("POSTGRES_USER", "postgres")
-    db_password = os.getenv("POSTGRES_PASSWORD", "postgres")
-    
-    env = os.environ.copy()
-    env['PGPASSWORD'] = db_password
-    
+    if not assume_yes:
+        confirm = input("\n¿Estás SEGURO de continuar? Escribe 'SI' para confirmar: ")
+
+        if confirm != "SI":
+            print("❌ Operación cancelada")
+            return False
+
+    target_db = f"{db_name}_restore_{timestamp}" if staging else db_name
+    start = time.perf_counter()
+
     try:
         print("\n🔄 Restaurando backup...")
-        
-        # Paso 1: Desconectar usuarios activos
-        print("  1. Desconectando usuarios activos...")
-        terminate_cmd = [
-            'psql',
-            '-h', db_host,
-            '-p', db_port,
-            '-U', db_user,
-            '-d', 'postgres',
-            '-c', f"SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = '{db_name}' AND pid <> pg_backend_pid();"
-        ]
-        subprocess.run(terminate_cmd, env=env, check=False, capture_output=True)
-        
-        # Paso 2: Eliminar la base de datos
-        print("  2. Eliminando base de datos actual...")
-        drop_cmd = [
-            'psql',
-            '-h', db_host,
-            '-p', db_port,
-            '-U', db_user,
-            '-d', 'postgres',
-            '-c', f"DROP DATABASE IF EXISTS {db_name};"
-        ]
-        subprocess.run(drop_cmd, env=env, check=True, capture_output=True)
-        
-        # Paso 3: Crear nueva base de datos
-        print("  3. Creando nueva base de datos...")
-        create_cmd = [
-            'psql',
-            '-h', db_host,
-            '-p', db_port,
-            '-U', db_user,
-            '-d', 'postgres',
-            '-c', f"CREATE DATABASE {db_name};"
-        ]
-        subprocess.run(create_cmd, env=env, check=True, capture_output=True)
-        
-        # Paso 4: Restaurar el backup
-        print("  4. Restaurando datos...")
-        restore_cmd = [
-            'pg_restore',
-            '-h', db_host,
-            '-p', db_port,
-            '-U', db_user,
-            '-d', db_name,
-            '-v',
-            str(backup_path)
-        ]
-        
-        result = subprocess.run(restore_cmd, env=env, capture_output=True)
-        
-        if result.returncode != 0:
-            print(f"⚠️  Algunos warnings durante la restauración (normal)")
-        
+
+        if staging:
+            print(f"  1. Creando BD temporal {target_db}...")
+            _psql_admin(conn_args, env, f'CREATE DATABASE "{target_db}";')
+        else:
+            # Paso 1: Desconectar usuarios activos
+            print("  1. Desconectando usuarios activos y recreando la base de datos...")
+            _terminate_connections(conn_args, env, db_name)
+            _psql_admin(conn_args, env, f'DROP DATABASE IF EXISTS "{db_name}";')
+            _psql_admin(conn_args, env, f'CREATE DATABASE "{db_name}";')
+
+        print(f"  2. Restaurando datos ({jobs} proceso/s)...")
+        with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as workdir:
+            returncode, errors = _restore_into(conn_args, env, target_db, manifest, jobs, workdir)
+
+        if returncode != 0:
+            print(f"⚠️  La restauración terminó con {len(errors)} error/es:")
+            for line in errors[-10:]:
+                print(f"     {line}")
+
+            if not staging:
+                print("\n❌ La restauración directa ha fallado: la BD puede estar incompleta")
+                return False
+
+            # Solo se activa una restauración con errores si alguien lo decide:
+            # --force, o confirmación interactiva (nunca con --yes a secas)
+            activate = force
+            if not activate and not assume_yes:
+                confirm = input(f"\n¿Activar igualmente la BD restaurada? (la actual sigue intacta) Escribe 'SI': ")
+                activate = confirm == "SI"
+            if not activate:
+                _psql_admin(conn_args, env, f'DROP DATABASE IF EXISTS "{target_db}";', check=False)
+                print("❌ Restauración descartada. La BD actual no se ha tocado")
+                if assume_yes:
+                    print("   Usa --force para activarla a pesar de los errores")
+                return False
+
+        if staging:
+            old_db = f"{db_name}_old_{timestamp}"
+            print(f"  3. Activando: {db_name} → {old_db}, {target_db} → {db_name}...")
+            _terminate_connections(conn_args, env, db_name)
+            _psql_admin(conn_args, env, f'ALTER DATABASE "{db_name}" RENAME TO "{old_db}";')
+            _psql_admin(conn_args, env, f'ALTER DATABASE "{target_db}" RENAME TO "{db_name}";')
+
+            if drop_old:
+                _psql_admin(conn_args, env, f'DROP DATABASE IF EXISTS "{old_db}";', check=False)
+                print(f"     BD anterior eliminada")
+            else:
+                print(f"     BD anterior conservada como {old_db}. Para borrarla:")
+                print(f"     psql -d postgres -c 'DROP DATABASE \"{old_db}\";'")
+
         print("\n" + "=" * 70)
-        print("✅ BACKUP RESTAURADO CORRECTAMENTE")
+        if returncode != 0:
+            print(f"⚠️  BACKUP RESTAURADO CON ERRORES ({time.perf_counter() - start:.1f}s)")
+        else:
+            print(f"✅ BACKUP RESTAURADO CORRECTAMENTE ({time.perf_counter() - start:.1f}s)")
         print("=" * 70)
         print("\n⚠️  Recuerda reiniciar el backend:")
         print("   docker-compose restart backend")
-        
+
         return True
-        
+
     except subprocess.CalledProcessError as e:
-        print(f"\n❌ Error restaurando backup: {e.stderr.decode()}")
-        return False
+        print(f"\n❌ Error restaurando backup: {e.stderr.decode(errors='replace') if e.stderr else e}")
     except Exception as e:
         print(f"\n❌ Error: {e}")
-        return False
+
+    if staging:
+        _psql_admin(conn_args, env, f'DROP DATABASE IF EXISTS "{target_db}";', check=False)
+        print("   La BD actual no se ha tocado")
+    return False
 
 def main():
     parser = argparse.ArgumentParser(description='Gestión de backups de PostgreSQL')
     parser.add_argument('--list', action='store_true', help='Listar backups disponibles')
-    parser.add_argument('--restore', type=str, help='Restaurar un backup específico (nombre del archivo)')
-    
+    parser.add_argument('--restore', type=str, help='Restaurar un backup específico (manifiesto o nombre del archivo)')
+    parser.add_argument('--jobs', '-j', type=int, default=int(os.getenv("RESTORE_JOBS", "2")),
+                        help='Procesos de pg_restore en paralelo (formatos custom/directory)')
+    parser.add_argument('--in-place', action='store_true',
+                        help='Borrar y restaurar directamente sobre la BD actual (sin BD temporal)')
+    parser.add_argument('--drop-old', action='store_true',
+                        help='Borrar la BD anterior tras activar la restaurada')
+    parser.add_argument('--yes', action='store_true', help='No pedir confirmación')
+    parser.add_argument('--force', action='store_true',
+                        help='Activar la BD restaurada aunque pg_restore termine con errores')
+
     args = parser.parse_args()
-    
+
     if args.list:
         list_backups()
     elif args.restore:
-        restore_backup(args.restore)
+        ok = restore_backup(args.restore, jobs=max(1, args.jobs), staging=not args.in_place,
+                            drop_old=args.drop_old, assume_yes=args.yes, force=args.force)
+        sys.exit(0 if ok else 1)
     else:
         parser.print_help()
         print("\nEjemplos:")
         print("  python3 restore_backup.py --list")
+        print("  python3 restore_backup.py --restore backup_20251121_093850.manifest.json --jobs 4")
         print("  python3 restore_backup.py --restore backup_20251121_093850.sql")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,10 +7,14 @@ echo "Configurando backups automáticos..."
 # Crear entrada de cron (cada día a las 3 AM)
 CRON_ENTRY="0 3 * * * cd /app && /usr/local/bin/python3 backup_service.py >> /app/backups/backup.log 2>&1"
 
+# Instantánea analítica en Parquet (cada día a las 3:30 AM, tras el backup)
+SNAPSHOT_ENTRY="30 3 * * * cd /app && /usr/local/bin/python3 -m app.analytics_snapshot >> /app/backups/analytics.log 2>&1"
+
 # Añadir al crontab del contenedor
-(crontab -l 2>/dev/null; echo "$CRON_ENTRY") | crontab -
+(crontab -l 2>/dev/null; echo "$CRON_ENTRY"; echo "$SNAPSHOT_ENTRY") | crontab -
 
 echo "✓ Cron configurado: Backups diarios a las 3:00 AM"
+echo "✓ Cron configurado: Instantánea analítica diaria a las 3:30 AM"
 echo "✓ Log: /app/backups/backup.log"
 
 # Iniciar cron en background
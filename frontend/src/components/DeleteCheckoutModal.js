@@ -1,6 +1,8 @@
 import React, { useState, useEffect } from 'react';
 import { Modal, Button, Alert, Form } from 'react-bootstrap';
 
+const PAGE_SIZE = 100;
+
 function DeleteCheckoutModal({ show, onHide, onDeleted }) {
   const [checkouts, setCheckouts] = useState([]);
   const [filteredCheckouts, setFilteredCheckouts] = useState([]);
@@ -8,6 +10,8 @@ function DeleteCheckoutModal({ show, onHide, onDeleted }) {
   const [error, setError] = useState(null);
   const [selectedStayId, setSelectedStayId] = useState(null);
   const [confirmDelete, setConfirmDelete] = useState(false);
+  const [hasMore, setHasMore] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   // ← NUEVO: Estado para búsqueda
   const [searchQuery, setSearchQuery] = useState('');
@@ -33,10 +37,18 @@ function DeleteCheckoutModal({ show, onHide, onDeleted }) {
     }
   }, [searchQuery, checkouts]);
 
-  const fetchRecentCheckouts = async () => {
-    setLoading(true);
+  // "Cargar más": la página siguiente empieza tras el último checkout cargado
+  const fetchRecentCheckouts = async (loadMore = false) => {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    const last = checkouts[checkouts.length - 1];
+    if (loadMore && last) {
+      params.append('before', last.check_out_time);
+      params.append('before_id', last.stay_id);
+    }
+
+    loadMore ? setLoadingMore(true) : setLoading(true);
     try {
-      const response = await fetch(`/api/stays/recent-checkouts?limit=100`, {
+      const response = await fetch(`/api/stays/recent-checkouts?${params}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem('token')}`
         }
@@ -45,14 +57,16 @@ function DeleteCheckoutModal({ show, onHide, onDeleted }) {
       if (!response.ok) throw new Error('Error al cargar checkouts');
 
       const data = await response.json();
-      setCheckouts(data);
-      setFilteredCheckouts(data);
+      const all = loadMore ? [...checkouts, ...data] : data;
+      setCheckouts(all);
+      setFilteredCheckouts(all);
+      setHasMore(data.length === PAGE_SIZE);
       setError(null);
     } catch (err) {
       setError('Error al cargar checkouts recientes');
       console.error(err);
     } finally {
-      setLoading(false);
+      loadMore ? setLoadingMore(false) : setLoading(false);
     }
   };
 
@@ -232,6 +246,18 @@ function DeleteCheckoutModal({ show, onHide, onDeleted }) {
                 ))}
               </tbody>
             </table>
+            {hasMore && (
+              <div className="text-center mb-2">
+                <Button
+                  variant="outline-secondary"
+                  size="sm"
+                  onClick={() => fetchRecentCheckouts(true)}
+                  disabled={loadingMore}
+                >
+                  {loadingMore ? 'Cargando...' : 'Cargar más checkouts'}
+                </Button>
+              </div>
+            )}
           </div>
         )}
 